@@ -0,0 +1,92 @@
+"""
+Concurrency benchmark of the HTTP/1.1 and HTTP/2 backends of ordflow.API
+
+Issues many concurrent metadata calls while allowing only a few connections per host,
+as a firewall would, against local HTTP/1.1 and HTTP/2 stand-in servers with the same
+simulated latency. HTTP/1.1 serializes requests on each connection whereas HTTP/2
+multiplexes them, so the gap grows with the number of concurrent calls.
+
+Run with:
+    python benchmarks/http2_concurrency.py --calls 200 --concurrency 32 --connections 2 --latency 0.05
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ordflow import API  # noqa: E402
+from ordflow.backends import RequestsBackend, HTTP2Backend  # noqa: E402
+from standin import StandInServer, H2StandInServer  # noqa: E402
+
+
+def run(server, backend, calls, concurrency):
+    """
+    Runs a mix of dataset searches and lookups through one API instance
+
+    Returns
+    -------
+    dict
+        Wall time, calls per second, median and 99th percentile latency, and the number
+        of connections the server accepted in total
+    """
+    api = API(server.api_key, server_url=server.url, backend=backend)
+    dset_ids = [api.dataset_create('Concurrency benchmark {}'.format(index))['id'] for index in range(8)]
+
+    def call(index):
+        t_start = time.perf_counter()
+        if index % 2:
+            api.dataset_info(dset_ids[index % len(dset_ids)])
+        else:
+            api.dataset_search('benchmark')
+        return time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(call, range(calls)))
+    wall = time.perf_counter() - t_start
+    backend.close()
+    return {'wall': wall,
+            'rate': calls / wall,
+            'p50': statistics.median(latencies),
+            'p99': latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))],
+            'connections': server.connections}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32, help="Concurrent calls in flight")
+    parser.add_argument('--connections', type=int, default=2, help="Connections allowed per host")
+    parser.add_argument('--latency', type=float, default=0.05, help="Simulated server latency in seconds")
+    parser.add_argument('--min-speedup', type=float, default=None,
+                        help="Fail unless HTTP/2 is at least this many times faster")
+    args = parser.parse_args()
+
+    results = {}
+    with StandInServer(latency=args.latency) as server:
+        results['HTTP/1.1'] = run(server, RequestsBackend(pool_maxsize=args.connections, pool_block=True),
+                                  args.calls, args.concurrency)
+    with H2StandInServer(latency=args.latency) as server:
+        results['HTTP/2'] = run(server, HTTP2Backend(max_connections=args.connections, prior_knowledge=True),
+                                args.calls, args.concurrency)
+
+    print("{} calls, {} in flight, {} connections, {:.0f} ms latency".format(
+        args.calls, args.concurrency, args.connections, args.latency * 1e3))
+    for name, result in results.items():
+        print("{:<9}: {:7.2f} s  {:8.1f} calls/s  p50 {:7.1f} ms  p99 {:7.1f} ms  {} connections".format(
+            name, result['wall'], result['rate'], result['p50'] * 1e3, result['p99'] * 1e3,
+            result['connections']))
+    speedup = results['HTTP/1.1']['wall'] / results['HTTP/2']['wall']
+    print("speedup  : {:.1f}x".format(speedup))
+    if args.min_speedup is not None and speedup < args.min_speedup:
+        print("FAIL: speedup {:.1f}x < {:.1f}x".format(speedup, args.min_speedup))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
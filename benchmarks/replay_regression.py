@@ -0,0 +1,96 @@
+"""
+Performance regression check of client-side behavior on recorded traffic
+
+"record" runs a representative workload against the local stand-in server and saves its
+traffic. "check" replays the same workload against that recording, without any server,
+and fails if the client now makes more calls or takes longer than when it was recorded.
+
+Run with:
+    python benchmarks/replay_regression.py record traffic.jsonl.gz --latency 0.01
+    python benchmarks/replay_regression.py check traffic.jsonl.gz --max-slowdown 1.2
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ordflow import API  # noqa: E402
+from ordflow.replay import Recording, RecordingBackend, ReplayBackend  # noqa: E402
+from standin import StandInServer  # noqa: E402
+
+
+def workload(api, data_dir, datasets=5, files=4):
+    """
+    Metadata-heavy session: creates datasets, uploads small files, then searches and lists them
+    """
+    dset_ids = []
+    for index in range(datasets):
+        metadata = {'Sample': {'Name': 'PZT-{}'.format(index), 'Thickness': 50 + index,
+                               'Anneal': {'Temperature': 600, 'Atmosphere': 'O2'}},
+                    'Measurement': {'Mode': 'PFM', 'Voltages': list(range(16))}}
+        dset_ids.append(api.dataset_create('Replay dataset {}'.format(index), metadata=metadata)['id'])
+    for dset_id in dset_ids:
+        for index in range(files):
+            file_path = os.path.join(data_dir, 'scan_{:03d}.txt'.format(index))
+            api.file_upload(file_path, dset_id, relative_path='raw')
+    api.dataset_search('Replay')
+    for dset_id in dset_ids:
+        api.dataset_info(dset_id)
+    api.files_search_many('scan', dset_ids, max_workers=4)
+    api.settings_get()
+    api.instrument_list()
+
+
+def make_data(data_dir, files):
+    for index in range(files):
+        with open(os.path.join(data_dir, 'scan_{:03d}.txt'.format(index)), 'w') as file_handle:
+            file_handle.write('\n'.join(str(value * index) for value in range(2000)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=['record', 'check'])
+    parser.add_argument('recording', help="Path to the recording")
+    parser.add_argument('--latency', type=float, default=0.01, help="Stand-in latency while recording")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="Scale of the recorded latencies")
+    parser.add_argument('--max-slowdown', type=float, default=1.2)
+    parser.add_argument('--max-extra-calls', type=int, default=0)
+    parser.add_argument('--datasets', type=int, default=5)
+    parser.add_argument('--files', type=int, default=4)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='ordflow-replay-')
+    try:
+        make_data(data_dir, args.files)
+        if args.mode == 'record':
+            with StandInServer(latency=args.latency) as server:
+                backend = RecordingBackend()
+                workload(API(server.api_key, server_url=server.url, backend=backend), data_dir,
+                         datasets=args.datasets, files=args.files)
+            backend.recording.save(args.recording)
+            print("Recorded {} calls over {:.3f} s to {} ({} bytes)".format(
+                len(backend.recording), backend.recording.span, args.recording,
+                os.path.getsize(args.recording)))
+            return 0
+
+        baseline = Recording.load(args.recording)
+        backend = ReplayBackend(baseline, time_scale=args.time_scale)
+        # The key is redacted in the recording and never checked during replay
+        workload(API('replay', server_url='http://replay/api/v1', backend=backend), data_dir,
+                 datasets=args.datasets, files=args.files)
+        report = backend.recording.compare(baseline, max_slowdown=args.max_slowdown,
+                                           max_extra_calls=args.max_extra_calls, time_scale=args.time_scale)
+        print(json.dumps(report, indent=2))
+        for regression in report['regressions']:
+            print("FAIL: " + regression)
+        return 1 if report['regressions'] else 0
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""
+Soak and load test of the ordflow client against the local stand-in server
+
+Drives one or more API instances from many threads for a fixed duration with a weighted
+mix of calls. The stand-in runs in a separate process so that only the client is measured.
+Every sampling interval it records the RSS, open file descriptors, open sockets and new
+connections of the client along with the p50/p99/p99.9 latency of the calls made during
+that interval. It fails when, after a warm-up, resources or tail latency grow beyond
+the given thresholds. Since CPython closes most leaked files and sockets once they are
+garbage collected, unclosed-resource warnings are counted as well.
+
+Run with:
+    python benchmarks/soak.py --duration 300 --clients 4 --threads 4 \\
+        --mix search=3,info=3,create=1,upload=2,rejected_upload=1
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ordflow import API  # noqa: E402
+
+STANDIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'standin.py')
+
+DEFAULT_MIX = 'search=3,info=3,files=2,create=1,upload=2,rejected_upload=1,settings=1'
+
+
+def rss_bytes():
+    """
+    Resident set size of this process. Falls back to the peak RSS where /proc is unavailable
+    """
+    try:
+        with open('/proc/self/statm') as file_handle:
+            return int(file_handle.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def open_descriptors():
+    """
+    Number of open file descriptors and the set of open sockets, or (None, None) where
+    descriptors cannot be listed
+    """
+    try:
+        fds = os.listdir('/proc/self/fd')
+    except OSError:
+        return None, None
+    sockets = set()
+    for fd in fds:
+        try:
+            target = os.readlink(os.path.join('/proc/self/fd', fd))
+        except OSError:
+            continue
+        if target.startswith('socket:'):
+            sockets.add(target)
+    return len(fds), sockets
+
+
+class StandInProcess(object):
+
+    def __init__(self, latency, http2=False):
+        """
+        Stand-in server in a child process, so that its memory and sockets are not counted
+        """
+        command = [sys.executable, STANDIN, '--port', '0', '--latency', str(latency)]
+        if http2:
+            command.append('--http2')
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+        # "Serving stand-in DataFlow at <url> (API key: <key>)"
+        words = self.process.stdout.readline().split()
+        self.url = words[4]
+        self.api_key = words[-1].rstrip(')')
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+        self.process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise ValueError("Unknown operations: {}. Choose from: {}".format(sorted(unknown), sorted(OPERATIONS)))
+    return mix
+
+
+class Context(object):
+    """
+    Datasets and files shared by the operations of one API instance
+    """
+
+    def __init__(self, api, data_dir):
+        self.api = api
+        self.data_dir = data_dir
+        self.dset_ids = [api.dataset_create('Soak dataset {}'.format(index))['id'] for index in range(4)]
+        # Uploads go to a dataset that is never listed, so that responses do not grow over time
+        self.sink_id = api.dataset_create('Upload sink')['id']
+
+    def data_file(self, rng):
+        return os.path.join(self.data_dir, 'soak_{}.txt'.format(rng.randrange(4)))
+
+
+OPERATIONS = {
+    'search': lambda ctx, rng: ctx.api.dataset_search('Soak'),
+    'info': lambda ctx, rng: ctx.api.dataset_info(rng.choice(ctx.dset_ids)),
+    'files': lambda ctx, rng: ctx.api.files_search('soak', dataset_id=rng.choice(ctx.dset_ids)),
+    'create': lambda ctx, rng: ctx.api.dataset_create('Extra', metadata={'Run': {'Index': rng.random()}}),
+    'upload': lambda ctx, rng: ctx.api.file_upload(ctx.data_file(rng), ctx.sink_id, relative_path='soak'),
+    # Rejected by the server, which used to leak the handle of the uploaded file
+    'rejected_upload': lambda ctx, rng: ctx.api.file_upload(ctx.data_file(rng), 10 ** 9),
+    'settings': lambda ctx, rng: ctx.api.settings_get(),
+}
+# Operations whose rejection by the server is the expected outcome
+EXPECTED_ERRORS = {'rejected_upload': ValueError}
+
+
+class Soak(object):
+
+    def __init__(self, server, clients, threads, mix, backend, seed=0):
+        self.server = server
+        self.clients = clients
+        self.threads = threads
+        self.mix = mix
+        self.backend = backend
+        self.seed = seed
+        self.samples = []
+        self.errors = {}
+        self._sockets = set()
+        self._resource_warnings = 0
+        self._showwarning = warnings.showwarning
+        self._window = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def __make_api(self):
+        backend = None
+        if self.backend == 'http2':
+            from ordflow.backends import HTTP2Backend
+            backend = HTTP2Backend(prior_knowledge=True)
+        return API(self.server.api_key, server_url=self.server.url, backend=backend)
+
+    def __drive(self, ctx, index):
+        rng = random.Random(self.seed * 1000 + index)
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        while not self._stop.is_set():
+            name = rng.choices(names, weights)[0]
+            t_start = time.perf_counter()
+            error = None
+            try:
+                OPERATIONS[name](ctx, rng)
+            except Exception as exc:
+                if not isinstance(exc, EXPECTED_ERRORS.get(name, ())):
+                    error = "{}: {}".format(name, type(exc).__name__)
+            elapsed = time.perf_counter() - t_start
+            with self._lock:
+                self._window.append(elapsed)
+                if error:
+                    self.errors[error] = self.errors.get(error, 0) + 1
+
+    def count_warning(self, message, category, *args, **kwargs):
+        """
+        Replacement for ``warnings.showwarning`` that counts unclosed files and sockets
+        """
+        if issubclass(category, ResourceWarning):
+            with self._lock:
+                self._resource_warnings += 1
+        else:
+            self._showwarning(message, category, *args, **kwargs)
+
+    def __sample(self, t_origin):
+        with self._lock:
+            latencies, self._window = sorted(self._window), []
+            resource_warnings, self._resource_warnings = self._resource_warnings, 0
+        fds, sockets = open_descriptors()
+        sample = {'t': time.perf_counter() - t_origin,
+                  'calls': len(latencies),
+                  'rss_mb': rss_bytes() / 1024 ** 2,
+                  'fds': fds,
+                  'sockets': None if sockets is None else len(sockets),
+                  # Sockets opened since the previous sample and still open, i.e. connection churn
+                  'new_connections': None if sockets is None else len(sockets - self._sockets),
+                  'resource_warnings': resource_warnings,
+                  'p50_ms': None, 'p99_ms': None, 'p999_ms': None}
+        for key, fraction in [('p50_ms', 0.5), ('p99_ms', 0.99), ('p999_ms', 0.999)]:
+            value = percentile(latencies, fraction)
+            sample[key] = None if value is None else value * 1e3
+        self.samples.append(sample)
+        self._sockets = sockets or set()
+        return sample
+
+    def run(self, duration, interval, data_dir, verbose=True):
+        apis = [self.__make_api() for _ in range(self.clients)]
+        contexts = [Context(api, data_dir) for api in apis]
+        workers = [threading.Thread(target=self.__drive, args=(contexts[index % self.clients], index), daemon=True)
+                   for index in range(self.clients * self.threads)]
+        t_origin = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        try:
+            while time.perf_counter() - t_origin < duration:
+                time.sleep(min(interval, max(0.0, duration - (time.perf_counter() - t_origin))))
+                sample = self.__sample(t_origin)
+                if verbose:
+                    print("t={t:7.1f}s calls={calls:6d} rss={rss_mb:7.1f}MB fds={fds} sockets={sockets} "
+                          "new_connections={new_connections} unclosed={resource_warnings} "
+                          "p50={p50_ms}ms p99={p99_ms}ms "
+                          "p999={p999_ms}ms".format(**{key: round(value, 1) if isinstance(value, float) else value
+                                                       for key, value in sample.items()}))
+        finally:
+            self._stop.set()
+            for worker in workers:
+                worker.join()
+            for api in apis:
+                api.close()
+        return self.samples
+
+
+def check(samples, errors, warmup, max_rss_growth, max_fd_growth, max_socket_growth, max_p99_growth,
+          max_p999, max_errors, max_resource_warnings):
+    """
+    Compares the last samples against the first samples after the warm-up
+
+    Returns
+    -------
+    list of str
+        Failures, empty if all thresholds were met
+    """
+    failures = []
+    steady = [sample for sample in samples if sample['t'] > warmup and sample['calls']]
+    if len(steady) < 2:
+        return ["Not enough samples after the warm-up; increase --duration or lower --interval"]
+    third = max(1, len(steady) // 3)
+    early, late = steady[:third], steady[-third:]
+
+    def mean(window, key):
+        values = [sample[key] for sample in window if sample[key] is not None]
+        return sum(values) / len(values) if values else None
+
+    for key, limit, unit in [('rss_mb', max_rss_growth, 'MB'), ('fds', max_fd_growth, ''),
+                             ('sockets', max_socket_growth, '')]:
+        before, after = mean(early, key), mean(late, key)
+        if before is not None and after - before > limit:
+            failures.append("{} grew by {:.1f}{} (from {:.1f} to {:.1f}), limit {}{}".format(
+                key, after - before, unit, before, after, limit, unit))
+    before, after = mean(early, 'p99_ms'), mean(late, 'p99_ms')
+    if before and after > max_p99_growth * before:
+        failures.append("p99 latency grew {:.2f}x (from {:.1f} ms to {:.1f} ms), limit {}x".format(
+            after / before, before, after, max_p99_growth))
+    worst = max(sample['p999_ms'] for sample in steady)
+    if max_p999 is not None and worst > max_p999:
+        failures.append("p99.9 latency reached {:.1f} ms, limit {} ms".format(worst, max_p999))
+    unclosed = sum(sample['resource_warnings'] for sample in samples)
+    if unclosed > max_resource_warnings:
+        failures.append("{} files or sockets were left for the garbage collector to close, limit {}".format(
+            unclosed, max_resource_warnings))
+    if sum(errors.values()) > max_errors:
+        failures.append("{} unexpected errors: {}".format(sum(errors.values()), errors))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=60, help="Seconds to run for")
+    parser.add_argument('--interval', type=float, default=5, help="Seconds between samples")
+    parser.add_argument('--warmup', type=float, default=None,
+                        help="Seconds ignored when checking growth. Default - one interval")
+    parser.add_argument('--clients', type=int, default=1, help="Concurrent API instances")
+    parser.add_argument('--threads', type=int, default=4, help="Threads per API instance")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Weighted operations. Default: " + DEFAULT_MIX)
+    parser.add_argument('--backend', choices=['requests', 'http2'], default='requests')
+    parser.add_argument('--latency', type=float, default=0.005, help="Simulated server latency in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-rss-growth', type=float, default=50, help="MB")
+    parser.add_argument('--max-fd-growth', type=int, default=20)
+    parser.add_argument('--max-socket-growth', type=int, default=10)
+    parser.add_argument('--max-p99-growth', type=float, default=2.0, help="Ratio of late to early p99")
+    parser.add_argument('--max-p999', type=float, default=None, help="Milliseconds")
+    parser.add_argument('--max-errors', type=int, default=0)
+    parser.add_argument('--max-resource-warnings', type=int, default=0,
+                        help="Unclosed files or sockets tolerated")
+    parser.add_argument('--output', help="Write the samples to this JSON file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    data_dir = tempfile.mkdtemp(prefix='ordflow-soak-')
+    for index in range(4):
+        with open(os.path.join(data_dir, 'soak_{}.txt'.format(index)), 'wb') as file_handle:
+            file_handle.write(os.urandom(1024 * (index + 1)))
+
+    with StandInProcess(args.latency, http2=args.backend == 'http2') as server:
+        soak = Soak(server, args.clients, args.threads, mix, args.backend, seed=args.seed)
+        warnings.simplefilter('always', ResourceWarning)
+        warnings.showwarning = soak.count_warning
+        samples = soak.run(args.duration, args.interval, data_dir)
+    for name in os.listdir(data_dir):
+        os.remove(os.path.join(data_dir, name))
+    os.rmdir(data_dir)
+
+    if args.output:
+        with open(args.output, 'w') as file_handle:
+            json.dump({'args': vars(args), 'samples': samples, 'errors': soak.errors}, file_handle, indent=2)
+
+    failures = check(samples, soak.errors, args.interval if args.warmup is None else args.warmup,
+                     args.max_rss_growth, args.max_fd_growth, args.max_socket_growth, args.max_p99_growth,
+                     args.max_p999, args.max_errors, args.max_resource_warnings)
+    for failure in failures:
+        print("FAIL: " + failure)
+    if not failures:
+        print("PASS: {} calls, no growth beyond thresholds".format(sum(sample['calls'] for sample in samples)))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,440 @@
+"""
+Local stand-in for the DataFlow REST API used by the ordflow benchmarks
+
+Implements just enough of the endpoints wrapped by ordflow.API to exercise the client
+without a real server. State is kept in memory.
+
+Run standalone with:
+    python benchmarks/standin.py --port 8765 [--http2]
+"""
+import argparse
+import asyncio
+from email.parser import BytesParser
+from email import policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+
+class DataFlowState(object):
+
+    def __init__(self, transfer_delay=0.0):
+        """
+        In-memory datasets, files and settings of the stand-in server
+
+        Parameters
+        ----------
+        transfer_delay : float, Optional
+            Seconds for which uploaded files are reported with a "transfer_status" of
+            "ACTIVE" before turning "SUCCEEDED". Default = 0 - no transfer status
+        """
+        self.transfer_delay = transfer_delay
+        self.transfers = {}
+        self.lock = threading.Lock()
+        self.settings = {'globus': {'destination_endpoint': '57230a10-7ba2-11e7-8c3b-22000b9923ef'},
+                         'transport': {'protocol': 'globus'}}
+        self.instruments = [{'id': 2, 'name': 'Asylum Research Cypher West', 'description': 'AFM',
+                             'instrument_type': None}]
+        self.datasets = {}
+        self.next_id = 1
+        self.requests = 0
+
+    def new_id(self):
+        with self.lock:
+            new_id = self.next_id
+            self.next_id += 1
+        return new_id
+
+    def create_dataset(self, body):
+        dset_id = self.new_id()
+        metadata = [{'id': self.new_id(), 'field_value': str(item.get('field_value')),
+                     'field_name': item.get('field_name'), 'metadata_field': None}
+                    for item in body.get('metadata_field_values_attributes', [])]
+        dataset = {'id': dset_id, 'name': body.get('name'), 'creator': {'id': 1, 'name': 'Stand-in'},
+                   'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                   'dataset_files': [], 'instrument': None, 'metadata_field_values': metadata}
+        with self.lock:
+            self.datasets[dset_id] = dataset
+        return dataset
+
+    def add_file(self, dset_id, name, length, relative_path):
+        entry = {'id': self.new_id(), 'name': name, 'file_length': length, 'file_type': '',
+                 'created_at': time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime()),
+                 'relative_path': relative_path, 'is_directory': False}
+        if self.transfer_delay:
+            entry['transfer_status'] = 'ACTIVE'
+        with self.lock:
+            self.datasets[dset_id]['dataset_files'].append(entry)
+            if self.transfer_delay:
+                self.transfers[entry['id']] = (entry, time.time() + self.transfer_delay)
+        return dict(entry)
+
+    def update_transfers(self):
+        """
+        Marks the transfers whose delay elapsed as succeeded
+        """
+        now = time.time()
+        with self.lock:
+            for file_id, (entry, finished_at) in list(self.transfers.items()):
+                if finished_at <= now:
+                    entry['transfer_status'] = 'SUCCEEDED'
+                    del self.transfers[file_id]
+
+
+def handle_request(state, api_key, prefix, method, target, headers, body=b''):
+    """
+    Answers a single request to the stand-in API, independently of the HTTP version
+
+    Parameters
+    ----------
+    state : DataFlowState
+        State of the server
+    api_key : str
+        API key that clients need to present
+    prefix : str
+        URL prefix of the API
+    method : str
+        "GET" or "POST"
+    target : str
+        Path and query string of the request
+    headers : dict
+        Request headers with lower case names
+    body : bytes, Optional
+        Body of the request
+
+    Returns
+    -------
+    status : int
+        HTTP status code
+    payload : object
+        JSON-serializable response
+    """
+    with state.lock:
+        state.requests += 1
+    if headers.get('authorization', '') != 'Bearer ' + api_key:
+        return 401, 'Unauthorized'
+
+    parts = urlsplit(target)
+    path = parts.path[len(prefix):].strip('/')
+    query = {key: vals[-1] for key, vals in parse_qs(parts.query).items()}
+
+    if path == 'user-settings':
+        if method == 'POST':
+            section, _, key = query.get('setting', '').partition('.')
+            state.settings.setdefault(section, {})[key] = query.get('value')
+        return 200, state.settings
+    if path == 'instruments':
+        return 200, state.instruments
+    match = re.fullmatch(r'instruments/(\d+)', path)
+    if match:
+        for instrument in state.instruments:
+            if instrument['id'] == int(match.group(1)):
+                return 200, instrument
+        return 404, 'Not Found'
+    if path == 'transports/globus/activation':
+        return 200, {'source_activation': {'code': 'AlreadyActivated', 'expires_in': 3600},
+                     'destination_activation': {'code': 'AlreadyActivated', 'expires_in': 3600}}
+    if path == 'transports/globus/activate':
+        return 200, {'status': 'ok'}
+    if path == 'datasets' and method == 'POST':
+        return 200, state.create_dataset(json.loads(body or b'{}'))
+    if path == 'datasets/search':
+        text = query.get('q', '').lower()
+        results = [dset for dset in list(state.datasets.values()) if text in (dset['name'] or '').lower()]
+        return 200, {'total': len(results), 'has_more': False, 'results': results}
+    match = re.fullmatch(r'datasets/(\d+)', path)
+    if match:
+        state.update_transfers()
+        dataset = state.datasets.get(int(match.group(1)))
+        if dataset is None:
+            return 404, 'Not Found'
+        return 200, dataset
+    if path == 'dataset-files/search':
+        text = query.get('q', '').lower()
+        dset_ids = [int(query['dataset_id'])] if 'dataset_id' in query else list(state.datasets)
+        results = [item for dset_id in dset_ids for item in state.datasets.get(dset_id, {}).get('dataset_files', [])
+                   if text in item['name'].lower()]
+        return 200, {'total': len(results), 'has_more': False, 'results': results}
+    if path == 'dataset-file-upload' and method == 'POST':
+        header = 'Content-Type: {}\r\n\r\n'.format(headers.get('content-type')).encode()
+        message = BytesParser(policy=policy.default).parsebytes(header + body)
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param('name', header='content-disposition')] = part
+        dset_id = int(fields['dataset_id'].get_content())
+        if dset_id not in state.datasets:
+            return 404, 'Not Found'
+        file_part = fields['file']
+        content = file_part.get_payload(decode=True) or b''
+        relative_path = fields['relative_path'].get_content() if 'relative_path' in fields else ''
+        return 200, state.add_file(dset_id, file_part.get_filename(), len(content), relative_path)
+    return 404, 'Not Found'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which would otherwise stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def _reply(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def _route(self, method):
+        body = self._body() if method == 'POST' else b''
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        headers = {key.lower(): value for key, value in self.headers.items()}
+        status, payload = handle_request(self.server.state, self.server.api_key, self.server.prefix,
+                                         method, self.path, headers, body)
+        self._reply(payload, status=status)
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+
+class StandInServer(object):
+
+    def __init__(self, host='127.0.0.1', port=0, api_key='standin-key', latency=0.0, prefix='/api/v1',
+                 transfer_delay=0.0):
+        """
+        Stand-in DataFlow server running in a background thread
+
+        Parameters
+        ----------
+        host : str, Optional
+            Interface to bind to. Default = 127.0.0.1
+        port : int, Optional
+            Port to bind to. Default - any free port
+        api_key : str, Optional
+            API key that clients need to present
+        latency : float, Optional
+            Artificial seconds of server-side latency per request. Default = 0
+        prefix : str, Optional
+            URL prefix of the API. Default = "/api/v1"
+        transfer_delay : float, Optional
+            Seconds until uploaded files are reported as transferred. Default = 0 - no transfer status
+        """
+        self.httpd = ThreadingHTTPServer((host, port), StandInHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = DataFlowState(transfer_delay=transfer_delay)
+        self.httpd.api_key = api_key
+        self.httpd.latency = latency
+        self.httpd.prefix = prefix
+        self.httpd.connections = 0
+        self.httpd.stats_lock = threading.Lock()
+        self.api_key = api_key
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}{}".format(host, port, self.httpd.prefix)
+
+    @property
+    def state(self):
+        return self.httpd.state
+
+    @property
+    def connections(self):
+        """
+        Number of TCP connections accepted so far
+        """
+        return self.httpd.connections
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class _H2Protocol(asyncio.Protocol):
+    """
+    Cleartext HTTP/2 ("h2c" with prior knowledge) connection of the stand-in server.
+    Each stream is answered by its own task so that slow responses do not block others
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.conn = None
+        self.streams = {}
+        self.window_open = {}
+
+    def connection_made(self, transport):
+        import h2.config
+        import h2.connection
+        self.transport = transport
+        with self.server.stats_lock:
+            self.server.connections += 1
+        config = h2.config.H2Configuration(client_side=False, header_encoding='utf-8')
+        self.conn = h2.connection.H2Connection(config=config)
+        self.conn.initiate_connection()
+        transport.write(self.conn.data_to_send())
+
+    def connection_lost(self, exc):
+        for event in self.window_open.values():
+            event.set()
+
+    def data_received(self, data):
+        import h2.events
+        import h2.exceptions
+        try:
+            events = self.conn.receive_data(data)
+        except h2.exceptions.ProtocolError:
+            self.transport.write(self.conn.data_to_send())
+            self.transport.close()
+            return
+        for event in events:
+            if isinstance(event, h2.events.RequestReceived):
+                self.streams[event.stream_id] = (dict(event.headers), bytearray())
+            elif isinstance(event, h2.events.DataReceived):
+                self.streams[event.stream_id][1].extend(event.data)
+                self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                headers, body = self.streams.pop(event.stream_id)
+                asyncio.ensure_future(self._respond(event.stream_id, headers, bytes(body)))
+            elif isinstance(event, h2.events.StreamReset):
+                self.streams.pop(event.stream_id, None)
+            elif isinstance(event, h2.events.WindowUpdated):
+                for waiting in self.window_open.values():
+                    waiting.set()
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self.transport.close()
+        self.transport.write(self.conn.data_to_send())
+
+    async def _respond(self, stream_id, headers, body):
+        import h2.exceptions
+        if self.server.latency:
+            await asyncio.sleep(self.server.latency)
+        status, payload = handle_request(self.server.state, self.server.api_key, self.server.prefix,
+                                         headers[':method'], headers[':path'], headers, body)
+        data = json.dumps(payload).encode()
+        try:
+            self.conn.send_headers(stream_id, [(':status', str(status)),
+                                               ('content-type', 'application/json'),
+                                               ('content-length', str(len(data)))])
+            while data:
+                window = min(self.conn.local_flow_control_window(stream_id), self.conn.max_outbound_frame_size)
+                if window <= 0:
+                    # Wait for the client to open the flow control window
+                    waiting = self.window_open[stream_id] = asyncio.Event()
+                    self.transport.write(self.conn.data_to_send())
+                    await waiting.wait()
+                    del self.window_open[stream_id]
+                    if self.transport.is_closing():
+                        return
+                    continue
+                self.conn.send_data(stream_id, data[:window])
+                data = data[window:]
+            self.conn.end_stream(stream_id)
+        except h2.exceptions.ProtocolError:
+            # The stream was reset or the connection closed meanwhile
+            return
+        self.transport.write(self.conn.data_to_send())
+
+
+class H2StandInServer(object):
+
+    def __init__(self, host='127.0.0.1', port=0, api_key='standin-key', latency=0.0, prefix='/api/v1'):
+        """
+        Stand-in DataFlow server speaking cleartext HTTP/2 with prior knowledge, running an
+        asyncio loop in a background thread. Requires the ``h2`` package
+
+        Parameters are the same as for ``StandInServer``. Latency is simulated without
+        blocking other streams, like a server that handles requests concurrently.
+        """
+        import h2  # noqa: F401
+        self.host = host
+        self.port = port
+        self.api_key = api_key
+        self.latency = latency
+        self.prefix = prefix
+        self.state = DataFlowState()
+        self.connections = 0
+        self.stats_lock = threading.Lock()
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}{}".format(self.host, self.port, self.prefix)
+
+    def _serve(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            self._loop.create_server(lambda: _H2Protocol(self), self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        ready.set()
+        self._loop.run_forever()
+        self._server.close()
+        self._loop.run_until_complete(self._server.wait_closed())
+        self._loop.close()
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stand-in DataFlow server")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--api-key', default='standin-key')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--http2', action='store_true', help="Speak cleartext HTTP/2 instead of HTTP/1.1")
+    args = parser.parse_args()
+    server_class = H2StandInServer if args.http2 else StandInServer
+    server = server_class(port=args.port, api_key=args.api_key, latency=args.latency).start()
+    print("Serving stand-in DataFlow at {} (API key: {})".format(server.url, server.api_key), flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
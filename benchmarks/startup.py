@@ -0,0 +1,107 @@
+"""
+Startup-time benchmark for the ordflow command line interface
+
+Measures how long short-lived ``ordflow`` invocations take and fails when they exceed
+the given budgets, or when "--help" starts importing heavy dependencies again.
+
+Run with:
+    python benchmarks/startup.py --repeat 10 --help-budget 0.15 --search-budget 0.5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from standin import StandInServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that must not be loaded merely to print help
+HEAVY_MODULES = ['requests', 'urllib3', 'concurrent.futures']
+
+
+def run(args, repeat, env):
+    """
+    Runs ``python -m ordflow <args>`` several times
+
+    Returns
+    -------
+    list of float
+        Wall time in seconds of each run
+    """
+    timings = []
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'ordflow'] + args, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - t_start)
+    return timings
+
+
+def run_python(repeat, env):
+    """
+    Wall times of starting a bare interpreter, for reference
+    """
+    timings = []
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], env=env, check=True)
+        timings.append(time.perf_counter() - t_start)
+    return timings
+
+
+def imported_modules(code, env):
+    """
+    Names of all modules imported while running the provided code in a fresh interpreter
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    names = set()
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            names.add(line.split('|')[-1].strip())
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--help-budget', type=float, default=0.15,
+                        help="Maximum median seconds for 'ordflow --help'")
+    parser.add_argument('--search-budget', type=float, default=0.5,
+                        help="Maximum median seconds for 'ordflow search' against a local server")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    failures = []
+
+    baseline = statistics.median(run_python(args.repeat, env))
+    help_times = run(['--help'], args.repeat, env)
+    help_median = statistics.median(help_times)
+    print("interpreter startup   : {:.1f} ms".format(baseline * 1e3))
+    print("ordflow --help        : {:.1f} ms (median of {})".format(help_median * 1e3, args.repeat))
+    if help_median > args.help_budget:
+        failures.append("'ordflow --help' took {:.3f} s > {:.3f} s".format(help_median, args.help_budget))
+
+    heavy = sorted(set(HEAVY_MODULES) & imported_modules(
+        'import sys; from ordflow import cli; sys.argv = ["ordflow", "--help"]\n'
+        'try:\n    cli.main()\nexcept SystemExit:\n    pass', env))
+    if heavy:
+        failures.append("'ordflow --help' imported: {}".format(', '.join(heavy)))
+
+    with StandInServer() as server:
+        server.state.create_dataset({'name': 'Startup benchmark dataset'})
+        search_args = ['--api-key', server.api_key, '--server-url', server.url, 'search', 'benchmark']
+        search_median = statistics.median(run(search_args, args.repeat, env))
+    print("ordflow search        : {:.1f} ms (median of {})".format(search_median * 1e3, args.repeat))
+    if search_median > args.search_budget:
+        failures.append("'ordflow search' took {:.3f} s > {:.3f} s".format(search_median, args.search_budget))
+
+    for failure in failures:
+        print("FAIL: " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
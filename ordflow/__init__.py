@@ -1,7 +1,42 @@
 """
 The ordflow package
 """
+import importlib
+
 from .__version__ import version as __version__
-from .api import API, Transport
 
-__all__ = ['__version__', 'API', 'Transport']
+# Public names and the modules providing them. Modules are only imported on first
+# access so that "import ordflow" and the command line interface start quickly
+_LAZY_ATTRS = {'API': 'api',
+               'Transport': 'api',
+               'UploadPlan': 'planner',
+               'UploadPlanner': 'planner',
+               'EndpointReadiness': 'globus',
+               'Profiler': 'profiling',
+               'Outbox': 'outbox',
+               'MultiServerAPI': 'routing',
+               'ArrayEncoder': 'encoding',
+               'Compressor': 'compression',
+               'Manifest': 'manifest',
+               'RequestsBackend': 'backends',
+               'HTTP2Backend': 'backends',
+               'HTTPError': 'backends',
+               'Pipeline': 'pipeline',
+               'RecordingBackend': 'replay',
+               'ReplayBackend': 'replay',
+               'TransferTracker': 'tracking'}
+
+__all__ = ['__version__'] + list(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        module = importlib.import_module('.' + _LAZY_ATTRS[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRS))
@@ -1,7 +1,14 @@
 from enum import Enum
 from collections.abc import MutableMapping
+import logging
 import os
-import requests
+import time
+from .metrics import ThroughputMeter
+from .encoding import ArrayEncoder
+from .backends import HTTPError, RequestsBackend
+
+
+logger = logging.getLogger(__name__)
 
 
 class Transport(Enum):
@@ -13,7 +20,7 @@ class Transport(Enum):
 
 class API(object):
 
-    def __init__(self, api_key, server_url=None):
+    def __init__(self, api_key, server_url=None, backend=None):
         """
         Creates an instance of the API class to communicate with DataFlow
 
@@ -25,6 +32,10 @@ class API(object):
         server_url : str, Optional
             URL for DataFlow server.
             Default: staging server
+        backend : ordflow.backends.HTTPBackend, Optional
+            Backend that sends the HTTP requests, e.g. ``HTTP2Backend()`` to multiplex
+            concurrent requests over a few connections.
+            Default: ``RequestsBackend()``
         """
         if not isinstance(api_key, str):
             raise TypeError("api_key should be a string. Generate this from DataFlow")
@@ -36,9 +47,49 @@ class API(object):
             self._API_URL = server_url
         else:
             self._API_URL = "https://dataflow.ornl.gov/api/v1"
-            print("Using server at: {} as default".format(self._API_URL))
+            logger.info("Using server at: {} as default".format(self._API_URL))
 
         self._API_KEY = api_key
+        self.backend = backend if backend is not None else RequestsBackend()
+        self.throughput = ThroughputMeter()
+        # Converts NumPy scalars and arrays in dataset metadata
+        self.array_encoder = ArrayEncoder()
+        # Optional ordflow.compression.Compressor applied to every file upload
+        self.compressor = None
+        # Optional ordflow.globus.EndpointReadiness that gates file uploads
+        self.endpoint_readiness = None
+
+    def close(self):
+        """
+        Releases the connections pooled by the HTTP backend
+        """
+        self.backend.close()
+
+    def profile(self, methods=None, trace_memory=True, cprofile_dir=None):
+        """
+        Starts measuring the client-side cost of calls made through this instance
+
+        Use the returned profiler as a context manager to profile only a block of calls,
+        or keep it attached for the whole session and call its ``detach`` method at the end.
+
+        Parameters
+        ----------
+        methods : list of str, optional
+            Names of methods to profile, e.g. ["dataset_create", "__flatten_dict"].
+            Default - all public methods and the internal request and metadata helpers
+        trace_memory : bool, optional
+            Whether to record allocation peaks with tracemalloc. Default = True
+        cprofile_dir : str, optional
+            Directory to write one cProfile dump per method to. Default - no cProfile
+
+        Returns
+        -------
+        ordflow.profiling.Profiler
+            Profiler whose ``report`` method summarizes where client-side time went
+        """
+        from .profiling import Profiler
+        return Profiler(methods=methods, trace_memory=trace_memory,
+                        cprofile_dir=cprofile_dir).attach(self)
 
     def __get(self, url):
         """
@@ -56,9 +107,10 @@ class API(object):
         """
         headers = {"accept": "*/*",
                    "Authorization": "Bearer " + self._API_KEY}
-        response = requests.get(url, headers=headers)
+        response = self.backend.request("GET", url, headers=headers)
         if not response.ok:
-            raise ValueError("{}: {}".format(response.reason, response.text[1:-1]))
+            raise HTTPError("{}: {}".format(response.reason, response.text[1:-1]),
+                            status_code=response.status_code, reason=response.reason)
         return response.json()
 
     def __post(self, url, headers={}, json=None, data=None, files=None):
@@ -86,12 +138,13 @@ class API(object):
         basic_headers = {"accept": "*/*",
                          "Authorization": "Bearer " + self._API_KEY}
         basic_headers.update(headers)
-        response = requests.post(url,
-                                 headers=basic_headers,
-                                 json=json, files=files,
-                                 data=data)
+        response = self.backend.request("POST", url,
+                                        headers=basic_headers,
+                                        json=json, files=files,
+                                        data=data)
         if not response.ok:
-            raise ValueError("{}: {}".format(response.reason, response.text[1:-1]))
+            raise HTTPError("{}: {}".format(response.reason, response.text[1:-1]),
+                            status_code=response.status_code, reason=response.reason)
         return response.json()
 
     @staticmethod
@@ -389,7 +442,7 @@ class API(object):
             mdlist.append({"field_name": key, "field_value": val})
         return mdlist
 
-    def dataset_create(self, title, instrument_id=0, metadata=None):
+    def dataset_create(self, title, instrument_id=0, metadata=None, array_encoder=None):
         """
         Create a new dataset
 
@@ -403,6 +456,10 @@ class API(object):
             Scientific metadata associated with this dataset.
             Metadata specified as {"param 1": value_1, "param 2": value_2}
             Nested dictionaries will be flattened with keys joined with a "-" separator
+            NumPy scalars and arrays are converted according to ``array_encoder``
+        array_encoder : ordflow.encoding.ArrayEncoder, optional
+            Policy for NumPy values in the metadata, e.g. how to summarize or chunk large arrays.
+            Default - ``self.array_encoder``, which summarizes arrays of over 1000 elements
 
         Returns
         -------
@@ -419,6 +476,7 @@ class API(object):
                 "instrument_id": instrument_id}
         if isinstance(metadata, dict):
             flat_md = self.__flatten_dict(metadata)
+            flat_md = (array_encoder or self.array_encoder).encode(flat_md)
             mdata_list = self.__mdata_dict_2_list(flat_md)
             data["metadata_field_values_attributes"] = mdata_list
 
@@ -449,7 +507,38 @@ class API(object):
         url = "%s/%s" % (self._API_URL, path)
         return self.__get(url)
 
-    def file_upload(self, file_path, dataset_id, relative_path=None, transport=None):
+    def files_search_many(self, query, dataset_ids, max_workers=8, timeout=None, max_hits=None):
+        """
+        Search for individual files across several datasets concurrently
+
+        Parameters
+        ----------
+        query : str
+            Search query
+        dataset_ids : list of int
+            Datasets to search within
+        max_workers : int, optional
+            Maximum number of concurrent queries. Default = 8
+        timeout : float, optional
+            Overall deadline in seconds. Queries still pending at the deadline are abandoned.
+            Default - no deadline
+        max_hits : int, optional
+            Stop issuing and waiting on queries once this many unique files are found.
+            Default - collect all hits
+
+        Returns
+        -------
+        dict
+            "results": de-duplicated list of files in the order they arrived,
+            "total": number of entries in "results",
+            "has_more": whether some queries were not completed or reported more results,
+            "failed": dict mapping dataset IDs to error messages
+        """
+        return search_many(self.files_search, query, dataset_ids, max_workers=max_workers, timeout=timeout,
+                           max_hits=max_hits)
+
+    def file_upload(self, file_path, dataset_id, relative_path=None, transport=None, compression=None,
+                    manifest=None):
         """
         Upload the provided file to the specified Dataset.
 
@@ -464,6 +553,17 @@ class API(object):
             Default - the file will be uploaded to the root directory of the dataset
         transport : ordflow.Transport, optional
             Transport protocol to use to transfer this specific file
+        compression : ordflow.compression.Compressor or bool, optional
+            Compressor used to compress this file while sending it, if its sampled compression
+            ratio makes that worthwhile. The original name, size and SHA-256 checksum are sent
+            along as "original_name", "original_size" and "original_sha256", so that the file
+            can be restored exactly. The checksum has to be sent before the compressed data,
+            so the file is read once more to compute it.
+            True - use a default Compressor, False - send the raw file.
+            Default - ``self.compressor``, which is None (no compression) unless set
+        manifest : ordflow.manifest.Manifest, optional
+            Manifest to record the size and checksum of this file in. The checksum is computed
+            while the file is read for the upload, so uncompressed files are only read once
 
         Returns
         -------
@@ -483,7 +583,8 @@ class API(object):
             if not isinstance(transport, Transport):
                 raise TypeError("transport should be of type ordflow.Transport")
 
-        file_handle = open(file_path, "rb")
+        if self.endpoint_readiness is not None:
+            self.endpoint_readiness.ensure_ready()
 
         form_data = {'dataset_id': dataset_id,
                      'transport': 'globus'}
@@ -493,15 +594,149 @@ class API(object):
                 raise TypeError("relative_path should be a string")
             form_data.update({'relative_path': relative_path})
 
+        if compression is None:
+            compression = self.compressor
+        elif compression is True:
+            from .compression import Compressor
+            compression = Compressor()
+
+        info = None
+        if compression and compression.should_compress(file_path):
+            from .manifest import file_checksum
+            _, original_sha256 = file_checksum(file_path)
+            file_handle, info = compression.compress(file_path)
+            upload = (info['compressed_name'], file_handle)
+            form_data.update({'compression': info['algorithm'],
+                              'original_name': info['original_name'],
+                              'original_size': info['original_size'],
+                              'original_sha256': original_sha256})
+        else:
+            file_handle = open(file_path, "rb")
+            upload = file_handle
+            if manifest is not None:
+                from .compression import HashingReader
+                upload = HashingReader(file_handle, algorithm=manifest.algorithm)
+
         """
         if transport != Transport.GLOBUS:
             print("using Globus since other file transfer adapters have not been implemented")
         """
 
-        response = self.__post(url,
-                               files={'file': file_handle},
-                               data=form_data)
-
-        file_handle.close()
+        t_start = time.time()
+        try:
+            response = self.__post(url,
+                                   files={'file': upload},
+                                   data=form_data)
+        finally:
+            # Also closed when the request fails, so long-running uploaders do not leak handles
+            file_handle.close()
+        elapsed = time.time() - t_start
+        self.throughput.record(os.path.getsize(file_path), elapsed)
+        if compression:
+            compression.record_upload(info or {'original_size': os.path.getsize(file_path)}, elapsed)
+        if manifest is not None:
+            remote = {}
+            if info is None:
+                size, checksum = upload.bytes_read, upload.hexdigest()
+            else:
+                remote = {'remote_name': info['compressed_name'], 'remote_size': info.get('compressed_size')}
+                if manifest.algorithm == 'sha256' and 'original_sha256' in info:
+                    size, checksum = info['original_size'], info['original_sha256']
+                else:
+                    from .manifest import file_checksum
+                    size, checksum = file_checksum(file_path, algorithm=manifest.algorithm)
+            manifest.add(os.path.basename(file_path), size, checksum, relative_path=relative_path,
+                         source=os.path.abspath(file_path), **remote)
 
         return response
+
+
+def search_many(search, query, dataset_ids, max_workers=8, timeout=None, max_hits=None):
+    """
+    Runs one search per dataset concurrently and merges the results, as done by
+    ``API.files_search_many``
+
+    Parameters
+    ----------
+    search : callable
+        Called as ``search(query, dataset_id=dataset_id)`` for each dataset, e.g. ``API.files_search``
+    query : str
+        Search query
+    dataset_ids : list of int
+        Datasets to search within
+    max_workers, timeout, max_hits :
+        See ``API.files_search_many``
+
+    Returns
+    -------
+    dict
+        See ``API.files_search_many``
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+
+    if not isinstance(query, str):
+        raise TypeError("query should be a non empty string")
+    if not query:
+        raise ValueError("query should be a non empty string")
+    if not isinstance(dataset_ids, (list, tuple, set)):
+        raise TypeError("dataset_ids should be a list of ints")
+    if not all(isinstance(dataset_id, int) for dataset_id in dataset_ids):
+        raise TypeError("dataset_id should be an int")
+    if any(dataset_id < 0 for dataset_id in dataset_ids):
+        raise ValueError("dataset_id should be > 0")
+    if not isinstance(max_workers, int):
+        raise TypeError("max_workers should be an int")
+    if max_workers < 1:
+        raise ValueError("max_workers should be > 1")
+    if max_hits is not None:
+        if not isinstance(max_hits, int):
+            raise TypeError("max_hits should be an int")
+        if max_hits < 1:
+            raise ValueError("max_hits should be > 1")
+
+    results = []
+    seen = set()
+    merged = {'results': results, 'total': 0, 'has_more': False, 'failed': {}}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(search, query, dataset_id=dataset_id): dataset_id
+               for dataset_id in dataset_ids}
+    done = set()
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            done.add(future)
+            dataset_id = futures[future]
+            try:
+                response = future.result()
+            except Exception as exc:
+                merged['failed'][dataset_id] = str(exc)
+                continue
+            if isinstance(response, dict):
+                merged['has_more'] |= bool(response.get('has_more'))
+                hits = response.get('results', [])
+            else:
+                hits = response
+            for hit in hits:
+                key = hit.get('id') if isinstance(hit, dict) else repr(hit)
+                if key is None:
+                    key = repr(sorted(hit.items()))
+                if key in seen:
+                    continue
+                seen.add(key)
+                results.append(hit)
+            if max_hits is not None and len(results) >= max_hits:
+                if len(results) > max_hits:
+                    merged['has_more'] = True
+                    del results[max_hits:]
+                break
+    except TimeoutError:
+        pass
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+    if len(done) < len(futures):
+        merged['has_more'] = True
+    merged['total'] = len(results)
+    return merged
@@ -0,0 +1,253 @@
+"""
+Pluggable HTTP backends that carry the requests made by ordflow.API
+"""
+import json as jsonlib
+import threading
+import time
+
+
+class HTTPResponse(object):
+
+    def __init__(self, status_code, reason, content, headers=None, elapsed=None, http_version=None):
+        """
+        Minimal response returned by every backend
+
+        Parameters
+        ----------
+        status_code : int
+            HTTP status code
+        reason : str
+            Reason phrase, e.g. "Not Found"
+        content : bytes
+            Body of the response
+        headers : dict, Optional
+            Response headers
+        elapsed : float, Optional
+            Seconds between sending the request and receiving the response
+        http_version : str, Optional
+            Protocol used, e.g. "HTTP/1.1" or "HTTP/2"
+        """
+        self.status_code = status_code
+        self.reason = reason
+        self.content = content
+        self.headers = headers or {}
+        self.elapsed = elapsed
+        self.http_version = http_version
+
+    def __repr__(self):
+        return "<HTTPResponse [{}]>".format(self.status_code)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return jsonlib.loads(self.content)
+
+
+class HTTPError(ValueError):
+
+    def __init__(self, message, status_code=None, reason=None):
+        """
+        Request that DataFlow answered with an error status
+
+        A ``ValueError`` so that existing error handling keeps working.
+
+        Parameters
+        ----------
+        message : str
+            Description of the error
+        status_code : int, Optional
+            HTTP status code of the response
+        reason : str, Optional
+            Reason phrase of the response
+        """
+        super(HTTPError, self).__init__(message)
+        self.status_code = status_code
+        self.reason = reason
+
+    @property
+    def transient(self):
+        """
+        Whether the server may accept the same request later, i.e. the status is 5xx, 408 or 429
+        """
+        return self.status_code is not None and (self.status_code >= 500 or self.status_code in (408, 429))
+
+
+class HTTPBackend(object):
+    """
+    Base class for HTTP backends. Subclasses implement ``request`` and may override ``close``
+    """
+
+    def request(self, method, url, headers=None, json=None, data=None, files=None):
+        """
+        Sends a single request
+
+        Parameters
+        ----------
+        method : str
+            "GET" or "POST"
+        url : str
+            URL for the request
+        headers : dict, optional
+            Request headers
+        json : dict, optional
+            Body to send as JSON
+        data : dict, optional
+            Key-value pairs for the form
+        files : dict, optional
+            Files to send as multipart form data, as accepted by ``requests``
+
+        Returns
+        -------
+        HTTPResponse
+            Response to the request
+
+        Raises
+        ------
+        ConnectionError
+            If the server could not be reached. Timeouts raise ``TimeoutError``
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Releases pooled connections
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RequestsBackend(HTTPBackend):
+
+    def __init__(self, pool_maxsize=10, pool_block=False, timeout=None):
+        """
+        HTTP/1.1 backend built upon ``requests``, with one pooled connection per concurrent request
+
+        Parameters
+        ----------
+        pool_maxsize : int, optional
+            Connections kept open per host. Default = 10
+        pool_block : bool, optional
+            Whether requests wait for a free connection instead of opening extra ones
+            beyond ``pool_maxsize``. Default = False
+        timeout : float, optional
+            Seconds to wait for the server. Default - wait indefinitely
+        """
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = timeout
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        ``requests.Session`` holding the connection pool, created on first use
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.pool_maxsize,
+                                                            pool_block=self.pool_block)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def request(self, method, url, headers=None, json=None, data=None, files=None):
+        response = self.session.request(method, url, headers=headers, json=json, data=data,
+                                        files=files, timeout=self.timeout)
+        return HTTPResponse(response.status_code, response.reason, response.content,
+                            headers=dict(response.headers), elapsed=response.elapsed.total_seconds(),
+                            http_version='HTTP/1.1')
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class HTTP2Backend(HTTPBackend):
+
+    def __init__(self, max_connections=2, prior_knowledge=False, timeout=None, verify=True):
+        """
+        HTTP/2 backend built upon ``httpx`` that multiplexes concurrent requests over a few connections
+
+        Requires the optional ``httpx[http2]`` package. Useful when a firewall limits the
+        number of connections per host, since concurrent calls from many threads share
+        the same connections. Requests from all threads are handed to a single event loop
+        thread, which opens the streams in order as HTTP/2 requires.
+
+        Parameters
+        ----------
+        max_connections : int, optional
+            Maximum number of connections per host. Default = 2
+        prior_knowledge : bool, optional
+            Whether to speak HTTP/2 right away over unencrypted "http://" URLs instead of
+            falling back to HTTP/1.1. Default = False
+        timeout : float, optional
+            Seconds to wait for the server. Default - wait indefinitely
+        verify : bool or str, optional
+            TLS certificate verification, as accepted by ``httpx``. Default = True
+        """
+        try:
+            import httpx
+            import h2  # noqa: F401
+        except ImportError:
+            raise ImportError("The HTTP/2 backend requires: pip install httpx[http2]")
+        import asyncio
+        self._httpx = httpx
+        self._asyncio = asyncio
+        self.max_connections = max_connections
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="ordflow-http2", daemon=True)
+        self._thread.start()
+
+        async def make_client():
+            return httpx.AsyncClient(http1=not prior_knowledge, http2=True, timeout=timeout, verify=verify,
+                                     limits=httpx.Limits(max_connections=max_connections,
+                                                         max_keepalive_connections=max_connections))
+
+        self.client = self.__run(make_client())
+
+    def __run(self, coroutine):
+        return self._asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def request(self, method, url, headers=None, json=None, data=None, files=None):
+        if self._loop.is_closed():
+            raise RuntimeError("This backend was closed")
+        if data is not None:
+            # httpx only accepts strings in form data
+            data = dict((key, str(value)) for key, value in data.items())
+        t_start = time.perf_counter()
+        try:
+            response = self.__run(self.client.request(method, url, headers=headers, json=json, data=data,
+                                                      files=files))
+        except self._httpx.TimeoutException as exc:
+            raise TimeoutError(str(exc)) from exc
+        except self._httpx.TransportError as exc:
+            # Reported like requests' connection errors, i.e. as an OSError
+            raise ConnectionError(str(exc)) from exc
+        return HTTPResponse(response.status_code, response.reason_phrase, response.content,
+                            headers=dict(response.headers), elapsed=time.perf_counter() - t_start,
+                            http_version=response.http_version)
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        self.__run(self.client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,217 @@
+"""
+Command line interface to DataFlow built upon ordflow.API
+
+Examples
+--------
+ordflow search "PZT"
+ordflow dataset create "My dataset" --metadata '{"Sample": "PZT"}'
+ordflow upload ./measurement_folder --dataset-id 12 --exclude "*.tmp"
+"""
+import argparse
+import json
+import os
+import sys
+
+
+API_KEY_ENV = 'ORDFLOW_API_KEY'
+SERVER_URL_ENV = 'ORDFLOW_SERVER_URL'
+THROUGHPUT_ENV = 'ORDFLOW_THROUGHPUT_FILE'
+
+
+def _throughput_path():
+    """
+    File keeping the recently measured upload throughput between runs, so that dry runs can estimate durations
+    """
+    return os.environ.get(THROUGHPUT_ENV) or os.path.join(os.path.expanduser('~'), '.cache', 'ordflow',
+                                                          'throughput.json')
+
+
+def _load_throughput(api):
+    path = _throughput_path()
+    if os.path.exists(path):
+        try:
+            api.throughput.load(path)
+        except (OSError, ValueError):
+            # A stale or corrupt file only costs the estimate
+            pass
+
+
+def _save_throughput(api):
+    try:
+        api.throughput.save(_throughput_path())
+    except OSError:
+        pass
+
+
+def _get_api(args):
+    """
+    Instantiates the API from command line arguments or environment variables
+    """
+    api_key = args.api_key or os.environ.get(API_KEY_ENV)
+    if not api_key:
+        raise SystemExit("An API key is required. Pass --api-key or set {}".format(API_KEY_ENV))
+    # Imported here so that "--help" and argument errors never pay for requests
+    from .api import API
+    return API(api_key, server_url=args.server_url or os.environ.get(SERVER_URL_ENV))
+
+
+def _cmd_search(args):
+    api = _get_api(args)
+    if args.files:
+        if len(args.dataset_id) > 1:
+            return api.files_search_many(args.query, args.dataset_id, max_workers=args.workers,
+                                         max_hits=args.max_hits)
+        dataset_id = args.dataset_id[0] if args.dataset_id else None
+        return api.files_search(args.query, dataset_id=dataset_id)
+    return api.dataset_search(args.query)
+
+
+def _cmd_dataset_create(args):
+    metadata = json.loads(args.metadata) if args.metadata else None
+    return _get_api(args).dataset_create(args.title, instrument_id=args.instrument_id,
+                                         metadata=metadata)
+
+
+def _cmd_dataset_info(args):
+    return _get_api(args).dataset_info(args.dataset_id)
+
+
+def _cmd_upload(args):
+    api = _get_api(args)
+    _load_throughput(api)
+    if not os.path.isdir(args.path):
+        if args.dry_run:
+            return {'files': 1, 'bytes': os.path.getsize(args.path)}
+        response = api.file_upload(args.path, args.dataset_id, relative_path=args.relative_path)
+        _save_throughput(api)
+        return response
+
+    from .planner import UploadPlanner, UploadPlan
+    if args.plan and os.path.exists(args.plan) and not args.dry_run:
+        plan = UploadPlan.load(args.plan)
+        # Filters are applied when planning, so a plan is only reused for the same upload
+        if plan.source != os.path.abspath(args.path) or plan.dataset_id != args.dataset_id or \
+                (plan.relative_path or '').strip('/') != (args.relative_path or '').strip('/'):
+            raise ValueError("{} plans uploading {} to dataset {}. Plan again with --dry-run or pass "
+                             "another --plan file".format(args.plan, plan.source, plan.dataset_id))
+    else:
+        planner = UploadPlanner(api, include=args.include, exclude=args.exclude,
+                                relative_path=args.relative_path, max_workers=args.workers,
+                                upload_workers=args.workers)
+        plan = planner.plan(args.path, args.dataset_id)
+        if args.plan:
+            plan.save(args.plan)
+    if args.dry_run:
+        return plan.summary()
+    results = plan.execute(api, max_workers=args.workers)
+    _save_throughput(api)
+    return {'uploaded': len(results['uploaded']),
+            'changed': results['changed'],
+            'failed': {path: str(exc) for path, exc in results['failed'].items()}}
+
+
+def _cmd_settings_get(args):
+    return _get_api(args).settings_get()
+
+
+def _cmd_settings_set(args):
+    return _get_api(args).settings_set(args.setting, args.value)
+
+
+def _cmd_instrument_list(args):
+    return _get_api(args).instrument_list()
+
+
+def build_parser():
+    """
+    Builds the argument parser for the ``ordflow`` command
+
+    Returns
+    -------
+    argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(prog='ordflow', description="Command line interface to ORNL's DataFlow")
+    parser.add_argument('--api-key', help="API key for DataFlow. Default - ${}".format(API_KEY_ENV))
+    parser.add_argument('--server-url', help="URL for DataFlow server. Default - ${} or the "
+                                             "central server".format(SERVER_URL_ENV))
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    search = commands.add_parser('search', help="Search for datasets or files")
+    search.add_argument('query', help="Text or date to search on")
+    search.add_argument('--files', action='store_true', help="Search for files instead of datasets")
+    search.add_argument('--dataset-id', type=int, action='append', default=[],
+                        help="Restrict file search to this dataset. Repeat to search several concurrently")
+    search.add_argument('--workers', type=int, default=8, help="Concurrent queries across datasets")
+    search.add_argument('--max-hits', type=int, help="Stop once this many files are found")
+    search.set_defaults(func=_cmd_search)
+
+    dataset = commands.add_parser('dataset', help="Create or view datasets")
+    dataset_cmds = dataset.add_subparsers(dest='dataset_command', metavar='command')
+    dataset_cmds.required = True
+    create = dataset_cmds.add_parser('create', help="Create a new dataset")
+    create.add_argument('title', help="Title for dataset")
+    create.add_argument('--instrument-id', type=int, default=0, help="Instrument ID")
+    create.add_argument('--metadata', help="Metadata as a JSON object")
+    create.set_defaults(func=_cmd_dataset_create)
+    info = dataset_cmds.add_parser('info', help="Show information about a dataset")
+    info.add_argument('dataset_id', type=int, help="ID for dataset")
+    info.set_defaults(func=_cmd_dataset_info)
+
+    upload = commands.add_parser('upload', help="Upload a file or directory to a dataset")
+    upload.add_argument('path', help="File or directory to upload")
+    upload.add_argument('--dataset-id', type=int, required=True, help="Dataset ID to upload to")
+    upload.add_argument('--relative-path', help="Directory within the dataset to place the data in")
+    upload.add_argument('--include', action='append', help="Glob pattern of files to upload. Repeatable")
+    upload.add_argument('--exclude', action='append', help="Glob pattern of files to skip. Repeatable")
+    upload.add_argument('--workers', type=int, default=4, help="Concurrent uploads")
+    upload.add_argument('--dry-run', action='store_true', help="Only report what would be uploaded")
+    upload.add_argument('--plan', help="JSON file to save the plan to, or to execute a saved plan from. "
+                                       "A saved plan keeps the filters it was made with")
+    upload.set_defaults(func=_cmd_upload)
+
+    settings = commands.add_parser('settings', help="View or change default user settings")
+    settings_cmds = settings.add_subparsers(dest='settings_command', metavar='command')
+    settings_cmds.required = True
+    settings_cmds.add_parser('get', help="Show current settings").set_defaults(func=_cmd_settings_get)
+    set_cmd = settings_cmds.add_parser('set', help="Set or update a setting")
+    set_cmd.add_argument('setting', help='Name of parameter, e.g. "globus.destination_endpoint"')
+    set_cmd.add_argument('value', help="New value for chosen parameter")
+    set_cmd.set_defaults(func=_cmd_settings_set)
+
+    instruments = commands.add_parser('instruments', help="List instruments connected to DataFlow")
+    instruments.set_defaults(func=_cmd_instrument_list)
+
+    return parser
+
+
+def main(argv=None):
+    """
+    Entry point for the ``ordflow`` command
+
+    Parameters
+    ----------
+    argv : list of str, Optional
+        Command line arguments. Default - sys.argv[1:]
+
+    Returns
+    -------
+    int
+        Exit status. 1 if the command failed, or if some of its items failed, e.g. files of
+        an upload or datasets of a file search
+    """
+    args = build_parser().parse_args(argv)
+    try:
+        response = args.func(args)
+    except (ValueError, TypeError, OSError) as exc:
+        sys.stderr.write("ordflow: error: {}\n".format(exc))
+        return 1
+    json.dump(response, sys.stdout, indent=2, default=str)
+    sys.stdout.write("\n")
+    if isinstance(response, dict) and response.get('failed'):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
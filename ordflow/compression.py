@@ -0,0 +1,346 @@
+"""
+Optional on-the-fly compression of files before they are uploaded to DataFlow
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import hashlib
+import os
+import threading
+import time
+import zlib
+
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+EXTENSIONS = {GZIP: '.gz', ZSTD: '.zst'}
+
+
+def zstd_available():
+    """
+    Checks whether the optional ``zstandard`` package is installed
+    """
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HashingReader(object):
+
+    def __init__(self, file_handle, algorithm='sha256'):
+        """
+        Wraps a binary file handle and hashes everything read through it
+
+        Parameters
+        ----------
+        file_handle : file-like
+            Binary file handle
+        algorithm : str, Optional
+            Name of a hashlib algorithm. Default = "sha256"
+        """
+        self.file_handle = file_handle
+        self.hash = hashlib.new(algorithm)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.file_handle.read(size)
+        self.hash.update(data)
+        self.bytes_read += len(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self.file_handle, name)
+
+
+class CompressedReader(object):
+
+    def __init__(self, chunks, source, info):
+        """
+        Read-only file-like object that hands out compressed data as it is produced, so that
+        a file is compressed while it is being uploaded instead of into memory beforehand
+
+        Parameters
+        ----------
+        chunks : generator of bytes
+            Compressed data, in order
+        source : HashingReader
+            Reader of the original file that ``chunks`` consumes
+        info : dict
+            Information about the file, completed with "original_sha256",
+            "compressed_size", "ratio" and "compress_seconds" once the last chunk was read
+        """
+        self.source = source
+        self.info = info
+        self.bytes_read = 0
+        self.compress_seconds = 0.0
+        self._chunks = chunks
+        self._buffer = bytearray()
+        self._finished = False
+
+    def read(self, size=-1):
+        while not self._finished and (size is None or size < 0 or len(self._buffer) < size):
+            t_start = time.perf_counter()
+            chunk = next(self._chunks, None)
+            self.compress_seconds += time.perf_counter() - t_start
+            if chunk is None:
+                self.__finish()
+            else:
+                self._buffer.extend(chunk)
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.bytes_read += len(data)
+        return data
+
+    def __finish(self):
+        self._finished = True
+        compressed_size = self.bytes_read + len(self._buffer)
+        self.info.update({'original_size': self.source.bytes_read,
+                          'original_sha256': self.source.hexdigest(),
+                          'compressed_size': compressed_size,
+                          'ratio': self.source.bytes_read / max(1, compressed_size),
+                          'compress_seconds': self.compress_seconds})
+
+    def readable(self):
+        return True
+
+    def close(self):
+        # Also stops the compression threads of a partially read file
+        self._chunks.close()
+        self.source.close()
+
+    @property
+    def closed(self):
+        return self.source.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Compressor(object):
+
+    def __init__(self, algorithm=None, level=None, min_ratio=1.2, min_size=64 * 1024, sample_blocks=4,
+                 block_size=128 * 1024, chunk_size=4 * 1024 ** 2, max_workers=4):
+        """
+        Decides whether files are worth compressing and compresses them while they are
+        read, across worker threads
+
+        Parameters
+        ----------
+        algorithm : str, Optional
+            "gzip" or "zstd". Default - "zstd" if the ``zstandard`` package is installed,
+            otherwise "gzip"
+        level : int, Optional
+            Compression level. Default - 6 for gzip, 3 for zstd
+        min_ratio : float, Optional
+            Smallest estimated compression ratio for which a file is compressed. Default = 1.2
+        min_size : int, Optional
+            Files smaller than this many bytes are never compressed. Default = 64 KiB
+        sample_blocks : int, Optional
+            Number of evenly spaced blocks sampled to estimate the compression ratio. Default = 4
+        block_size : int, Optional
+            Bytes per sampled block. Default = 128 KiB
+        chunk_size : int, Optional
+            Bytes compressed by each worker at a time. The compressor holds at most two
+            chunks per worker for each file being compressed. Default = 4 MiB
+        max_workers : int, Optional
+            Number of compression threads. Default = 4
+        """
+        if algorithm is None:
+            algorithm = ZSTD if zstd_available() else GZIP
+        if algorithm not in EXTENSIONS:
+            raise ValueError("algorithm should be one of: {}".format(list(EXTENSIONS)))
+        if algorithm == ZSTD and not zstd_available():
+            raise ImportError("zstd compression requires the zstandard package")
+        for value, title in [(sample_blocks, "sample_blocks"), (block_size, "block_size"),
+                             (chunk_size, "chunk_size"), (max_workers, "max_workers")]:
+            if not isinstance(value, int):
+                raise TypeError("{} should be an int".format(title))
+            if value < 1:
+                raise ValueError("{} should be > 0".format(title))
+        self.algorithm = algorithm
+        self.level = level if level is not None else (3 if algorithm == ZSTD else 6)
+        self.min_ratio = min_ratio
+        self.min_size = min_size
+        self.sample_blocks = sample_blocks
+        self.block_size = block_size
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "Compressor({}, level={})".format(self.algorithm, self.level)
+
+    def estimate_ratio(self, file_path):
+        """
+        Estimates how well a file compresses by compressing a few blocks sampled from it
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the file
+
+        Returns
+        -------
+        float
+            Estimated ratio of original to compressed size
+        """
+        size = os.path.getsize(file_path)
+        if size == 0:
+            return 1.0
+        if size <= self.sample_blocks * self.block_size:
+            offsets = [0]
+            block_size = size
+        else:
+            step = (size - self.block_size) // max(1, self.sample_blocks - 1)
+            offsets = [index * step for index in range(self.sample_blocks)]
+            block_size = self.block_size
+        raw = 0
+        packed = 0
+        with open(file_path, 'rb') as file_handle:
+            for offset in offsets:
+                file_handle.seek(offset)
+                block = file_handle.read(block_size)
+                raw += len(block)
+                # A fast level is enough to tell compressible data apart
+                packed += len(zlib.compress(block, 1))
+        return raw / max(1, packed)
+
+    def should_compress(self, file_path):
+        """
+        Checks whether compressing a file is likely to pay off
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the file
+
+        Returns
+        -------
+        bool
+            True if the file is large enough and its sampled compression ratio is at least ``min_ratio``
+        """
+        if os.path.getsize(file_path) < self.min_size:
+            return False
+        return self.estimate_ratio(file_path) >= self.min_ratio
+
+    def __gzip_member(self, chunk):
+        # Each chunk becomes an independent gzip member. Concatenated members form a
+        # valid gzip stream that decompresses to the original bytes
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(chunk) + compressor.flush()
+
+    def __compress_gzip(self, reader):
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                chunk = reader.read(self.chunk_size)
+                if not chunk:
+                    break
+                in_flight.append(executor.submit(self.__gzip_member, chunk))
+                # Bounds memory to a few chunks per worker
+                while len(in_flight) > 2 * self.max_workers:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def __compress_zstd(self, reader):
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=self.level, threads=self.max_workers)
+        with compressor.stream_reader(reader, read_size=self.chunk_size, closefd=False) as stream:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def compress(self, file_path):
+        """
+        Opens a file for reading in compressed form. The file is compressed while the
+        returned reader is being read, without temporary files. Memory use stays at a few
+        chunks only if the reader is consumed a piece at a time; ``RequestsBackend`` reads
+        it to the end to build the request body, which holds the whole compressed file
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the file
+
+        Returns
+        -------
+        reader : CompressedReader
+            File-like object yielding the compressed data. Close it once done
+        info : dict
+            "original_name", "original_size", "compressed_name" and "algorithm".
+            "original_sha256", "compressed_size", "ratio" and "compress_seconds" are added
+            once the reader was read to the end
+        """
+        name = os.path.basename(file_path)
+        file_handle = open(file_path, 'rb')
+        info = {'original_name': name,
+                'original_size': os.fstat(file_handle.fileno()).st_size,
+                'compressed_name': name + EXTENSIONS[self.algorithm],
+                'algorithm': self.algorithm}
+        source = HashingReader(file_handle)
+        if self.algorithm == ZSTD:
+            chunks = self.__compress_zstd(source)
+        else:
+            chunks = self.__compress_gzip(source)
+        return CompressedReader(chunks, source, info), info
+
+    def record_upload(self, info, upload_seconds):
+        """
+        Records how long the upload of a compressed (or skipped) file took
+
+        Parameters
+        ----------
+        info : dict
+            Information returned by ``compress``, or at least "original_size" for files
+            that were uploaded without compression
+        upload_seconds : float
+            Wall time of the upload
+        """
+        record = dict(info, upload_seconds=upload_seconds)
+        with self._lock:
+            self.records.append(record)
+
+    def report(self):
+        """
+        Summarizes the effect of compression on the recorded uploads
+
+        Returns
+        -------
+        dict
+            "files", "compressed_files", "original_bytes", "sent_bytes", "ratio",
+            "compress_seconds", "upload_seconds", "wire_throughput" (bytes sent per second
+            of upload), "effective_throughput" (original bytes per second of compression
+            and upload) and "throughput_gain" (effective over wire throughput)
+        """
+        with self._lock:
+            records = list(self.records)
+        original = sum(record['original_size'] for record in records)
+        sent = sum(record.get('compressed_size', record['original_size']) for record in records)
+        compress_secs = sum(record.get('compress_seconds', 0.0) for record in records)
+        upload_secs = sum(record['upload_seconds'] for record in records)
+        wire = sent / upload_secs if upload_secs else None
+        effective = original / (upload_secs + compress_secs) if upload_secs else None
+        return {'files': len(records),
+                'compressed_files': sum(1 for record in records if 'compressed_size' in record),
+                'original_bytes': original,
+                'sent_bytes': sent,
+                'ratio': original / sent if sent else None,
+                'compress_seconds': compress_secs,
+                'upload_seconds': upload_secs,
+                'wire_throughput': wire,
+                'effective_throughput': effective,
+                'throughput_gain': effective / wire if wire else None}
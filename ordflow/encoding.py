@@ -0,0 +1,230 @@
+"""
+Conversion of NumPy values in metadata into JSON-friendly values that DataFlow accepts
+
+NumPy is an optional dependency. Nothing here imports it; values are only converted when
+NumPy was already imported by the caller, since NumPy values cannot exist otherwise.
+"""
+import hashlib
+import math
+import sys
+import warnings
+
+
+SUMMARIZE = 'summarize'
+CHUNK = 'chunk'
+INLINE = 'inline'
+POLICIES = [SUMMARIZE, CHUNK, INLINE]
+
+
+class ArrayEncoder(object):
+
+    def __init__(self, policy=SUMMARIZE, max_elements=1000, chunk_size=1000, separator='-'):
+        """
+        Converts NumPy scalars and arrays within flattened metadata
+
+        NumPy scalars become native python types. Arrays with up to ``max_elements``
+        elements become (nested) lists. Larger arrays are handled according to ``policy``.
+        Lists of NumPy numbers are treated as arrays. NaN and infinite values, which JSON
+        cannot represent, become None.
+        All conversions use NumPy's vectorized routines so the cost stays linear in the
+        size of the array without visiting elements one at a time in Python.
+
+        Parameters
+        ----------
+        policy : str, Optional
+            How to handle arrays larger than ``max_elements``:
+            "summarize" - replace with "<key>-shape", "<key>-dtype", "<key>-min", "<key>-max"
+            and "<key>-sha256" fields,
+            "chunk" - split the flattened array into "<key>-0", "<key>-1", ... fields of
+            ``chunk_size`` elements along with "<key>-shape" and "<key>-dtype",
+            "inline" - always convert to a single list.
+            Default = "summarize"
+        max_elements : int, Optional
+            Largest array that is stored as a single list. Default = 1000
+        chunk_size : int, Optional
+            Elements per field when chunking. Default = 1000
+        separator : str, Optional
+            Separator between the key and the suffixes of generated fields. Default = "-"
+        """
+        if policy not in POLICIES:
+            raise ValueError("policy should be one of: {}".format(POLICIES))
+        for value, title in [(max_elements, "max_elements"), (chunk_size, "chunk_size")]:
+            if not isinstance(value, int):
+                raise TypeError("{} should be an int".format(title))
+            if value < 1:
+                raise ValueError("{} should be > 0".format(title))
+        self.policy = policy
+        self.max_elements = max_elements
+        self.chunk_size = chunk_size
+        self.separator = separator
+
+    @staticmethod
+    def __native_array(np, array):
+        """
+        Casts dtypes whose elements do not map onto JSON types to strings and replaces
+        non-finite floats with None
+        """
+        if array.dtype.kind in 'mMSc':
+            return array.astype(str)
+        if array.dtype.kind == 'f':
+            finite = np.isfinite(array)
+            if not finite.all():
+                array = array.astype(object)
+                array[~finite] = None
+        return array
+
+    @staticmethod
+    def __finite(value):
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        return value
+
+    def __summarize(self, np, key, array):
+        fields = {key + self.separator + 'shape': list(array.shape),
+                  key + self.separator + 'dtype': str(array.dtype)}
+        if array.size and array.dtype.kind in 'biuf':
+            if array.dtype.kind == 'f':
+                with warnings.catch_warnings():
+                    # All-NaN arrays are reported with a None minimum and maximum
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    low, high = np.nanmin(array), np.nanmax(array)
+            else:
+                low, high = array.min(), array.max()
+            fields[key + self.separator + 'min'] = self.__finite(low.item())
+            fields[key + self.separator + 'max'] = self.__finite(high.item())
+        if array.dtype.kind != 'O':
+            digest = hashlib.sha256(np.ascontiguousarray(array).tobytes()).hexdigest()
+            fields[key + self.separator + 'sha256'] = digest
+        return fields
+
+    def __chunk(self, np, key, array):
+        fields = {key + self.separator + 'shape': list(array.shape),
+                  key + self.separator + 'dtype': str(array.dtype)}
+        flat = self.__native_array(np, array.ravel())
+        for index, start in enumerate(range(0, flat.size, self.chunk_size)):
+            fields[key + self.separator + str(index)] = flat[start:start + self.chunk_size].tolist()
+        return fields
+
+    def encode_array(self, key, array):
+        """
+        Encodes a single NumPy array
+
+        Parameters
+        ----------
+        key : str
+            Flattened metadata key of the array
+        array : numpy.ndarray
+            Array to encode
+
+        Returns
+        -------
+        dict
+            Metadata fields replacing the array
+        """
+        np = sys.modules['numpy']
+        if array.ndim == 0:
+            return {key: self.encode_scalar(array[()])}
+        if array.size <= self.max_elements or self.policy == INLINE:
+            return {key: self.__native_array(np, array).tolist()}
+        if self.policy == CHUNK:
+            return self.__chunk(np, key, array)
+        return self.__summarize(np, key, array)
+
+    @staticmethod
+    def encode_scalar(value):
+        """
+        Converts a NumPy scalar to the equivalent python type
+
+        Parameters
+        ----------
+        value : numpy.generic
+            NumPy scalar
+
+        Returns
+        -------
+        object
+            Native python value. None for NaN and infinite values
+        """
+        if value.dtype.kind == 'S':
+            return value.decode('utf-8', 'replace')
+        if value.dtype.kind in 'mMc':
+            return str(value)
+        value = value.item()
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        return value
+
+    def encode_list(self, key, values):
+        """
+        Encodes a list or tuple holding NumPy scalars or arrays, possibly within nested lists
+
+        Parameters
+        ----------
+        key : str
+            Flattened metadata key of the list
+        values : list or tuple
+            Values to encode
+
+        Returns
+        -------
+        dict
+            Metadata fields replacing the list
+        """
+        np = sys.modules['numpy']
+        try:
+            array = np.asarray(values)
+        except ValueError:
+            # Ragged nesting
+            array = None
+        if array is not None and array.dtype.kind in 'biuf':
+            return self.encode_array(key, array)
+        # Mixed types would all be cast to strings by NumPy
+        return {key: self.__encode_items(np, values)}
+
+    def __encode_items(self, np, values):
+        items = []
+        for value in values:
+            if isinstance(value, np.generic):
+                value = self.encode_scalar(value)
+            elif isinstance(value, np.ndarray):
+                value = self.__native_array(np, value).tolist()
+            elif isinstance(value, (list, tuple)):
+                value = self.__encode_items(np, value)
+            items.append(value)
+        return items
+
+    @classmethod
+    def __holds_numpy(cls, np, values):
+        return any(isinstance(item, (np.generic, np.ndarray)) or
+                   isinstance(item, (list, tuple)) and cls.__holds_numpy(np, item)
+                   for item in values)
+
+    def encode(self, flat_dict):
+        """
+        Converts all NumPy values within flattened metadata
+
+        Parameters
+        ----------
+        flat_dict : dict
+            Metadata already flattened to a single level
+
+        Returns
+        -------
+        dict
+            Metadata with only native python values. The input is returned unchanged if it
+            holds no NumPy values
+        """
+        np = sys.modules.get('numpy')
+        if np is None:
+            return flat_dict
+        encoded = {}
+        for key, value in flat_dict.items():
+            if isinstance(value, np.ndarray):
+                encoded.update(self.encode_array(key, value))
+            elif isinstance(value, np.generic):
+                encoded[key] = self.encode_scalar(value)
+            elif isinstance(value, (list, tuple)) and self.__holds_numpy(np, value):
+                encoded.update(self.encode_list(key, value))
+            else:
+                encoded[key] = value
+        return encoded
@@ -0,0 +1,258 @@
+"""
+Cached, expiry-aware readiness checks for the Globus endpoints used by DataFlow
+"""
+import threading
+import time
+
+
+READY_CODE_PREFIXES = ('AlreadyActivated', 'AutoActivated', 'Activated')
+
+
+def activation_ready(activation):
+    """
+    Checks whether a single endpoint activation status reported by DataFlow is usable
+
+    Parameters
+    ----------
+    activation : dict
+        Activation status such as ``{'code': 'AlreadyActivated'}``
+
+    Returns
+    -------
+    bool
+        True if the endpoint can be used for transfers
+    """
+    if not isinstance(activation, dict):
+        return False
+    code = activation.get('code') or ''
+    if code.endswith('Failed'):
+        return False
+    return code.startswith(READY_CODE_PREFIXES)
+
+
+class EndpointReadiness(object):
+
+    def __init__(self, api, endpoint=None, default_ttl=600, refresh_margin=60, retry_interval=30,
+                 wait_timeout=600):
+        """
+        Checks the source and destination Globus endpoints once and caches the result
+        until shortly before the activation expires
+
+        Attach an instance to ``API.endpoint_readiness`` to make ``API.file_upload`` and
+        everything built upon it pause while the endpoints are not active.
+
+        Parameters
+        ----------
+        api : ordflow.API
+            API instance used to query the activation status
+        endpoint : str, Optional
+            UUID of the destination endpoint. Default - the default destination endpoint
+        default_ttl : float, Optional
+            Seconds for which a positive result is trusted when DataFlow does not report
+            when the activation expires. Default = 600
+        refresh_margin : float, Optional
+            Seconds before expiry at which the status is checked again. Endpoints whose
+            activation lapses within this margin are treated as expiring, i.e. not ready,
+            until a check finds them renewed. Default = 60
+        retry_interval : float, Optional
+            Seconds between checks while the endpoints are not active, and the shortest
+            interval between any two background checks. Default = 30
+        wait_timeout : float, Optional
+            Maximum seconds ``ensure_ready`` blocks for. None blocks until the endpoints
+            are active. Default = 600
+        """
+        self.api = api
+        self.endpoint = endpoint
+        self.default_ttl = default_ttl
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.wait_timeout = wait_timeout
+
+        self.status = None
+        self.checked_at = None
+        self.expires_at = None
+        self.num_checks = 0
+
+        self._ready = threading.Event()
+        self._check_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return "EndpointReadiness(ready={}, expires_in={})".format(self.is_ready, self.expires_in)
+
+    @property
+    def expires_in(self):
+        """
+        Seconds until the cached result goes stale or None if never checked
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    @property
+    def is_ready(self):
+        """
+        Whether the endpoints were active at the last check and are not about to expire.
+        Does not contact the server
+        """
+        expires_in = self.expires_in
+        return self._ready.is_set() and expires_in is not None and expires_in > self.refresh_margin
+
+    def __lifetime(self, response):
+        """
+        Seconds until the reported activations lapse
+        """
+        lifetimes = []
+        for activation in response.values():
+            if isinstance(activation, dict):
+                expires_in = activation.get('expires_in')
+                if isinstance(expires_in, (int, float)) and expires_in >= 0:
+                    lifetimes.append(expires_in)
+        return min(lifetimes) if lifetimes else self.default_ttl
+
+    def check(self):
+        """
+        Queries DataFlow for the activation status of both endpoints and updates the cache.
+        Concurrent callers share a single request
+
+        Returns
+        -------
+        bool
+            True if both endpoints are active for longer than ``refresh_margin``
+
+        Raises
+        ------
+        ValueError
+            If the response is not shaped like ``{name: {'code': ..., 'expires_in': ...}}``
+        """
+        started = time.time()
+        with self._check_lock:
+            if self.checked_at is not None and self.checked_at >= started:
+                return self._ready.is_set()
+            response = self.api.globus_endpoints_active(endpoint=self.endpoint)
+            self.num_checks += 1
+            self.status = response
+            self.checked_at = time.time()
+            if not isinstance(response, dict) or not response or \
+                    not all(isinstance(activation, dict) and isinstance(activation.get('code'), str)
+                            for activation in response.values()):
+                # Never mistaken for "not active yet", which would block uploads until the timeout
+                self.invalidate()
+                raise ValueError("Unrecognized Globus activation status: {}".format(response))
+            lifetime = self.__lifetime(response)
+            ready = lifetime > max(0, self.refresh_margin) and \
+                all(activation_ready(activation) for activation in response.values())
+            if ready:
+                self.expires_at = self.checked_at + lifetime
+                self._ready.set()
+            else:
+                self.expires_at = self.checked_at + self.retry_interval
+                self._ready.clear()
+        return ready
+
+    def invalidate(self):
+        """
+        Forgets the cached result, e.g. after a transfer failed because of an expired activation
+        """
+        self._ready.clear()
+        self.expires_at = None
+
+    def wait_ready(self, timeout=None):
+        """
+        Blocks until the endpoints are active
+
+        Parameters
+        ----------
+        timeout : float, Optional
+            Maximum seconds to wait. Default - wait indefinitely
+
+        Returns
+        -------
+        bool
+            True if the endpoints are active, False if the timeout elapsed first
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self.is_ready:
+                return True
+            expires_in = self.expires_in
+            if expires_in is None or expires_in <= 0 or self._ready.is_set():
+                # Never checked, stale or expiring
+                if self.check():
+                    return True
+                expires_in = self.expires_in
+            # None if invalidated meanwhile, e.g. after a failed transfer
+            remaining = self.retry_interval if expires_in is None else expires_in
+            if deadline is not None:
+                remaining = min(remaining, deadline - time.time())
+                if remaining <= 0:
+                    return False
+            # Woken early if the background refresher finds the endpoints active
+            self._ready.wait(remaining)
+
+    def ensure_ready(self):
+        """
+        Blocks for up to ``wait_timeout`` until the endpoints are active
+
+        Raises
+        ------
+        RuntimeError
+            If the endpoints did not become active in time
+        """
+        if not self.wait_ready(timeout=self.wait_timeout):
+            raise RuntimeError("Globus endpoints are not active: {}".format(self.status))
+
+    def start(self):
+        """
+        Starts re-checking the endpoints in the background shortly before the cached result
+        expires, and periodically while they are not active
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.__refresh_loop, name="ordflow-globus-readiness",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background refresher
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __refresh_loop(self):
+        while not self._stop.is_set():
+            expires_in = self.expires_in
+            if expires_in is None:
+                delay = 0
+            elif not self._ready.is_set():
+                delay = expires_in
+            elif expires_in > self.refresh_margin:
+                delay = expires_in - self.refresh_margin
+            else:
+                # Expiring: uploads wait until a check finds the activation renewed
+                self._ready.clear()
+                delay = 0
+            if self.checked_at is not None:
+                delay = max(delay, self.checked_at + self.retry_interval - time.time())
+            if self._stop.wait(delay):
+                return
+            try:
+                self.check()
+            except Exception:
+                # Network hiccups are retried after the regular interval. Updated together so that
+                # waiters never see the result invalidated without a retry time
+                with self._check_lock:
+                    self._ready.clear()
+                    self.expires_at = time.time() + self.retry_interval
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
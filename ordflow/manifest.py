@@ -0,0 +1,267 @@
+"""
+Checksum manifests of uploaded files and verification against the contents of a dataset
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import hashlib
+import json
+import mmap
+import os
+import posixpath
+import threading
+
+from .planner import UploadPlanner, UploadPlan, matches_filters, destination_path
+
+
+def file_checksum(file_path, algorithm='sha256', block_size=16 * 1024 ** 2):
+    """
+    Computes the checksum of a file through a memory map, in large blocks
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the file
+    algorithm : str, Optional
+        Name of a hashlib algorithm. Default = "sha256"
+    block_size : int, Optional
+        Bytes hashed at a time. Default = 16 MiB
+
+    Returns
+    -------
+    size : int
+        Size of the file in bytes
+    checksum : str
+        Hexadecimal digest
+    """
+    digest = hashlib.new(algorithm)
+    with open(file_path, 'rb') as file_handle:
+        size = os.fstat(file_handle.fileno()).st_size
+        if size:
+            # hashlib releases the GIL on large buffers, so files hash in parallel across threads
+            with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    for start in range(0, size, block_size):
+                        digest.update(view[start:start + block_size])
+    return size, digest.hexdigest()
+
+
+def _bounded_map(func, items, max_workers):
+    """
+    Like ``ThreadPoolExecutor.map`` but only keeps a few tasks per worker in flight,
+    so that millions of items do not turn into millions of pending futures
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for item in items:
+            in_flight.append(executor.submit(func, item))
+            if len(in_flight) >= 4 * max_workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+class Manifest(object):
+
+    def __init__(self, algorithm='sha256'):
+        """
+        Sizes and checksums of files, keyed by their location within a dataset
+
+        Parameters
+        ----------
+        algorithm : str, Optional
+            Name of the hashlib algorithm used for checksums. Default = "sha256"
+        """
+        hashlib.new(algorithm)
+        self.algorithm = algorithm
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return "Manifest({} files, {})".format(len(self.entries), self.algorithm)
+
+    @staticmethod
+    def key(name, relative_path=None):
+        """
+        Location of a file within a dataset, e.g. "foo/bar/measurement.txt"
+        """
+        relative_path = (relative_path or '').strip('/')
+        return posixpath.join(relative_path, name) if relative_path else name
+
+    def add(self, name, size, checksum, relative_path=None, source=None, remote_name=None,
+            remote_size=None):
+        """
+        Adds or replaces the entry of a single file
+
+        Parameters
+        ----------
+        name : str
+            Name of the file
+        size : int
+            Size of the original file in bytes
+        checksum : str
+            Hexadecimal checksum of the original file
+        relative_path : str, Optional
+            Directory within the dataset holding the file. Default - root of the dataset
+        source : str, Optional
+            Local path the file was read from
+        remote_name : str, Optional
+            Name the file was stored under if it differs from ``name``, e.g. when compressed
+        remote_size : int, Optional
+            Size of the stored file if it differs from ``size``, e.g. when compressed
+        """
+        remote_name = remote_name or name
+        entry = {'name': name, 'relative_path': (relative_path or '').strip('/'), 'size': size,
+                 'checksum': checksum, 'source': source, 'remote_name': remote_name,
+                 'remote_size': size if remote_size is None else remote_size}
+        with self._lock:
+            self.entries[self.key(remote_name, relative_path)] = entry
+
+    def add_file(self, file_path, relative_path=None):
+        """
+        Hashes a local file and adds it to the manifest
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the file
+        relative_path : str, Optional
+            Directory within the dataset the file is uploaded to
+
+        Returns
+        -------
+        dict
+            The new entry
+        """
+        size, checksum = file_checksum(file_path, algorithm=self.algorithm)
+        self.add(os.path.basename(file_path), size, checksum, relative_path=relative_path,
+                 source=os.path.abspath(file_path))
+        return self.entries[self.key(os.path.basename(file_path), relative_path)]
+
+    @classmethod
+    def build(cls, source, relative_path=None, include=None, exclude=None, algorithm='sha256',
+              max_workers=8):
+        """
+        Hashes every file of a directory in parallel, using the same filters and
+        ``relative_path`` mapping as ``UploadPlanner``
+
+        Parameters
+        ----------
+        source : str or ordflow.UploadPlan
+            Directory to hash, or a plan whose uploads should be hashed
+        relative_path : str, Optional
+            Directory within the dataset under which the source directory is placed
+        include : list of str, Optional
+            Glob patterns of files to include. Default - all files
+        exclude : list of str, Optional
+            Glob patterns of files to leave out
+        algorithm : str, Optional
+            Name of the hashlib algorithm. Default = "sha256"
+        max_workers : int, Optional
+            Number of files hashed concurrently. Default = 8
+
+        Returns
+        -------
+        Manifest
+        """
+        manifest = cls(algorithm=algorithm)
+        if isinstance(source, UploadPlan):
+            jobs = [(entry['path'], entry['relative_path']) for entry in source.uploads]
+        else:
+            source = os.path.abspath(source)
+            planner = UploadPlanner(max_workers=max_workers)
+            jobs = []
+            for path, _, _, error in planner.scan(source):
+                rel_path = os.path.relpath(path, source).replace(os.sep, '/')
+                if error is None and matches_filters(rel_path, include=include, exclude=exclude):
+                    jobs.append((path, destination_path(rel_path, relative_path)))
+
+        for _ in _bounded_map(lambda job: manifest.add_file(*job), jobs, max_workers):
+            pass
+        return manifest
+
+    def save(self, file_path):
+        """
+        Writes the manifest as JSON lines: a header line followed by one line per file
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the manifest file
+        """
+        with open(file_path, 'w') as file_handle:
+            file_handle.write(json.dumps({'algorithm': self.algorithm, 'files': len(self.entries)}) + '\n')
+            for entry in self.entries.values():
+                file_handle.write(json.dumps(entry) + '\n')
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Reads a manifest written by ``save``
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the manifest file
+
+        Returns
+        -------
+        Manifest
+        """
+        with open(file_path, 'r') as file_handle:
+            header = json.loads(file_handle.readline())
+            manifest = cls(algorithm=header['algorithm'])
+            for line in file_handle:
+                entry = json.loads(line)
+                manifest.entries[cls.key(entry['remote_name'], entry['relative_path'])] = entry
+        return manifest
+
+    def verify(self, api, dataset_id):
+        """
+        Compares the manifest against the files DataFlow lists for a dataset
+
+        Sizes are always compared. Checksums are compared as well when DataFlow reports
+        one computed with the same algorithm.
+
+        Parameters
+        ----------
+        api : ordflow.API
+            API instance used to list the dataset
+        dataset_id : int
+            ID of the dataset the files were uploaded to
+
+        Returns
+        -------
+        dict
+            "matched": number of files that arrived intact,
+            "missing": keys of files in the manifest but not in the dataset,
+            "extra": keys of files in the dataset but not in the manifest,
+            "mismatched": dict mapping keys to {"expected": ..., "found": ...}
+        """
+        listing = api.dataset_info(dataset_id).get('dataset_files', [])
+        remote = {}
+        for item in listing:
+            if item.get('is_directory'):
+                continue
+            remote[self.key(item.get('name'), item.get('relative_path'))] = item
+
+        report = {'matched': 0, 'missing': [], 'extra': [], 'mismatched': {}}
+        for key, entry in self.entries.items():
+            item = remote.pop(key, None)
+            if item is None:
+                report['missing'].append(key)
+                continue
+            found = {'size': item.get('file_length')}
+            expected = {'size': entry['remote_size']}
+            remote_checksum = item.get(self.algorithm)
+            if remote_checksum and entry['remote_size'] == entry['size']:
+                found['checksum'] = remote_checksum
+                expected['checksum'] = entry['checksum']
+            if found == expected:
+                report['matched'] += 1
+            else:
+                report['mismatched'][key] = {'expected': expected, 'found': found}
+        report['extra'] = sorted(remote)
+        return report
@@ -0,0 +1,206 @@
+"""
+Lightweight client-side measurements shared by the ordflow tools
+"""
+from collections import deque
+import json
+import os
+import threading
+
+
+class ThroughputMeter(object):
+
+    def __init__(self, window=32):
+        """
+        Keeps track of recently measured transfer throughput
+
+        Each transfer is modelled as a fixed per-file overhead, e.g. request latency,
+        followed by the bytes flowing at a steady rate. Both are fitted to the recent
+        transfers so that estimates hold for many small files as well as a few large ones.
+
+        Parameters
+        ----------
+        window : int, Optional
+            Number of most recent transfers considered when computing the rate.
+            Default = 32
+        """
+        if not isinstance(window, int):
+            raise TypeError("window should be an int")
+        if window < 1:
+            raise ValueError("window should be > 0")
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, num_bytes, seconds):
+        """
+        Records a single completed transfer
+
+        Parameters
+        ----------
+        num_bytes : int
+            Number of bytes transferred
+        seconds : float
+            Wall time taken for the transfer
+        """
+        if seconds <= 0:
+            return
+        with self._lock:
+            self._samples.append((num_bytes, seconds))
+
+    def fit(self):
+        """
+        Fits the per-file overhead and the transfer rate to the recent transfers
+
+        Returns
+        -------
+        tuple or None
+            (overhead in seconds per file, rate in bytes per second) or None if nothing
+            was measured yet. The overhead is 0 until transfers of different sizes were seen
+        """
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return None
+        total_bytes = sum(sample[0] for sample in samples)
+        total_secs = sum(sample[1] for sample in samples)
+        mean_bytes = total_bytes / len(samples)
+        mean_secs = total_secs / len(samples)
+        variance = sum((sample[0] - mean_bytes) ** 2 for sample in samples)
+        if variance > 0:
+            # Least squares fit of seconds = overhead + bytes / rate
+            slope = sum((sample[0] - mean_bytes) * (sample[1] - mean_secs) for sample in samples) / variance
+            overhead = mean_secs - slope * mean_bytes
+            if slope > 0 and overhead >= 0:
+                return overhead, 1 / slope
+            if slope <= 0:
+                # Sizes do not explain the timings, e.g. all files were small
+                return mean_secs, float('inf')
+        if total_bytes == 0:
+            return mean_secs, float('inf')
+        return 0.0, total_bytes / total_secs
+
+    @property
+    def rate(self):
+        """
+        Fitted bytes per second, excluding per-file overheads, or None if nothing was measured yet
+        """
+        fitted = self.fit()
+        return None if fitted is None else fitted[1]
+
+    @property
+    def seconds_per_file(self):
+        """
+        Fitted per-file overhead in seconds or None if nothing was measured yet
+        """
+        fitted = self.fit()
+        return None if fitted is None else fitted[0]
+
+    def estimate(self, num_bytes, num_files=0, concurrency=1):
+        """
+        Estimates the time needed to transfer the provided volume of data
+
+        Parameters
+        ----------
+        num_bytes : int
+            Total number of bytes to transfer
+        num_files : int, Optional
+            Number of files carrying these bytes. Each adds the fitted per-file overhead
+        concurrency : int, Optional
+            Number of files transferred at once, e.g. ``max_workers`` of
+            ``UploadPlan.execute``. The measured rate is per transfer, so it already
+            reflects the bandwidth shared at the concurrency it was measured with. Default = 1
+
+        Returns
+        -------
+        float or None
+            Estimated seconds or None if no throughput has been measured yet
+        """
+        if not isinstance(concurrency, int):
+            raise TypeError("concurrency should be an int")
+        if concurrency < 1:
+            raise ValueError("concurrency should be > 0")
+        fitted = self.fit()
+        if fitted is None:
+            return None
+        overhead, rate = fitted
+        if rate == 0:
+            return float('inf')
+        work = num_files * overhead + num_bytes / rate
+        return work / max(1, min(concurrency, num_files))
+
+    def save(self, file_path):
+        """
+        Writes the recent transfers to a JSON file so that later sessions, e.g. a dry run,
+        can estimate transfer times before uploading anything
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the JSON file. Missing directories are created
+        """
+        with self._lock:
+            samples = list(self._samples)
+        directory = os.path.dirname(os.path.abspath(file_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'w') as file_handle:
+            json.dump({'version': 1, 'samples': samples}, file_handle)
+        os.replace(tmp_path, file_path)
+
+    def load(self, file_path):
+        """
+        Adds the transfers saved by ``save`` before the ones recorded so far
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the JSON file
+        """
+        with open(file_path, 'r') as file_handle:
+            saved = json.load(file_handle)
+        if not isinstance(saved, dict) or saved.get('version') != 1:
+            raise ValueError("Unsupported throughput file: {}".format(file_path))
+        with self._lock:
+            recorded = list(self._samples)
+            self._samples.clear()
+            for num_bytes, seconds in saved['samples'] + recorded:
+                if seconds > 0:
+                    self._samples.append((num_bytes, seconds))
+
+
+class MovingAverage(object):
+
+    def __init__(self, alpha=0.3):
+        """
+        Exponentially weighted moving average
+
+        Parameters
+        ----------
+        alpha : float, Optional
+            Weight of the newest sample between 0 and 1. Default = 0.3
+        """
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha should be in (0, 1]")
+        self.alpha = alpha
+        self.value = None
+        self.count = 0
+
+    def update(self, sample):
+        """
+        Adds a sample and returns the updated average
+
+        Parameters
+        ----------
+        sample : float
+            New measurement
+
+        Returns
+        -------
+        float
+            Updated average
+        """
+        if self.value is None:
+            self.value = float(sample)
+        else:
+            self.value += self.alpha * (sample - self.value)
+        self.count += 1
+        return self.value
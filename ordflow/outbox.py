@@ -0,0 +1,515 @@
+"""
+Durable store-and-forward queue for instruments with intermittent connectivity to DataFlow
+"""
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from .backends import HTTPError
+
+
+PENDING_PREFIX = 'pending:'
+SETTINGS_GROUP = 'settings'
+
+
+def is_offline_error(exc):
+    """
+    Checks whether an exception indicates that DataFlow could not be reached,
+    as opposed to a request that DataFlow rejected
+
+    Parameters
+    ----------
+    exc : Exception
+        Exception raised by an ordflow.API call
+
+    Returns
+    -------
+    bool
+        True if the call should be retried once connectivity returns, including when
+        DataFlow answered with a 5xx, 408 or 429 status
+    """
+    if isinstance(exc, HTTPError):
+        return exc.transient
+    if isinstance(exc, (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError)):
+        return False
+    # requests' ConnectionError and Timeout are OSError subclasses
+    return isinstance(exc, OSError)
+
+
+def is_pending_id(dataset_id):
+    """
+    Checks whether a dataset ID is a placeholder for a dataset that is still in the outbox
+    """
+    return isinstance(dataset_id, str) and dataset_id.startswith(PENDING_PREFIX)
+
+
+class Outbox(object):
+
+    def __init__(self, api, directory, max_bytes=1024 ** 3, copy_files=False):
+        """
+        Journals dataset_create, file_upload and settings_set calls made while DataFlow
+        cannot be reached and replays them once connectivity returns
+
+        Calls are sent straight away when possible. Once a call fails because DataFlow is
+        unreachable, it and every later call for the same dataset are journaled to disk so
+        that they survive restarts. ``drain`` sends the backlog in parallel: a dataset is
+        created before any file is uploaded to it, settings are changed in the order they
+        were made and the remaining uploads are sent concurrently. Datasets created while
+        offline are given placeholder IDs that can be passed to ``file_upload`` and are
+        swapped for the real ID when the dataset is created. Calls that DataFlow rejects
+        are moved aside and can be put back with ``requeue_failed``.
+
+        Parameters
+        ----------
+        api : ordflow.API
+            API instance used to send the calls
+        directory : str
+            Directory holding the journal. Created if it does not exist
+        max_bytes : int, Optional
+            Disk quota for the journal and any spooled file copies. Default = 1 GiB
+        copy_files : bool, Optional
+            Whether to copy files into the outbox when journaling uploads, so that the
+            instrument may delete or overwrite the originals. Default = False - only
+            the path, size and modification time are journaled
+        """
+        if not isinstance(directory, str):
+            raise TypeError("directory should be a string")
+        if not isinstance(max_bytes, int):
+            raise TypeError("max_bytes should be an int")
+        self.api = api
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.copy_files = copy_files
+
+        self._entries_dir = os.path.join(directory, 'entries')
+        self._spool_dir = os.path.join(directory, 'spool')
+        self._failed_dir = os.path.join(directory, 'failed')
+        self._ids_path = os.path.join(directory, 'ids.json')
+        for path in [self._entries_dir, self._spool_dir, self._failed_dir]:
+            os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.RLock()
+        # Held for a whole drain, so that the background thread and callers never send an entry twice
+        self._drain_lock = threading.Lock()
+        self._ids = {}
+        if os.path.exists(self._ids_path):
+            with open(self._ids_path, 'r') as file_handle:
+                self._ids = json.load(file_handle)
+        entries = self.__load_entries()
+        # Failed entries keep their sequence numbers so that they can be requeued in order
+        seqs = [entry['seq'] for entry in entries + self.__load_entries(self._failed_dir)]
+        self._seq = itertools.count(max(seqs) + 1 if seqs else 0)
+        self._pending_groups = set(entry['group'] for entry in entries)
+        self._used_bytes = self.__disk_usage()
+
+        self.sent = 0
+        self.failed = 0
+        self.last_drain = None
+        # Time at which DataFlow was last found unreachable. Cleared by a successful drain
+        self.offline_since = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return "Outbox({}: {} pending)".format(self.directory, len(self.__load_entries()))
+
+    @staticmethod
+    def __write_json(path, obj):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as file_handle:
+            json.dump(obj, file_handle)
+        os.replace(tmp_path, path)
+
+    def __load_entries(self, directory=None):
+        directory = directory or self._entries_dir
+        entries = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(directory, name), 'r') as file_handle:
+                entries.append(json.load(file_handle))
+        return entries
+
+    def __disk_usage(self):
+        total = 0
+        for directory in [self._entries_dir, self._spool_dir]:
+            for root, _, files in os.walk(directory):
+                total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return total
+
+    def __entry_path(self, entry):
+        return os.path.join(self._entries_dir, "{:012d}.json".format(entry['seq']))
+
+    def __journal(self, op, group, kwargs, file_path=None):
+        """
+        Appends an operation to the journal
+        """
+        with self._lock:
+            entry = {'seq': next(self._seq), 'op': op, 'group': group, 'kwargs': kwargs,
+                     'created': time.time(), 'spool': None, 'file': None}
+            spool_bytes = 0
+            if file_path is not None:
+                stat = os.stat(file_path)
+                entry['file'] = {'path': os.path.abspath(file_path), 'size': stat.st_size,
+                                 'mtime': stat.st_mtime}
+                if self.copy_files:
+                    spool_bytes = stat.st_size
+            entry_bytes = len(json.dumps(entry))
+            if self._used_bytes + entry_bytes + spool_bytes > self.max_bytes:
+                raise OSError(errno.ENOSPC, "Outbox quota of {} bytes exceeded".format(self.max_bytes),
+                              self.directory)
+            if spool_bytes:
+                # One directory per entry so that the copy keeps the original file name
+                spool_dir = os.path.join(self._spool_dir, "{:012d}".format(entry['seq']))
+                os.makedirs(spool_dir, exist_ok=True)
+                entry['spool'] = os.path.join(spool_dir, os.path.basename(file_path))
+                shutil.copyfile(file_path, entry['spool'])
+            self.__write_json(self.__entry_path(entry), entry)
+            self._used_bytes += os.path.getsize(self.__entry_path(entry)) + spool_bytes
+            self._pending_groups.add(group)
+        return entry
+
+    def __remove(self, entry, error=None):
+        """
+        Removes a sent entry from the journal, or moves it to the failed directory
+        """
+        path = self.__entry_path(entry)
+        with self._lock:
+            if not os.path.exists(path):
+                # Already removed, e.g. by another Outbox instance on the same directory
+                return
+            freed = os.path.getsize(path)
+            if error is not None:
+                entry['error'] = error
+                self.__write_json(os.path.join(self._failed_dir, os.path.basename(path)), entry)
+            os.remove(path)
+            if entry['spool'] and os.path.exists(entry['spool']):
+                freed += os.path.getsize(entry['spool'])
+                shutil.rmtree(os.path.dirname(entry['spool']))
+            self._used_bytes -= freed
+
+    def __resolve(self, dataset_id):
+        if is_pending_id(dataset_id):
+            return self._ids.get(dataset_id, dataset_id)
+        return dataset_id
+
+    def __send_or_journal(self, op, group, kwargs, file_path=None):
+        """
+        Sends the call right away unless earlier calls for the same group are pending
+        or DataFlow cannot be reached
+        """
+        if group not in self._pending_groups and self.offline_since is None:
+            try:
+                return self.__call(op, kwargs, file_path)
+            except Exception as exc:
+                if not is_offline_error(exc):
+                    raise
+                self.offline_since = time.time()
+        return self.__journal(op, group, kwargs, file_path=file_path)
+
+    def __call(self, op, kwargs, file_path=None):
+        kwargs = dict(kwargs)
+        if file_path is not None:
+            kwargs['file_path'] = file_path
+        if 'dataset_id' in kwargs:
+            kwargs['dataset_id'] = self.__resolve(kwargs['dataset_id'])
+        return getattr(self.api, op)(**kwargs)
+
+    def dataset_create(self, title, instrument_id=0, metadata=None):
+        """
+        Create a new dataset, or journal its creation if DataFlow cannot be reached
+
+        Parameters
+        ----------
+        title : str
+            Title for dataset
+        instrument_id : int, optional
+            Instrument ID. Default = 0 - UnknownInstrument
+        metadata : dict, optional
+            Scientific metadata associated with this dataset
+
+        Returns
+        -------
+        dict
+            Response from DataFlow, or ``{"id": <placeholder>, "name": title, "pending": True}``
+            if the call was journaled. The placeholder ID can be passed to ``file_upload``
+        """
+        if metadata is not None:
+            # Fail now rather than at drain time if the metadata cannot be journaled
+            json.dumps(metadata)
+        placeholder = PENDING_PREFIX + uuid.uuid4().hex
+        kwargs = {'title': title, 'instrument_id': instrument_id, 'metadata': metadata}
+        if self.offline_since is None:
+            try:
+                return self.api.dataset_create(**kwargs)
+            except Exception as exc:
+                if not is_offline_error(exc):
+                    raise
+                self.offline_since = time.time()
+        self.__journal('dataset_create', placeholder, kwargs)
+        return {'id': placeholder, 'name': title, 'pending': True}
+
+    def file_upload(self, file_path, dataset_id, relative_path=None):
+        """
+        Upload a file to a dataset, or journal the upload if DataFlow cannot be reached
+        or earlier calls for this dataset are still pending
+
+        Parameters
+        ----------
+        file_path : str
+            Local path to file that needs to be uploaded
+        dataset_id : int or str
+            Dataset ID, or placeholder ID returned by ``dataset_create`` while offline
+        relative_path : str, optional
+            Relative path in destination to place this file
+
+        Returns
+        -------
+        dict
+            Response from DataFlow, or the journal entry if the call was journaled
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError("{} not found".format(file_path))
+        dataset_id = self.__resolve(dataset_id)
+        group = dataset_id if is_pending_id(dataset_id) else str(dataset_id)
+        kwargs = {'dataset_id': dataset_id, 'relative_path': relative_path}
+        if is_pending_id(dataset_id):
+            return self.__journal('file_upload', group, kwargs, file_path=file_path)
+        return self.__send_or_journal('file_upload', group, kwargs, file_path=file_path)
+
+    def settings_set(self, setting, value):
+        """
+        Set or update default user settings, or journal the change if DataFlow cannot be reached
+
+        Parameters
+        ----------
+        setting : str
+            Name of parameter
+        value : obj
+            New value for chosen parameter
+
+        Returns
+        -------
+        dict
+            Response from DataFlow, or the journal entry if the call was journaled
+        """
+        return self.__send_or_journal('settings_set', SETTINGS_GROUP,
+                                      {'setting': setting, 'value': value})
+
+    def __count(self, results, key, number=1):
+        with self._lock:
+            results[key] += number
+
+    def __is_held(self, entry):
+        """
+        Checks whether a call waits on a dataset that could not be created, e.g. because
+        DataFlow rejected it. Such calls stay in the journal until the dataset is requeued
+        """
+        dataset_id = entry['kwargs'].get('dataset_id')
+        return is_pending_id(dataset_id) and dataset_id not in self._ids
+
+    def __drain_entry(self, entry, results):
+        """
+        Sends a single journaled call
+
+        Returns
+        -------
+        bool
+            False if DataFlow could not be reached, so later calls of the group should wait
+        """
+        file_path = None
+        if entry['file'] is not None:
+            file_path = entry['spool'] or entry['file']['path']
+            if entry['spool'] is None:
+                try:
+                    stat = os.stat(file_path)
+                except OSError as exc:
+                    self.__remove(entry, error=str(exc))
+                    self.__count(results, 'failed')
+                    return True
+                if stat.st_size != entry['file']['size'] or stat.st_mtime != entry['file']['mtime']:
+                    self.__remove(entry, error="file changed after it was journaled")
+                    self.__count(results, 'failed')
+                    return True
+        try:
+            response = self.__call(entry['op'], entry['kwargs'], file_path=file_path)
+        except Exception as exc:
+            if is_offline_error(exc):
+                results['offline'] = True
+                return False
+            self.__remove(entry, error=str(exc))
+            self.__count(results, 'failed')
+            return True
+        if entry['op'] == 'dataset_create':
+            with self._lock:
+                self._ids[entry['group']] = response['id']
+                self.__write_json(self._ids_path, self._ids)
+        self.__remove(entry)
+        self.__count(results, 'sent')
+        return True
+
+    def __drain_upload(self, entry, results, stopped):
+        if stopped.is_set():
+            return
+        if not self.__drain_entry(entry, results):
+            # Keep the uploads of this group that did not start yet for the next drain
+            stopped.set()
+
+    def __drain_group(self, entries, results, executor, uploads):
+        """
+        Sends the calls of a group in order up to its first upload, then queues its
+        uploads on ``executor`` so that they are sent concurrently
+        """
+        index = 0
+        while index < len(entries) and entries[index]['op'] != 'file_upload':
+            if not self.__drain_entry(entries[index], results):
+                # Keep this and all later entries of the group for the next drain
+                return
+            index += 1
+        tail = entries[index:]
+        if tail and self.__is_held(tail[0]):
+            self.__count(results, 'held', len(tail))
+            return
+        stopped = threading.Event()
+        for entry in tail:
+            uploads.append(executor.submit(self.__drain_upload, entry, results, stopped))
+
+    def drain(self, max_workers=8):
+        """
+        Sends all journaled calls. A dataset is created before its files are uploaded and
+        settings are changed in the order they were made. Everything else is sent concurrently
+
+        Parameters
+        ----------
+        max_workers : int, Optional
+            Number of calls sent concurrently. Default = 8
+
+        Returns
+        -------
+        dict
+            Number of calls "sent", "failed" (rejected by DataFlow and moved aside), "held"
+            (uploads to datasets that could not be created) and "remaining", along with
+            whether DataFlow was found to be "offline". A drain started while another one runs,
+            e.g. the background drain of ``start``, waits for it and then sends what is left
+        """
+        with self._drain_lock:
+            return self.__drain(max_workers)
+
+    def __drain(self, max_workers):
+        groups = {}
+        for entry in self.__load_entries():
+            groups.setdefault(entry['group'], []).append(entry)
+        results = {'sent': 0, 'failed': 0, 'held': 0, 'offline': False}
+        if groups:
+            uploads = []
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(self.__drain_group, entries, results, executor, uploads)
+                           for entries in groups.values()]
+                # Uploads are only queued by the groups, so all of them are known once these finished
+                for future in futures:
+                    future.result()
+                for future in uploads:
+                    future.result()
+        with self._lock:
+            remaining = self.__load_entries()
+            self._pending_groups = set(entry['group'] for entry in remaining)
+        self.sent += results['sent']
+        self.failed += results['failed']
+        results['remaining'] = len(remaining)
+        if results['offline']:
+            self.offline_since = self.offline_since or time.time()
+        else:
+            self.offline_since = None
+        self.last_drain = dict(results, time=time.time())
+        return results
+
+    def requeue_failed(self):
+        """
+        Puts the calls that DataFlow rejected back into the journal, in their original order,
+        e.g. once the cause was fixed on the server. They are sent by the next ``drain``.
+        Copies of spooled files are deleted when a call fails, so requeued uploads read the
+        original files
+
+        Returns
+        -------
+        int
+            Number of calls requeued
+        """
+        with self._lock:
+            entries = self.__load_entries(self._failed_dir)
+            for entry in entries:
+                entry.pop('error', None)
+                if entry['spool'] is not None and not os.path.exists(entry['spool']):
+                    entry['spool'] = None
+                self.__write_json(self.__entry_path(entry), entry)
+                os.remove(os.path.join(self._failed_dir, os.path.basename(self.__entry_path(entry))))
+                self._used_bytes += os.path.getsize(self.__entry_path(entry))
+                self._pending_groups.add(entry['group'])
+        return len(entries)
+
+    def start(self, interval=30, max_workers=8):
+        """
+        Drains the outbox in a background thread every ``interval`` seconds while it is not empty
+
+        Parameters
+        ----------
+        interval : float, Optional
+            Seconds between attempts. Default = 30
+        max_workers : int, Optional
+            Number of datasets drained concurrently. Default = 8
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def __loop():
+            while not self._stop.wait(interval):
+                if self._pending_groups or self.offline_since is not None:
+                    self.drain(max_workers=max_workers)
+
+        self._thread = threading.Thread(target=__loop, name="ordflow-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background drain thread
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def backlog(self):
+        """
+        Metrics describing the calls waiting to be sent
+
+        Returns
+        -------
+        dict
+            "entries": number of journaled calls,
+            "datasets": number of datasets with pending calls,
+            "file_bytes": bytes of data waiting to be uploaded,
+            "disk_bytes": bytes used by the journal and spooled copies,
+            "quota_bytes": disk quota,
+            "oldest_age": seconds since the oldest pending call was made,
+            "offline": whether DataFlow was unreachable at the last attempt,
+            "failed": number of calls rejected by DataFlow so far,
+            "sent": number of journaled calls sent so far
+        """
+        entries = self.__load_entries()
+        now = time.time()
+        return {'entries': len(entries),
+                'datasets': len(set(entry['group'] for entry in entries) - {SETTINGS_GROUP}),
+                'file_bytes': sum(entry['file']['size'] for entry in entries if entry['file']),
+                'disk_bytes': self._used_bytes,
+                'quota_bytes': self.max_bytes,
+                'oldest_age': now - min(entry['created'] for entry in entries) if entries else 0.0,
+                'offline': self.offline_since is not None,
+                'failed': self.failed,
+                'sent': self.sent}
@@ -0,0 +1,562 @@
+"""
+Ingest pipelines whose stages (scan, hash, compress, upload) overlap, connected by bounded queues
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+from .planner import UploadPlanner, destination_path
+
+
+logger = logging.getLogger(__name__)
+
+# Tells a worker that no more items will arrive on its queue
+_DONE = object()
+
+
+class Stage(object):
+    """
+    Base class of pipeline stages. Subclasses implement ``process``
+
+    Stages whose ``expands`` attribute is True return an iterable of outputs per input,
+    e.g. all the files within a directory. Otherwise ``process`` returns a single output,
+    or None to drop the item.
+    """
+
+    expands = False
+
+    def __init__(self, workers=1, queue_size=None, name=None):
+        """
+        Parameters
+        ----------
+        workers : int, Optional
+            Number of threads running this stage. Default = 1
+        queue_size : int, Optional
+            Capacity of the queue feeding this stage. Default - the pipeline's ``queue_size``
+        name : str, Optional
+            Name shown in the metrics. Default - name of the class
+        """
+        if not isinstance(workers, int):
+            raise TypeError("workers should be an int")
+        if workers < 1:
+            raise ValueError("workers should be > 0")
+        if queue_size is not None and (not isinstance(queue_size, int) or queue_size < 1):
+            raise ValueError("queue_size should be an int > 0")
+        self.workers = workers
+        self.queue_size = queue_size
+        self.name = name or type(self).__name__
+
+    def __repr__(self):
+        return "{}(workers={})".format(self.name, self.workers)
+
+    def process(self, item):
+        raise NotImplementedError()
+
+
+class FunctionStage(Stage):
+
+    def __init__(self, func, workers=1, queue_size=None, name=None, expands=False):
+        """
+        Stage that applies a function to every item
+
+        Parameters
+        ----------
+        func : callable
+            Function taking an item and returning the output (or None to drop the item).
+            If ``expands`` is True, it returns an iterable of outputs instead
+        workers, queue_size, name :
+            See ``Stage``. ``name`` defaults to the name of the function
+        expands : bool, Optional
+            Whether ``func`` returns several outputs per item. Default = False
+        """
+        super(FunctionStage, self).__init__(workers=workers, queue_size=queue_size,
+                                            name=name or getattr(func, '__name__', None))
+        self.func = func
+        self.expands = expands
+
+    def process(self, item):
+        return self.func(item)
+
+
+class ScanStage(Stage):
+
+    expands = True
+
+    def __init__(self, relative_path=None, include=None, exclude=None, skip_empty=False, max_workers=8,
+                 workers=1, queue_size=None, name=None):
+        """
+        Turns source directories into one item per file, using the same filters and
+        ``relative_path`` mapping as ``UploadPlanner``. Files are handed on one directory
+        at a time while the tree is still being listed
+
+        Items are dicts with "path", "size", "mtime" and "relative_path". Files that cannot
+        be read or are filtered out are listed in the ``skipped`` attribute instead.
+
+        Parameters
+        ----------
+        relative_path : str, Optional
+            Directory within the dataset under which each source directory is placed
+        include : list of str, Optional
+            Glob patterns of files to keep. Default - all files
+        exclude : list of str, Optional
+            Glob patterns of files to leave out
+        skip_empty : bool, Optional
+            Whether to leave out empty files. Default = False
+        max_workers : int, Optional
+            Threads used to list each directory tree. Default = 8
+        workers, queue_size, name :
+            See ``Stage``
+        """
+        super(ScanStage, self).__init__(workers=workers, queue_size=queue_size, name=name)
+        self.planner = UploadPlanner(include=include, exclude=exclude, relative_path=relative_path,
+                                     skip_empty=skip_empty, deduplicate=False, max_workers=max_workers)
+        self.skipped = []
+        self._lock = threading.Lock()
+
+    def process(self, source):
+        source = os.path.abspath(source)
+        for dir_files in self.planner.iter_scan(source):
+            for path, size, mtime, error in dir_files:
+                rel_path = os.path.relpath(path, source).replace(os.sep, '/')
+                reason = self.planner.skip_reason(rel_path, size, error)
+                if reason is not None:
+                    with self._lock:
+                        self.skipped.append((path, reason))
+                    continue
+                yield {'path': path, 'size': size, 'mtime': mtime,
+                       'relative_path': destination_path(rel_path, self.planner.relative_path)}
+
+
+class HashStage(Stage):
+
+    def __init__(self, algorithm='sha256', uploaded=None, workers=2, queue_size=None, name=None):
+        """
+        Adds the checksum of each file to its item as "checksum"
+
+        This reads every file once more on top of the upload, so it is only worth it to
+        drop files recorded in ``uploaded``. Otherwise ``UploadStage`` computes the
+        checksums while sending the files.
+
+        Parameters
+        ----------
+        algorithm : str, Optional
+            Name of the hashlib algorithm. Default = "sha256"
+        uploaded : ordflow.manifest.Manifest, Optional
+            Manifest of files uploaded earlier. Files found in it with the same location,
+            size and checksum are dropped, so that interrupted ingests resume where they stopped
+        workers, queue_size, name :
+            See ``Stage``. Default = 2 workers
+        """
+        super(HashStage, self).__init__(workers=workers, queue_size=queue_size, name=name)
+        if uploaded is not None and uploaded.algorithm != algorithm:
+            raise ValueError("uploaded manifest uses {} instead of {}".format(uploaded.algorithm, algorithm))
+        self.algorithm = algorithm
+        self.uploaded = {}
+        for entry in (uploaded.entries.values() if uploaded is not None else []):
+            key = uploaded.key(entry['name'], entry['relative_path'])
+            self.uploaded[key] = (entry['size'], entry['checksum'])
+
+    def process(self, item):
+        from .manifest import Manifest, file_checksum
+        size, checksum = file_checksum(item['path'], algorithm=self.algorithm)
+        key = Manifest.key(os.path.basename(item['path']), item.get('relative_path'))
+        if self.uploaded.get(key) == (size, checksum):
+            return None
+        return dict(item, size=size, checksum=checksum)
+
+
+class _Compress(object):
+    """
+    Hands the decision made by ``CompressStage`` to ``API.file_upload`` as if it were a Compressor,
+    so that the file is not sampled again
+    """
+
+    def __init__(self, compressor):
+        self.compressor = compressor
+        self.info = None
+
+    def should_compress(self, file_path):
+        return True
+
+    def compress(self, file_path):
+        reader, self.info = self.compressor.compress(file_path)
+        return reader, self.info
+
+    def record_upload(self, info, upload_seconds):
+        self.compressor.record_upload(info, upload_seconds)
+
+
+class CompressStage(Stage):
+
+    def __init__(self, compressor=None, workers=2, queue_size=None, name=None):
+        """
+        Samples each file to decide whether it is worth compressing and marks such items
+        with "compressed". The marked files are compressed while ``UploadStage`` sends them,
+        without temporary files. Backends that build the whole request body first, such as
+        ``RequestsBackend``, hold the compressed file in memory during its upload
+
+        Parameters
+        ----------
+        compressor : ordflow.compression.Compressor, Optional
+            Decides whether and how files are compressed. Default - ``Compressor()``
+        workers, queue_size, name :
+            See ``Stage``. Default = 2 workers
+        """
+        super(CompressStage, self).__init__(workers=workers, queue_size=queue_size, name=name)
+        if compressor is None:
+            from .compression import Compressor
+            compressor = Compressor()
+        self.compressor = compressor
+
+    def process(self, item):
+        if not self.compressor.should_compress(item['path']):
+            return item
+        return dict(item, compressed=_Compress(self.compressor))
+
+
+class UploadStage(Stage):
+
+    def __init__(self, api, dataset_id, manifest=None, workers=4, queue_size=None, name=None):
+        """
+        Uploads each file through ``API.file_upload`` and adds the response to the item as "response"
+
+        Parameters
+        ----------
+        api : ordflow.API
+            API instance used to upload the files
+        dataset_id : int
+            Dataset ID to upload the files to
+        manifest : ordflow.manifest.Manifest, Optional
+            Manifest to record the uploaded files in. Checksums are computed while the
+            files are read for the upload, unless ``HashStage``, which should use the same
+            algorithm, already added them to the items
+        workers, queue_size, name :
+            See ``Stage``. Default = 4 workers
+        """
+        super(UploadStage, self).__init__(workers=workers, queue_size=queue_size, name=name)
+        if not isinstance(dataset_id, int):
+            raise TypeError("dataset_id should be an int")
+        self.api = api
+        self.dataset_id = dataset_id
+        self.manifest = manifest
+
+    def process(self, item):
+        compressed = item.get('compressed')
+        hashed = 'checksum' in item
+        response = self.api.file_upload(item['path'], self.dataset_id, relative_path=item.get('relative_path'),
+                                        compression=compressed or False,
+                                        manifest=None if hashed else self.manifest)
+        if self.manifest is not None and hashed:
+            remote = {}
+            if compressed is not None:
+                remote = {'remote_name': compressed.info['compressed_name'],
+                          'remote_size': compressed.info.get('compressed_size')}
+            self.manifest.add(os.path.basename(item['path']), item['size'], item['checksum'],
+                              relative_path=item.get('relative_path'), source=item['path'], **remote)
+        output = dict(item, response=response)
+        # The compression decision is not needed anymore
+        output.pop('compressed', None)
+        return output
+
+
+class StageMetrics(object):
+
+    def __init__(self, stage, input_queue):
+        """
+        Counters of a single stage, updated by its workers
+        """
+        self.stage = stage
+        self.queue = input_queue
+        self.items_in = 0
+        self.items_out = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds, outputs, failed=False):
+        with self._lock:
+            self.items_in += 1
+            self.items_out += outputs
+            self.failed += int(failed)
+            self.busy_seconds += busy_seconds
+
+    def sample_queue(self):
+        depth = self.queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def to_dict(self):
+        """
+        Returns
+        -------
+        dict
+            "stage", "workers", "items_in", "items_out", "failed", "queue_depth",
+            "max_queue_depth", "utilization" (fraction of worker time spent processing)
+            and "items_per_second"
+        """
+        end = self.finished or time.perf_counter()
+        elapsed = end - self.started if self.started is not None else 0.0
+        with self._lock:
+            return {'stage': self.stage.name,
+                    'workers': self.stage.workers,
+                    'items_in': self.items_in,
+                    'items_out': self.items_out,
+                    'failed': self.failed,
+                    'queue_depth': self.queue.qsize(),
+                    'max_queue_depth': self.max_queue_depth,
+                    'utilization': self.busy_seconds / (elapsed * self.stage.workers) if elapsed else 0.0,
+                    'items_per_second': self.items_in / elapsed if elapsed else 0.0}
+
+
+class Pipeline(object):
+
+    def __init__(self, stages, queue_size=8, sink=None, keep_results=True):
+        """
+        Runs stages concurrently, each on its own threads, connected by bounded queues.
+        A full queue blocks the stage feeding it, so a slow stage throttles the ones
+        upstream and at most a few items per queue are held in memory
+
+        Parameters
+        ----------
+        stages : list of Stage
+            Stages in the order items flow through them
+        queue_size : int, Optional
+            Default capacity of the queue feeding each stage. Default = 8
+        sink : callable, Optional
+            Called with each output of the last stage, on the thread that produced it.
+            Exceptions it raises count as failures of the last stage
+        keep_results : bool, Optional
+            Whether to collect the outputs of the last stage in ``results``. Turn off for
+            long-running ingests, where they would add up to one item per file, and
+            handle the outputs in ``sink`` instead. Default = True
+        """
+        if not stages:
+            raise ValueError("stages should not be empty")
+        for stage in stages:
+            if not isinstance(stage, Stage):
+                raise TypeError("stages should be instances of ordflow.pipeline.Stage")
+        if not isinstance(queue_size, int) or queue_size < 1:
+            raise ValueError("queue_size should be an int > 0")
+        if sink is not None and not callable(sink):
+            raise TypeError("sink should be callable")
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.sink = sink
+        self.keep_results = keep_results
+        self.results = []
+        self.failed = []
+        self._queues = []
+        self._metrics = []
+        self._threads = []
+        self._remaining = []
+        self._lock = threading.Lock()
+        self._started = None
+        self._finished = None
+
+    def __repr__(self):
+        return "Pipeline({})".format(' -> '.join(repr(stage) for stage in self.stages))
+
+    def __put(self, index, item):
+        if index < len(self.stages):
+            self._queues[index].put(item)
+            self._metrics[index].sample_queue()
+        else:
+            if self.sink is not None:
+                self.sink(item)
+            if self.keep_results:
+                with self._lock:
+                    self.results.append(item)
+
+    def __worker(self, index):
+        stage = self.stages[index]
+        metrics = self._metrics[index]
+        input_queue = self._queues[index]
+        while True:
+            item = input_queue.get()
+            if item is _DONE:
+                break
+            t_start = time.perf_counter()
+            outputs = 0
+            failed = False
+            try:
+                results = stage.process(item)
+                if not stage.expands:
+                    results = [] if results is None else [results]
+                for output in results:
+                    # Time spent blocked on a full queue downstream does not count as busy
+                    t_blocked = time.perf_counter()
+                    self.__put(index + 1, output)
+                    t_start += time.perf_counter() - t_blocked
+                    outputs += 1
+            except Exception as exc:
+                logger.warning("Stage {} failed on {}: {}".format(stage.name, item, exc))
+                failed = True
+                with self._lock:
+                    self.failed.append((stage.name, item, exc))
+            metrics.record(time.perf_counter() - t_start, outputs, failed=failed)
+
+        with self._lock:
+            self._remaining[index] -= 1
+            last = self._remaining[index] == 0
+        if last:
+            metrics.finished = time.perf_counter()
+            if index + 1 < len(self.stages):
+                for _ in range(self.stages[index + 1].workers):
+                    self._queues[index + 1].put(_DONE)
+            else:
+                self._finished = time.perf_counter()
+
+    def __feed(self, items):
+        try:
+            for item in items:
+                self.__put(0, item)
+        except Exception as exc:
+            with self._lock:
+                self.failed.append(('feed', None, exc))
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._queues[0].put(_DONE)
+
+    def start(self, items):
+        """
+        Starts feeding items into the first stage and returns immediately
+
+        Parameters
+        ----------
+        items : iterable
+            Inputs of the first stage, e.g. source directories for a ``ScanStage``.
+            Consumed lazily, so generators are fine
+
+        Returns
+        -------
+        Pipeline
+            This pipeline, so that ``join`` can be chained
+        """
+        if self._started is not None:
+            raise RuntimeError("A pipeline can only be run once")
+        self._started = time.perf_counter()
+        self._queues = [queue.Queue(maxsize=stage.queue_size or self.queue_size) for stage in self.stages]
+        self._metrics = [StageMetrics(stage, input_queue) for stage, input_queue in zip(self.stages, self._queues)]
+        self._remaining = [stage.workers for stage in self.stages]
+        for index, stage in enumerate(self.stages):
+            self._metrics[index].started = self._started
+            for number in range(stage.workers):
+                thread = threading.Thread(target=self.__worker, args=(index,), daemon=True,
+                                          name="ordflow-{}-{}".format(stage.name, number))
+                thread.start()
+                self._threads.append(thread)
+        feeder = threading.Thread(target=self.__feed, args=(items,), daemon=True, name="ordflow-feeder")
+        feeder.start()
+        self._threads.append(feeder)
+        return self
+
+    def join(self, timeout=None):
+        """
+        Waits for all items to pass through the pipeline
+
+        Parameters
+        ----------
+        timeout : float, Optional
+            Seconds to wait. Default - wait until done
+
+        Returns
+        -------
+        dict
+            "completed": outputs of the last stage, empty unless ``keep_results``,
+            "failed": list of (stage name, item, exception),
+            "metrics": output of ``metrics``
+
+        Raises
+        ------
+        TimeoutError
+            If the pipeline did not finish in time. It keeps running in the background
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            if thread.is_alive():
+                raise TimeoutError("Pipeline did not finish within {} s".format(timeout))
+        return {'completed': self.results, 'failed': self.failed, 'metrics': self.metrics()}
+
+    def run(self, items, timeout=None):
+        """
+        Runs the pipeline to completion. Shorthand for ``start(items).join(timeout)``
+        """
+        return self.start(items).join(timeout=timeout)
+
+    @property
+    def done(self):
+        return self._finished is not None
+
+    def metrics(self):
+        """
+        Current metrics of every stage. Can be called while the pipeline runs
+
+        Returns
+        -------
+        list of dict
+            One dict per stage, see ``StageMetrics.to_dict``
+        """
+        return [metrics.to_dict() for metrics in self._metrics]
+
+    def bottleneck(self):
+        """
+        Name of the stage with the highest utilization, i.e. the one worth more workers
+        """
+        metrics = self.metrics()
+        if not metrics:
+            return None
+        return max(metrics, key=lambda item: item['utilization'])['stage']
+
+
+def upload_pipeline(api, dataset_id, relative_path=None, include=None, exclude=None, compressor=None,
+                    manifest=None, uploaded=None, hash_workers=2, compress_workers=2, upload_workers=4,
+                    queue_size=8, sink=None, keep_results=True):
+    """
+    Builds the usual scan -> hash -> compress -> upload pipeline. The hash stage is only
+    added to resume from ``uploaded``. Otherwise files are hashed while being uploaded, so
+    that each uncompressed file is read once
+
+    Parameters
+    ----------
+    api : ordflow.API
+        API instance used to upload the files
+    dataset_id : int
+        Dataset ID to upload the files to
+    relative_path : str, Optional
+        Directory within the dataset under which each source directory is placed
+    include : list of str, Optional
+        Glob patterns of files to upload. Default - all files
+    exclude : list of str, Optional
+        Glob patterns of files to leave out
+    compressor : ordflow.compression.Compressor, Optional
+        Adds a compression stage using this compressor. Default - no compression
+    manifest : ordflow.manifest.Manifest, Optional
+        Manifest to record the uploaded files in
+    uploaded : ordflow.manifest.Manifest, Optional
+        Manifest of an earlier ingest whose unchanged files should not be uploaded again
+    hash_workers, compress_workers, upload_workers : int, Optional
+        Threads per stage. Default = 2, 2 and 4
+    queue_size : int, Optional
+        Capacity of the queue between stages. Default = 8
+    sink, keep_results :
+        See ``Pipeline``
+
+    Returns
+    -------
+    Pipeline
+        Pipeline to run with the source directories as items, e.g. ``.run(["/data/run1"])``
+    """
+    stages = [ScanStage(relative_path=relative_path, include=include, exclude=exclude)]
+    if uploaded is not None:
+        algorithm = manifest.algorithm if manifest is not None else uploaded.algorithm
+        stages.append(HashStage(algorithm=algorithm, uploaded=uploaded, workers=hash_workers))
+    if compressor is not None:
+        stages.append(CompressStage(compressor, workers=compress_workers))
+    stages.append(UploadStage(api, dataset_id, manifest=manifest, workers=upload_workers))
+    return Pipeline(stages, queue_size=queue_size, sink=sink, keep_results=keep_results)
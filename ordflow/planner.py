@@ -0,0 +1,481 @@
+"""
+Dry-run planning of bulk uploads so that their cost is known before any data is transferred
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import errno
+import fnmatch
+import json
+import os
+import posixpath
+import time
+
+
+UPLOAD = 'upload'
+DEDUPLICATE = 'deduplicate'
+SKIP = 'skip'
+
+
+def matches_filters(rel_path, include=None, exclude=None):
+    """
+    Checks whether a file should be considered for upload
+
+    Parameters
+    ----------
+    rel_path : str
+        Path of the file relative to the source directory, using "/" as separator
+    include : list of str, Optional
+        Glob patterns. If provided, only files matching at least one pattern are kept.
+        Patterns are matched against both the relative path and the file name
+    exclude : list of str, Optional
+        Glob patterns of files to leave out. Takes precedence over ``include``
+
+    Returns
+    -------
+    bool
+        True if the file passes the filters
+    """
+    name = posixpath.basename(rel_path)
+
+    def __match(patterns):
+        for pattern in patterns:
+            if fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    if exclude and __match(exclude):
+        return False
+    if include:
+        return __match(include)
+    return True
+
+
+def destination_path(rel_path, relative_path=None):
+    """
+    Maps a file within the source directory to the ``relative_path`` used by ``API.file_upload``
+
+    Parameters
+    ----------
+    rel_path : str
+        Path of the file relative to the source directory, using "/" as separator
+    relative_path : str, Optional
+        Directory within the dataset under which the whole source directory is placed.
+        Default - root directory of the dataset
+
+    Returns
+    -------
+    str or None
+        Directory within the dataset for this file. None for the root of the dataset
+    """
+    parent = posixpath.dirname(rel_path)
+    if relative_path:
+        parent = posixpath.join(relative_path.strip('/'), parent) if parent else relative_path.strip('/')
+    return parent or None
+
+
+class UploadPlan(object):
+
+    def __init__(self, source, dataset_id, entries, relative_path=None, eta=None, created=None):
+        """
+        Serializable description of the files that an upload would transfer
+
+        Parameters
+        ----------
+        source : str
+            Absolute path of the scanned source directory
+        dataset_id : int
+            Dataset ID that the files would be uploaded to
+        entries : list of dict
+            One dict per scanned file with keys: "path", "size", "mtime", "relative_path",
+            "action" (one of "upload", "deduplicate", "skip") and "reason"
+        relative_path : str, Optional
+            Directory within the dataset under which the source directory is placed
+        eta : float, Optional
+            Estimated seconds needed to transfer the files marked for upload
+        created : float, Optional
+            Time at which the plan was made, as seconds since the epoch. Default - now
+        """
+        self.source = source
+        self.dataset_id = dataset_id
+        self.entries = entries
+        self.relative_path = relative_path
+        self.eta = eta
+        self.created = time.time() if created is None else created
+
+    def __repr__(self):
+        return "UploadPlan({}: {} files, {} bytes to upload)".format(self.source, self.num_files,
+                                                                     self.num_bytes)
+
+    def __select(self, action):
+        return [entry for entry in self.entries if entry['action'] == action]
+
+    @property
+    def uploads(self):
+        """
+        Entries that would be transferred
+        """
+        return self.__select(UPLOAD)
+
+    @property
+    def num_files(self):
+        """
+        Number of files that would be transferred
+        """
+        return len(self.uploads)
+
+    @property
+    def num_bytes(self):
+        """
+        Number of bytes that would be transferred
+        """
+        return sum(entry['size'] for entry in self.uploads)
+
+    def summary(self):
+        """
+        Summarizes the cost of this plan
+
+        Returns
+        -------
+        dict
+            Counts and sizes of files per action along with the estimated time to completion
+        """
+        summary = {'files': self.num_files,
+                   'bytes': self.num_bytes,
+                   'eta_seconds': self.eta}
+        for action in [DEDUPLICATE, SKIP]:
+            entries = self.__select(action)
+            summary[action] = {'files': len(entries),
+                               'bytes': sum(entry['size'] or 0 for entry in entries)}
+        return summary
+
+    def to_dict(self):
+        """
+        Returns
+        -------
+        dict
+            JSON-serializable representation of this plan
+        """
+        return {'source': self.source,
+                'dataset_id': self.dataset_id,
+                'relative_path': self.relative_path,
+                'eta': self.eta,
+                'created': self.created,
+                'entries': self.entries}
+
+    @classmethod
+    def from_dict(cls, plan_dict):
+        """
+        Rebuilds a plan from the output of ``to_dict``
+
+        Parameters
+        ----------
+        plan_dict : dict
+            Serialized plan
+
+        Returns
+        -------
+        UploadPlan
+        """
+        if not isinstance(plan_dict, dict):
+            raise TypeError("plan_dict should be a dict")
+        return cls(plan_dict['source'], plan_dict['dataset_id'], plan_dict['entries'],
+                   relative_path=plan_dict.get('relative_path'), eta=plan_dict.get('eta'),
+                   created=plan_dict.get('created'))
+
+    def save(self, file_path):
+        """
+        Writes this plan to a JSON file
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the JSON file
+        """
+        with open(file_path, 'w') as file_handle:
+            json.dump(self.to_dict(), file_handle)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Reads a plan written by ``save``
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the JSON file
+
+        Returns
+        -------
+        UploadPlan
+        """
+        with open(file_path, 'r') as file_handle:
+            return cls.from_dict(json.load(file_handle))
+
+    def execute(self, api, max_workers=4, verify_unchanged=True, manifest=None):
+        """
+        Uploads the files marked for upload without rescanning the source directory
+
+        Parameters
+        ----------
+        api : ordflow.API
+            API instance used to upload the files
+        max_workers : int, Optional
+            Number of files uploaded concurrently. Default = 4
+        verify_unchanged : bool, Optional
+            Whether to skip files whose size or modification time changed since planning.
+            Default = True
+        manifest : ordflow.manifest.Manifest, Optional
+            Manifest to record the checksums of the uploaded files in, computed while uploading
+
+        Returns
+        -------
+        dict
+            "uploaded": list of responses from ``API.file_upload``,
+            "changed": list of paths skipped because they changed since planning,
+            "failed": dict mapping paths to the raised exceptions
+        """
+        results = {'uploaded': [], 'changed': [], 'failed': {}}
+
+        def __upload(entry):
+            if verify_unchanged:
+                stat = os.stat(entry['path'])
+                if stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+                    return None
+            return api.file_upload(entry['path'], self.dataset_id,
+                                   relative_path=entry['relative_path'], manifest=manifest)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(__upload, entry): entry for entry in self.uploads}
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    response = future.result()
+                except Exception as exc:
+                    results['failed'][entry['path']] = exc
+                    continue
+                if response is None:
+                    results['changed'].append(entry['path'])
+                else:
+                    results['uploaded'].append(response)
+        return results
+
+
+class UploadPlanner(object):
+
+    def __init__(self, api=None, include=None, exclude=None, relative_path=None, skip_empty=False,
+                 deduplicate=True, max_workers=8, upload_workers=4):
+        """
+        Scans source directories and estimates the cost of uploading them
+
+        Parameters
+        ----------
+        api : ordflow.API, Optional
+            API instance. Used to look up files already present in the dataset and
+            the recently measured upload throughput. Default - no deduplication or ETA
+        include : list of str, Optional
+            Glob patterns of files to upload. Default - all files
+        exclude : list of str, Optional
+            Glob patterns of files to leave out
+        relative_path : str, Optional
+            Directory within the dataset under which the source directory is placed.
+            Default - root directory of the dataset
+        skip_empty : bool, Optional
+            Whether to skip empty files. Default = False
+        deduplicate : bool, Optional
+            Whether to leave out files already present in the dataset with the same
+            relative path, name and size. Requires ``api``. Default = True
+        max_workers : int, Optional
+            Number of threads used to list directories and stat files. Default = 8
+        upload_workers : int, Optional
+            Number of concurrent uploads assumed by the estimated time to completion,
+            i.e. ``max_workers`` of ``UploadPlan.execute``. Default = 4
+        """
+        for patterns, title in [(include, "include"), (exclude, "exclude")]:
+            if patterns is not None and not isinstance(patterns, (list, tuple)):
+                raise TypeError("{} should be a list of glob patterns".format(title))
+        if relative_path is not None and not isinstance(relative_path, str):
+            raise TypeError("relative_path should be a string")
+        if not isinstance(max_workers, int):
+            raise TypeError("max_workers should be an int")
+        if max_workers < 1:
+            raise ValueError("max_workers should be > 0")
+        if not isinstance(upload_workers, int):
+            raise TypeError("upload_workers should be an int")
+        if upload_workers < 1:
+            raise ValueError("upload_workers should be > 0")
+
+        self.api = api
+        self.include = include
+        self.exclude = exclude
+        self.relative_path = relative_path
+        self.skip_empty = skip_empty
+        self.deduplicate = deduplicate
+        self.max_workers = max_workers
+        self.upload_workers = upload_workers
+
+    @staticmethod
+    def __scan_dir(directory):
+        """
+        Lists a single directory and stats all the files within it. Symbolic links to
+        directories are not followed, so that links cannot cause loops
+
+        Returns
+        -------
+        files : list of tuple
+            (path, size, mtime, error) for each file. A directory that cannot be listed is
+            reported as a single entry carrying the error
+        sub_dirs : list of str
+            Paths of the sub-directories
+        """
+        files = []
+        sub_dirs = []
+        try:
+            with os.scandir(directory) as iterator:
+                for dir_entry in iterator:
+                    try:
+                        if dir_entry.is_dir(follow_symlinks=False):
+                            sub_dirs.append(dir_entry.path)
+                            continue
+                        if dir_entry.is_symlink() and dir_entry.is_dir():
+                            raise IsADirectoryError(errno.EISDIR, "Symbolic link to a directory", dir_entry.path)
+                        stat = dir_entry.stat()
+                        files.append((dir_entry.path, stat.st_size, stat.st_mtime, None))
+                    except OSError as exc:
+                        files.append((dir_entry.path, None, None, exc))
+        except OSError as exc:
+            # E.g. no permission to list the directory. The rest of the tree is still scanned
+            files.append((directory, None, None, exc))
+        return files, sub_dirs
+
+    def iter_scan(self, source):
+        """
+        Lists and stats the files within the source directory using a pool of threads,
+        handing out the files of each directory as soon as it was listed. Sub-directories
+        are only listed while the caller keeps consuming, so a slow consumer does not
+        make the whole tree pile up in memory
+
+        Parameters
+        ----------
+        source : str
+            Path to the source directory
+
+        Yields
+        ------
+        list of tuple
+            (path, size, mtime, error) for each file within one directory
+        """
+        if not isinstance(source, str):
+            raise TypeError("source should be a string")
+        if not os.path.isdir(source):
+            raise NotADirectoryError("{} is not a directory".format(source))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(self.__scan_dir, source)}
+            while pending:
+                future = next(as_completed(pending))
+                pending.remove(future)
+                dir_files, sub_dirs = future.result()
+                pending.update(executor.submit(self.__scan_dir, sub_dir) for sub_dir in sub_dirs)
+                yield dir_files
+
+    def scan(self, source):
+        """
+        Lists and stats all files within the source directory using a pool of threads
+
+        Parameters
+        ----------
+        source : str
+            Path to the source directory
+
+        Returns
+        -------
+        list of tuple
+            (path, size, mtime, error) for each file
+        """
+        files = []
+        for dir_files in self.iter_scan(source):
+            files.extend(dir_files)
+        return files
+
+    def skip_reason(self, rel_path, size, error=None):
+        """
+        Reason for leaving a scanned file out of an upload
+
+        Parameters
+        ----------
+        rel_path : str
+            Path of the file relative to the source directory, using "/" as separator
+        size : int
+            Size of the file in bytes
+        error : OSError, Optional
+            Error raised while scanning the file
+
+        Returns
+        -------
+        str or None
+            Reason, or None if the file should be uploaded
+        """
+        if isinstance(error, IsADirectoryError):
+            return "symbolic link to a directory"
+        if error is not None:
+            return "unreadable: {}".format(error)
+        if not matches_filters(rel_path, include=self.include, exclude=self.exclude):
+            return "filtered"
+        if self.skip_empty and size == 0:
+            return "empty"
+        return None
+
+    def __existing_files(self, dataset_id):
+        """
+        Set of (relative_path, name, size) for files already present in the dataset
+        """
+        response = self.api.dataset_info(dataset_id)
+        existing = set()
+        for item in response.get('dataset_files', []):
+            if item.get('is_directory'):
+                continue
+            existing.add(((item.get('relative_path') or '').strip('/'), item.get('name'),
+                          item.get('file_length')))
+        return existing
+
+    def plan(self, source, dataset_id):
+        """
+        Builds an upload plan without transferring any data
+
+        Parameters
+        ----------
+        source : str
+            Path to the directory that needs to be uploaded
+        dataset_id : int
+            Dataset ID to upload the files to
+
+        Returns
+        -------
+        UploadPlan
+        """
+        if not isinstance(dataset_id, int):
+            raise TypeError("dataset_id should be an int")
+        source = os.path.abspath(source)
+        scanned = self.scan(source)
+
+        existing = set()
+        if self.deduplicate and self.api is not None:
+            existing = self.__existing_files(dataset_id)
+
+        entries = []
+        for path, size, mtime, error in sorted(scanned, key=lambda item: item[0]):
+            rel_path = os.path.relpath(path, source).replace(os.sep, '/')
+            dest = destination_path(rel_path, self.relative_path)
+            entry = {'path': path, 'size': size, 'mtime': mtime,
+                     'relative_path': dest, 'action': UPLOAD, 'reason': None}
+            reason = self.skip_reason(rel_path, size, error)
+            if reason is not None:
+                entry.update(action=SKIP, reason=reason)
+            elif (dest or '', posixpath.basename(rel_path), size) in existing:
+                entry.update(action=DEDUPLICATE, reason="already in dataset")
+            entries.append(entry)
+
+        plan = UploadPlan(source, dataset_id, entries, relative_path=self.relative_path)
+        if self.api is not None:
+            plan.eta = self.api.throughput.estimate(plan.num_bytes, num_files=plan.num_files,
+                                                    concurrency=self.upload_workers)
+        return plan
@@ -0,0 +1,312 @@
+"""
+Opt-in profiling of the client-side cost of ordflow.API calls
+"""
+import cProfile
+import functools
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+# Internal API methods that are worth timing in addition to the public ones
+INTERNAL_METHODS = ['_API__get', '_API__post', '_API__flatten_dict', '_API__mdata_dict_2_list']
+
+# Substrings of cProfile function labels used to attribute time to broad categories
+HOT_SPOTS = {'json encoding / decoding': ['json/encoder.py', 'json/decoder.py', '_json'],
+             'multipart encoding': ['_encode_files', 'encode_multipart_formdata'],
+             'network wait': ["'_socket.socket'", "'_ssl._SSLSocket'", 'socket.py:', 'ssl.py:'],
+             'metadata flattening': ['__flatten_dict']}
+
+
+class CallStats(object):
+
+    def __init__(self, name):
+        """
+        Accumulated measurements for a single API method
+
+        Parameters
+        ----------
+        name : str
+            Name of the method
+        """
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.alloc_peak = 0
+        self.errors = 0
+
+    def to_dict(self):
+        """
+        Returns
+        -------
+        dict
+            Measurements of this method
+        """
+        return {'calls': self.calls, 'wall': self.wall, 'cpu': self.cpu,
+                'wait': max(0.0, self.wall - self.cpu), 'alloc_peak': self.alloc_peak,
+                'errors': self.errors}
+
+
+class Profiler(object):
+
+    def __init__(self, methods=None, trace_memory=True, cprofile_dir=None):
+        """
+        Measures wall time, CPU time and allocation peaks of API method calls
+
+        Parameters
+        ----------
+        methods : list of str, Optional
+            Names of the API methods to profile, e.g. ["dataset_create", "__flatten_dict"].
+            Default - all public methods along with the internal request, flattening and
+            metadata helpers
+        trace_memory : bool, Optional
+            Whether to record allocation peaks with tracemalloc. Default = True
+        cprofile_dir : str, Optional
+            Directory to dump one cProfile file per method into when detaching.
+            Default - cProfile is not used
+        """
+        if methods is not None and not isinstance(methods, (list, tuple)):
+            raise TypeError("methods should be a list of method names")
+        self.methods = methods
+        self.trace_memory = trace_memory
+        self.cprofile_dir = cprofile_dir
+
+        self.stats = {}
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._api = None
+        self._wrapped = []
+        self._started_tracemalloc = False
+        self._attached_at = None
+        self.session_wall = 0.0
+
+    @staticmethod
+    def __display_name(attr):
+        return attr[len('_API'):] if attr.startswith('_API__') else attr
+
+    def __resolve(self, api):
+        """
+        Instance attribute names of the methods to wrap
+        """
+        if self.methods is None:
+            names = [name for name in dir(type(api)) if not name.startswith('_')
+                     and name != 'profile' and callable(getattr(type(api), name))]
+            return names + INTERNAL_METHODS
+        names = []
+        for name in self.methods:
+            attr = '_API' + name if name.startswith('__') else name
+            if not hasattr(api, attr):
+                raise ValueError("API has no method named {}".format(name))
+            names.append(attr)
+        return names
+
+    def attach(self, api):
+        """
+        Starts profiling calls made on the provided API instance
+
+        Parameters
+        ----------
+        api : ordflow.API
+            API instance to profile
+
+        Returns
+        -------
+        Profiler
+            This profiler
+        """
+        if self._api is not None:
+            raise RuntimeError("Profiler is already attached to an API instance")
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        for attr in self.__resolve(api):
+            name = self.__display_name(attr)
+            self.stats.setdefault(name, CallStats(name))
+            setattr(api, attr, self.__wrap(name, getattr(api, attr)))
+            self._wrapped.append(attr)
+        self._api = api
+        self._attached_at = time.perf_counter()
+        return self
+
+    def detach(self):
+        """
+        Stops profiling, restores the original methods and writes any cProfile dumps
+        """
+        if self._api is None:
+            return
+        for attr in self._wrapped:
+            delattr(self._api, attr)
+        self._wrapped = []
+        self._api = None
+        self.session_wall += time.perf_counter() - self._attached_at
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        if self.cprofile_dir:
+            self.dump(self.cprofile_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.detach()
+
+    def __frames(self):
+        frames = getattr(self._local, 'frames', None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    def __wrap(self, name, func):
+        @functools.wraps(func)
+        def __profiled(*args, **kwargs):
+            frames = self.__frames()
+            outermost = not frames
+            trace_memory = self.trace_memory and tracemalloc.is_tracing()
+            frame = {'start_mem': 0, 'child_peak': 0}
+            if trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                if frames:
+                    frames[-1]['child_peak'] = max(frames[-1]['child_peak'], peak)
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+                frame['start_mem'] = current
+            frames.append(frame)
+
+            profile = None
+            if self.cprofile_dir and outermost:
+                with self._lock:
+                    profile = self._profiles.setdefault(name, cProfile.Profile())
+                try:
+                    profile.enable()
+                except ValueError:
+                    # Another profiler is active, e.g. in a concurrent call
+                    profile = None
+
+            failed = False
+            t_wall = time.perf_counter()
+            t_cpu = time.thread_time()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                cpu = time.thread_time() - t_cpu
+                wall = time.perf_counter() - t_wall
+                if profile is not None:
+                    profile.disable()
+                frames.pop()
+                alloc_peak = 0
+                if trace_memory and tracemalloc.is_tracing():
+                    peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+                    alloc_peak = max(0, peak - frame['start_mem'])
+                    if frames:
+                        frames[-1]['child_peak'] = max(frames[-1]['child_peak'], peak)
+                stats = self.stats[name]
+                with self._lock:
+                    stats.calls += 1
+                    stats.wall += wall
+                    stats.cpu += cpu
+                    stats.alloc_peak = max(stats.alloc_peak, alloc_peak)
+                    stats.errors += int(failed)
+
+        return __profiled
+
+    def dump(self, directory):
+        """
+        Writes the accumulated cProfile data as one ``<method>.prof`` file per method
+
+        Parameters
+        ----------
+        directory : str
+            Directory to write the files into
+
+        Returns
+        -------
+        list of str
+            Paths of the written files
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for name, profile in self._profiles.items():
+            path = os.path.join(directory, name.strip('_') + '.prof')
+            profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def hot_spots(self):
+        """
+        Attributes the profiled time to broad categories using the cProfile data
+
+        Returns
+        -------
+        dict
+            Cumulative seconds per category. Empty if cProfile was not used
+        """
+        if not self._profiles:
+            return {}
+        combined = None
+        for profile in self._profiles.values():
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if combined is None:
+                combined = pstats.Stats(profile)
+            else:
+                combined.add(profile)
+        if combined is None:
+            return {}
+        totals = dict((category, 0.0) for category in HOT_SPOTS)
+        for (file_name, line, func_name), (_, _, self_time, _, _) in combined.stats.items():
+            label = "{}:{}({})".format(file_name, line, func_name)
+            for category, patterns in HOT_SPOTS.items():
+                if any(pattern in label for pattern in patterns):
+                    totals[category] += self_time
+                    break
+        return totals
+
+    def summary(self):
+        """
+        Returns
+        -------
+        dict
+            Measurements per profiled method that was called at least once
+        """
+        return dict((name, stats.to_dict()) for name, stats in self.stats.items() if stats.calls)
+
+    def report(self, sort_by='wall'):
+        """
+        Builds a human-readable report of where client-side time went
+
+        Parameters
+        ----------
+        sort_by : str, Optional
+            Column to sort methods by: "wall", "cpu", "wait", "calls" or "alloc_peak".
+            Default = "wall"
+
+        Returns
+        -------
+        str
+            Report
+        """
+        summary = self.summary()
+        if sort_by not in ['wall', 'cpu', 'wait', 'calls', 'alloc_peak']:
+            raise ValueError("Cannot sort by {}".format(sort_by))
+        lines = ["{:<28} {:>7} {:>10} {:>10} {:>10} {:>10} {:>12}".format(
+            'method', 'calls', 'wall (s)', 'cpu (s)', 'wait (s)', 'mean (ms)', 'peak (KiB)')]
+        for name, stats in sorted(summary.items(), key=lambda item: item[1][sort_by], reverse=True):
+            lines.append("{:<28} {:>7} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.2f} {:>12.1f}".format(
+                name, stats['calls'], stats['wall'], stats['cpu'], stats['wait'],
+                1e3 * stats['wall'] / stats['calls'], stats['alloc_peak'] / 1024.0))
+        hot_spots = self.hot_spots()
+        if hot_spots:
+            lines.append('')
+            lines.append("{:<28} {:>10}".format('hot spot (cProfile)', 'self (s)'))
+            for category, seconds in sorted(hot_spots.items(), key=lambda item: item[1], reverse=True):
+                lines.append("{:<28} {:>10.4f}".format(category, seconds))
+        return '\n'.join(lines)
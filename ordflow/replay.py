@@ -0,0 +1,364 @@
+"""
+Recording of real HTTP traffic and its replay without a server, for repeatable performance tests
+"""
+import base64
+from collections import defaultdict, deque
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+from .backends import HTTPBackend, HTTPResponse, RequestsBackend
+
+
+REDACTED = 'REDACTED'
+# Headers whose values never end up in a recording
+SECRET_HEADERS = {'authorization', 'cookie', 'set-cookie'}
+# Query parameters whose values never end up in a recording, besides any ending in "password"
+SECRET_PARAMS = {'username'}
+# Errors that can be replayed, by name
+REPLAYABLE_ERRORS = {'ConnectionError': ConnectionError, 'TimeoutError': TimeoutError}
+
+
+def request_target(url):
+    """
+    Path and query string of a URL, so that recordings do not depend on the server they were made with.
+    Credentials passed as query parameters, e.g. by ``API.globus_endpoints_activate``, are redacted
+    """
+    parts = urlsplit(url)
+    return parts.path + ('?' + _redact_query(parts.query) if parts.query else '')
+
+
+def _redact_query(query):
+    params = []
+    for param in query.split('&'):
+        name = unquote(param.split('=', 1)[0]).lower()
+        if name in SECRET_PARAMS or name.endswith('password'):
+            param = param.split('=', 1)[0] + '=' + REDACTED
+        params.append(param)
+    return '&'.join(params)
+
+
+def endpoint(target):
+    """
+    Groups request targets by endpoint, e.g. "/api/v1/datasets/12" -> "/api/v1/datasets/{id}"
+    """
+    return re.sub(r'/\d+(?=/|$)', '/{id}', target.split('?')[0])
+
+
+def _redact(headers):
+    return {key: REDACTED if key.lower() in SECRET_HEADERS else value for key, value in (headers or {}).items()}
+
+
+def _describe_files(files):
+    """
+    Names and sizes of the files in a multipart upload. Their contents are not recorded
+    """
+    described = {}
+    for field, value in (files or {}).items():
+        name = None
+        if isinstance(value, tuple):
+            name, value = value[0], value[1]
+        name = name or os.path.basename(str(getattr(value, 'name', '')))
+        size = None
+        if hasattr(value, 'getbuffer'):
+            size = value.getbuffer().nbytes
+        else:
+            try:
+                size = os.fstat(value.fileno()).st_size
+            except (AttributeError, OSError, ValueError):
+                pass
+        described[field] = {'name': name, 'size': size}
+    return described
+
+
+def _drain_files(files, chunk_size=1024 ** 2):
+    """
+    Reads uploaded files to the end like a real backend would, so that client-side
+    reading and hashing costs are still incurred during replay
+    """
+    for value in (files or {}).values():
+        if isinstance(value, tuple):
+            value = value[1]
+        if hasattr(value, 'read'):
+            while value.read(chunk_size):
+                pass
+
+
+class Recording(object):
+
+    def __init__(self, entries=None):
+        """
+        Requests and responses of an API session, in the order the requests were sent
+
+        Parameters
+        ----------
+        entries : list of dict, Optional
+            Recorded calls, as made by ``RecordingBackend`` or ``ReplayBackend``
+        """
+        self.entries = list(entries or [])
+        self._lock = threading.Lock()
+        self._origin = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return "Recording({} calls, {:.3f} s)".format(len(self.entries), self.span)
+
+    def add(self, t_start, elapsed, method, url, headers=None, json=None, data=None, files=None,
+            response=None, error=None):
+        """
+        Records a single call
+
+        Parameters
+        ----------
+        t_start : float
+            ``time.perf_counter()`` when the request was sent
+        elapsed : float
+            Seconds until the response arrived or the request failed
+        method, url, headers, json, data, files :
+            Arguments of ``HTTPBackend.request``. Secret headers are redacted and only the
+            names and sizes of files are kept
+        response : ordflow.backends.HTTPResponse, Optional
+            Response received
+        error : Exception, Optional
+            Exception raised instead of a response
+        """
+        entry = {'method': method, 'target': request_target(url), 'elapsed': elapsed,
+                 'request': {'headers': _redact(headers)}}
+        if json is not None:
+            entry['request']['json'] = json
+        if data:
+            entry['request']['data'] = {key: str(value) for key, value in data.items()}
+        if files:
+            entry['request']['files'] = _describe_files(files)
+        if response is not None:
+            entry['response'] = {'status': response.status_code, 'reason': response.reason,
+                                 'headers': _redact(response.headers)}
+            try:
+                entry['response']['body'] = response.content.decode('utf-8')
+            except UnicodeDecodeError:
+                entry['response']['body_b64'] = base64.b64encode(response.content).decode('ascii')
+        if error is not None:
+            entry['error'] = {'type': type(error).__name__, 'message': str(error)}
+        with self._lock:
+            if self._origin is None:
+                self._origin = t_start
+            entry['offset'] = t_start - self._origin
+            self.entries.append(entry)
+        return entry
+
+    @property
+    def span(self):
+        """
+        Seconds from the first request to the last response
+        """
+        if not self.entries:
+            return 0.0
+        return max(entry['offset'] + entry['elapsed'] for entry in self.entries) - \
+            min(entry['offset'] for entry in self.entries)
+
+    def save(self, file_path):
+        """
+        Writes the recording as gzip-compressed JSON lines: a header line followed by one line per call
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the recording, e.g. "session.jsonl.gz"
+        """
+        with gzip.open(file_path, 'wt', encoding='utf-8') as file_handle:
+            file_handle.write(json.dumps({'version': 1, 'calls': len(self.entries)}) + '\n')
+            for entry in sorted(self.entries, key=lambda item: item['offset']):
+                file_handle.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Reads a recording written by ``save``
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the recording
+
+        Returns
+        -------
+        Recording
+        """
+        with gzip.open(file_path, 'rt', encoding='utf-8') as file_handle:
+            header = json.loads(file_handle.readline())
+            if header.get('version') != 1:
+                raise ValueError("Unsupported recording version: {}".format(header.get('version')))
+            return cls([json.loads(line) for line in file_handle])
+
+    def summary(self):
+        """
+        Number of calls and total latency per endpoint
+
+        Returns
+        -------
+        dict
+            Maps "<method> <endpoint>" to {"calls": int, "seconds": float}
+        """
+        summary = defaultdict(lambda: {'calls': 0, 'seconds': 0.0})
+        for entry in self.entries:
+            item = summary['{} {}'.format(entry['method'], endpoint(entry['target']))]
+            item['calls'] += 1
+            item['seconds'] += entry['elapsed']
+        return dict(summary)
+
+    def compare(self, baseline, max_slowdown=1.2, max_extra_calls=0, time_scale=1.0):
+        """
+        Checks this recording for regressions against a baseline recording of the same workload
+
+        Parameters
+        ----------
+        baseline : Recording
+            Recording of the reference session
+        max_slowdown : float, Optional
+            Largest acceptable ratio of this session's span to the baseline's. Default = 1.2
+        max_extra_calls : int, Optional
+            Calls per endpoint that may be made on top of those in the baseline. Default = 0
+        time_scale : float, Optional
+            ``time_scale`` this session was replayed with. The baseline's span is scaled
+            accordingly. 0 skips the latency check. Default = 1
+
+        Returns
+        -------
+        dict
+            "regressions": list of messages, empty when there are none,
+            "calls": maps endpoints to {"baseline": int, "current": int},
+            "span": {"baseline": float, "current": float} in seconds, the baseline being scaled
+        """
+        ours = self.summary()
+        theirs = baseline.summary()
+        expected_span = baseline.span * time_scale
+        report = {'regressions': [], 'calls': {},
+                  'span': {'baseline': expected_span, 'current': self.span}}
+        for key in sorted(set(ours) | set(theirs)):
+            current = ours.get(key, {}).get('calls', 0)
+            expected = theirs.get(key, {}).get('calls', 0)
+            report['calls'][key] = {'baseline': expected, 'current': current}
+            if current > expected + max_extra_calls:
+                report['regressions'].append("{}: {} calls instead of {}".format(key, current, expected))
+        failed = [entry for entry in self.entries if 'error' in entry and entry['error']['type'] == 'LookupError']
+        if failed:
+            report['regressions'].append("{} calls had no recorded response, e.g. {} {}".format(
+                len(failed), failed[0]['method'], failed[0]['target']))
+        if expected_span and self.span > max_slowdown * expected_span:
+            report['regressions'].append("session took {:.3f} s instead of {:.3f} s ({:.2f}x)".format(
+                self.span, expected_span, self.span / expected_span))
+        return report
+
+
+class RecordingBackend(HTTPBackend):
+
+    def __init__(self, backend=None):
+        """
+        Passes requests on to another backend and records them along with their responses
+
+        Use it as ``API(api_key, backend=RecordingBackend())`` and save ``recording`` at the end
+        of the session. The Authorization header is redacted and file contents are not recorded.
+
+        Parameters
+        ----------
+        backend : ordflow.backends.HTTPBackend, Optional
+            Backend that actually sends the requests. Default - ``RequestsBackend()``
+        """
+        self.backend = backend if backend is not None else RequestsBackend()
+        self.recording = Recording()
+
+    def request(self, method, url, headers=None, json=None, data=None, files=None):
+        t_start = time.perf_counter()
+        try:
+            response = self.backend.request(method, url, headers=headers, json=json, data=data, files=files)
+        except Exception as exc:
+            self.recording.add(t_start, time.perf_counter() - t_start, method, url, headers=headers,
+                               json=json, data=data, files=files, error=exc)
+            raise
+        self.recording.add(t_start, time.perf_counter() - t_start, method, url, headers=headers,
+                           json=json, data=data, files=files, response=response)
+        return response
+
+    def close(self):
+        self.backend.close()
+
+
+class ReplayBackend(HTTPBackend):
+
+    def __init__(self, recording, time_scale=1.0):
+        """
+        Serves the responses of a recording instead of contacting a server
+
+        Requests are matched to recorded calls by method, path and redacted query string,
+        in the order they were recorded. Once the recorded calls for a request are used up, the
+        last one is served again so that the session can finish; ``recording`` then shows
+        the extra calls. Uploaded files are still read to the end.
+
+        Parameters
+        ----------
+        recording : Recording or str
+            Recording, or path to a file written by ``Recording.save``
+        time_scale : float, Optional
+            Factor applied to the recorded latency of each call, e.g. 0.5 for half the
+            latency or 0 for none. Default = 1 (original timing)
+        """
+        if isinstance(recording, str):
+            recording = Recording.load(recording)
+        if time_scale < 0:
+            raise ValueError("time_scale should be >= 0")
+        self.time_scale = time_scale
+        self.source = recording
+        self._calls = defaultdict(deque)
+        self._last = {}
+        for entry in recording.entries:
+            # Redacted again in case the recording was made before credentials were redacted
+            self._calls[(entry['method'], request_target(entry['target']))].append(entry)
+        self._lock = threading.Lock()
+        # What this backend served, to compare against the source recording
+        self.recording = Recording()
+
+    def __next_entry(self, method, target):
+        with self._lock:
+            calls = self._calls.get((method, target))
+            if calls:
+                entry = calls.popleft()
+                self._last[(method, target)] = entry
+                return entry
+            return self._last.get((method, target))
+
+    def request(self, method, url, headers=None, json=None, data=None, files=None):
+        t_start = time.perf_counter()
+        _drain_files(files)
+        entry = self.__next_entry(method, request_target(url))
+        if entry is None:
+            exc = LookupError("No recorded response for {} {}".format(method, request_target(url)))
+            self.recording.add(t_start, time.perf_counter() - t_start, method, url, headers=headers,
+                               json=json, data=data, files=files, error=exc)
+            raise exc
+        if self.time_scale:
+            remaining = entry['elapsed'] * self.time_scale - (time.perf_counter() - t_start)
+            if remaining > 0:
+                time.sleep(remaining)
+        error = entry.get('error')
+        if error is not None:
+            exc = REPLAYABLE_ERRORS.get(error['type'], ConnectionError)(error['message'])
+            self.recording.add(t_start, time.perf_counter() - t_start, method, url, headers=headers,
+                               json=json, data=data, files=files, error=exc)
+            raise exc
+        recorded = entry['response']
+        if 'body_b64' in recorded:
+            content = base64.b64decode(recorded['body_b64'])
+        else:
+            content = recorded['body'].encode('utf-8')
+        response = HTTPResponse(recorded['status'], recorded['reason'], content, headers=recorded['headers'],
+                                http_version='replay')
+        response.elapsed = time.perf_counter() - t_start
+        self.recording.add(t_start, response.elapsed, method, url, headers=headers, json=json, data=data,
+                           files=files, response=response)
+        return response
@@ -0,0 +1,251 @@
+"""
+Client for several DataFlow servers that routes reads to the healthiest, fastest one
+"""
+from collections import deque
+import functools
+import threading
+import time
+
+from .api import API, search_many
+from .metrics import MovingAverage
+from .outbox import is_offline_error
+
+
+# Calls that only read from DataFlow and can be served by any of the servers
+READ_METHODS = ['dataset_search', 'dataset_info', 'files_search', 'instrument_list', 'instrument_info']
+
+
+class ServerHealth(object):
+
+    def __init__(self, url, alpha=0.3):
+        """
+        Moving averages of latency and error rate for a single server
+
+        Parameters
+        ----------
+        url : str
+            URL for DataFlow server
+        alpha : float, Optional
+            Weight of the newest sample in the moving averages. Default = 0.3
+        """
+        self.url = url
+        self.latency = MovingAverage(alpha)
+        self.error_rate = MovingAverage(alpha)
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_failure = None
+        self.last_success = None
+
+    def record(self, seconds, failed):
+        """
+        Records the outcome of a single call
+        """
+        self.calls += 1
+        self.error_rate.update(1.0 if failed else 0.0)
+        if failed:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_failure = time.time()
+        else:
+            self.consecutive_failures = 0
+            self.last_success = time.time()
+            self.latency.update(seconds)
+
+
+class MultiServerAPI(object):
+
+    def __init__(self, api_key, server_urls, primary=0, alpha=0.3, error_penalty=10.0,
+                 max_failures=3, cooldown=30.0, probe_interval=60.0, history=100):
+        """
+        Talks to several DataFlow servers, e.g. a production instance and regional mirrors
+
+        Read calls (``dataset_search``, ``dataset_info``, ``files_search``,
+        ``instrument_list`` and ``instrument_info``) are routed to the server with the best
+        score, i.e. the lowest moving average latency inflated by its moving average error
+        rate, and fail over to the next best server on errors. Each query of
+        ``files_search_many`` is routed on its own. All other calls, including every write,
+        go to the primary server.
+
+        Parameters
+        ----------
+        api_key : str
+            API key for accessing DataFlow. Must be valid on all servers
+        server_urls : list of str
+            URLs for the DataFlow servers
+        primary : int, Optional
+            Index of the server that receives all writes. Default = 0
+        alpha : float, Optional
+            Weight of the newest sample in the moving averages. Default = 0.3
+        error_penalty : float, Optional
+            How strongly errors worsen a server's score. Default = 10
+        max_failures : int, Optional
+            Consecutive failures, i.e. the server was unreachable, timed out or answered
+            with a 5xx status, after which it is only tried as a last resort until
+            ``cooldown`` elapses. Default = 3
+        cooldown : float, Optional
+            Seconds for which a failing server is demoted. Default = 30
+        probe_interval : float, Optional
+            Seconds after which a server that has not served a read is tried again so that
+            its latency estimate stays current. Default = 60
+        history : int, Optional
+            Number of routing decisions kept for inspection. Default = 100
+        """
+        if not isinstance(server_urls, (list, tuple)) or not server_urls:
+            raise TypeError("server_urls should be a non-empty list of strings")
+        if not isinstance(primary, int):
+            raise TypeError("primary should be an int")
+        if not 0 <= primary < len(server_urls):
+            raise ValueError("primary should be an index into server_urls")
+
+        self.apis = [API(api_key, server_url=url) for url in server_urls]
+        self.health = [ServerHealth(url, alpha=alpha) for url in server_urls]
+        self.primary = primary
+        self.error_penalty = error_penalty
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self.decisions = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "MultiServerAPI(primary={}, servers={})".format(self.health[self.primary].url,
+                                                              len(self.apis))
+
+    @property
+    def primary_api(self):
+        """
+        API instance bound to the primary server
+        """
+        return self.apis[self.primary]
+
+    def __getattr__(self, name):
+        if name.startswith('__') or 'apis' not in self.__dict__:
+            raise AttributeError(name)
+        if name in READ_METHODS:
+            return functools.partial(self.__routed, name)
+        # Writes and everything else stay pinned to the primary server
+        return getattr(self.apis[self.__dict__['primary']], name)
+
+    def __dir__(self):
+        return sorted(set(list(self.__dict__) + dir(type(self)) + dir(self.primary_api)))
+
+    def __demoted(self, health):
+        return health.consecutive_failures >= self.max_failures and \
+            time.time() - health.last_failure < self.cooldown
+
+    def score(self, index):
+        """
+        Routing score of a server. Lower is better
+
+        Parameters
+        ----------
+        index : int
+            Index of the server
+
+        Returns
+        -------
+        float
+            Moving average latency in seconds, inflated by the moving average error rate.
+            Servers that have not been measured yet, or not within ``probe_interval``,
+            score 0 so that they get tried, unless they failed within ``probe_interval``.
+            Servers that failed without ever serving a read score infinity
+        """
+        health = self.health[index]
+        now = time.time()
+        recently_failed = health.last_failure is not None and now - health.last_failure < self.probe_interval
+        if (health.last_success is None or now - health.last_success > self.probe_interval) and \
+                not recently_failed:
+            return 0.0
+        if health.latency.value is None:
+            return float('inf')
+        return health.latency.value * (1 + self.error_penalty * (health.error_rate.value or 0.0))
+
+    def ranking(self):
+        """
+        Order in which servers would be tried for the next read
+
+        Returns
+        -------
+        list of int
+            Server indices, best first
+        """
+        with self._lock:
+            return sorted(range(len(self.apis)),
+                          key=lambda index: (self.__demoted(self.health[index]), self.score(index),
+                                             index != self.primary))
+
+    def __routed(self, method, *args, **kwargs):
+        order = self.ranking()
+        tried = []
+        last_exc = None
+        rejection = None
+        for index in order:
+            health = self.health[index]
+            tried.append(health.url)
+            t_start = time.perf_counter()
+            try:
+                response = getattr(self.apis[index], method)(*args, **kwargs)
+            except TypeError:
+                # Invalid arguments fail identically everywhere
+                raise
+            except Exception as exc:
+                last_exc = exc
+                with self._lock:
+                    # Unreachable servers, timeouts and 5xx statuses are penalized. Other 4xx
+                    # rejections are retried elsewhere since a mirror may lag behind the primary
+                    if is_offline_error(exc):
+                        health.record(time.perf_counter() - t_start, True)
+                    elif rejection is None:
+                        rejection = exc
+                continue
+            with self._lock:
+                health.record(time.perf_counter() - t_start, False)
+            self.decisions.append({'method': method, 'server': health.url, 'tried': tried,
+                                   'failovers': len(tried) - 1, 'time': time.time()})
+            return response
+        self.decisions.append({'method': method, 'server': None, 'tried': tried,
+                               'failovers': len(tried) - 1, 'time': time.time(),
+                               'error': str(rejection or last_exc)})
+        # A server's rejection is more telling than another server being unreachable
+        raise rejection or last_exc
+
+    def files_search_many(self, query, dataset_ids, max_workers=8, timeout=None, max_hits=None):
+        """
+        Search for individual files across several datasets concurrently. Takes the same
+        arguments and returns the same results as ``API.files_search_many``, with each
+        per-dataset ``files_search`` routed and failed over on its own
+        """
+        return search_many(self.files_search, query, dataset_ids, max_workers=max_workers, timeout=timeout,
+                           max_hits=max_hits)
+
+    @property
+    def last_decision(self):
+        """
+        Most recent routing decision or None
+        """
+        return self.decisions[-1] if self.decisions else None
+
+    def routing_table(self):
+        """
+        Current view of all servers used for routing reads
+
+        Returns
+        -------
+        list of dict
+            Per server, in ranking order: "url", "primary", "latency" (seconds),
+            "error_rate", "score", "calls", "failures" and "demoted"
+        """
+        table = []
+        for index in self.ranking():
+            health = self.health[index]
+            with self._lock:
+                table.append({'url': health.url,
+                              'primary': index == self.primary,
+                              'latency': health.latency.value,
+                              'error_rate': health.error_rate.value or 0.0,
+                              'score': self.score(index),
+                              'calls': health.calls,
+                              'failures': health.failures,
+                              'demoted': self.__demoted(health)})
+        return table
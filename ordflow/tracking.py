@@ -0,0 +1,438 @@
+"""
+Completion tracking of the transfers that follow file uploads, with coalesced and adaptive polling
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import logging
+import random
+import threading
+import time
+import warnings
+
+from .backends import HTTPError
+
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+# Status values that DataFlow or Globus may report for a file, in lower case
+DONE_STATUSES = {'succeeded', 'success', 'successful', 'done', 'complete', 'completed', 'transferred'}
+FAILED_STATUSES = {'failed', 'failure', 'error', 'cancelled', 'canceled', 'inactive'}
+STATUS_KEYS = ('transfer_status', 'status', 'state')
+
+
+def transfer_state(item):
+    """
+    Classifies a file listed by ``API.dataset_info``
+
+    Uses the first of "transfer_status", "status" or "state" that the file carries. Files
+    without any of these stay pending, with a warning, since DataFlow lists files before
+    their transfer finished. Pass ``classify`` to ``TransferTracker`` for such servers.
+
+    Parameters
+    ----------
+    item : dict
+        Entry of "dataset_files"
+
+    Returns
+    -------
+    str
+        "pending", "done" or "failed"
+    """
+    for key in STATUS_KEYS:
+        status = item.get(key)
+        if isinstance(status, str):
+            status = status.lower()
+            if status in FAILED_STATUSES:
+                return FAILED
+            if status in DONE_STATUSES:
+                return DONE
+            return PENDING
+    warnings.warn("Files listed by DataFlow carry none of {}, so their transfers never count as done. "
+                  "Pass classify to TransferTracker".format(', '.join(STATUS_KEYS)), RuntimeWarning)
+    return PENDING
+
+
+class Transfer(object):
+
+    def __init__(self, dataset_id, file_id=None, name=None, relative_path=None, timeout=None):
+        """
+        A watched file, or a whole dataset when neither ``file_id`` nor ``name`` is given
+
+        ``future`` resolves with the file's entry in the dataset (or the whole ``dataset_info``
+        response for datasets) once transferred. It fails with RuntimeError if the transfer
+        failed and with TimeoutError if it did not finish within ``timeout`` seconds.
+        """
+        self.dataset_id = dataset_id
+        self.file_id = file_id
+        self.name = name
+        self.relative_path = (relative_path or '').strip('/')
+        self.state = PENDING
+        self.item = None
+        self.started = time.time()
+        self.finished = None
+        self.deadline = None if timeout is None else self.started + timeout
+        self.future = Future()
+
+    def __repr__(self):
+        target = self.file_id or self.name or 'all files'
+        return "Transfer(dataset {}: {}, {})".format(self.dataset_id, target, self.state)
+
+    @property
+    def is_dataset(self):
+        return self.file_id is None and self.name is None
+
+    def matches(self, item):
+        if self.file_id is not None:
+            return item.get('id') == self.file_id
+        return item.get('name') == self.name and (item.get('relative_path') or '').strip('/') == self.relative_path
+
+    def _finish(self, state, item=None, exc=None):
+        self.state = state
+        self.item = item
+        self.finished = time.time()
+        if exc is None:
+            self.future.set_result(item)
+        else:
+            self.future.set_exception(exc)
+
+
+class _DatasetWatch(object):
+    """
+    Transfers within one dataset, all resolved by the same ``dataset_info`` query
+    """
+
+    def __init__(self, dataset_id, interval):
+        self.dataset_id = dataset_id
+        self.transfers = []
+        self.interval = interval
+        self.next_poll = time.time() + interval
+        self.polling = False
+        self.errors = 0
+
+
+class TransferTracker(object):
+
+    def __init__(self, api, min_interval=2.0, max_interval=60.0, backoff=2.0, jitter=0.1, max_errors=5,
+                 max_workers=4, classify=None):
+        """
+        Watches many uploaded files or datasets until their transfers finish
+
+        All transfers within a dataset are resolved by a single ``dataset_info`` query per
+        poll. Each dataset is polled every ``min_interval`` seconds while its transfers make
+        progress and ever less often, up to ``max_interval``, while they do not.
+
+        Parameters
+        ----------
+        api : ordflow.API
+            API instance used to query the datasets
+        min_interval : float, Optional
+            Seconds between polls of a dataset that just made progress. Default = 2
+        max_interval : float, Optional
+            Longest interval between polls of a dataset. Default = 60
+        backoff : float, Optional
+            Factor by which the interval grows after a poll without progress. Default = 2
+        jitter : float, Optional
+            Random fraction added to intervals so that datasets are not polled in bursts. Default = 0.1
+        max_errors : int, Optional
+            Consecutive failed queries of a dataset after which its transfers fail. Default = 5
+        max_workers : int, Optional
+            Datasets queried concurrently. Default = 4
+        classify : callable, Optional
+            Function mapping a file entry to "pending", "done" or "failed".
+            Default - ``transfer_state``
+        """
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("intervals should satisfy 0 < min_interval <= max_interval")
+        if backoff < 1:
+            raise ValueError("backoff should be >= 1")
+        self.api = api
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.max_errors = max_errors
+        self.max_workers = max_workers
+        self.classify = classify or transfer_state
+
+        self.transfers = []
+        self.num_queries = 0
+        self._watches = {}
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    def __repr__(self):
+        return "TransferTracker({} pending in {} datasets)".format(len(self.pending), len(self._watches))
+
+    @property
+    def pending(self):
+        return [transfer for transfer in self.transfers if transfer.state == PENDING]
+
+    def __add(self, transfer, callback):
+        if callback is not None:
+            transfer.future.add_done_callback(lambda _: callback(transfer))
+        with self._condition:
+            watch = self._watches.get(transfer.dataset_id)
+            if watch is None:
+                watch = self._watches[transfer.dataset_id] = _DatasetWatch(transfer.dataset_id, self.min_interval)
+            else:
+                # Poll soon again since a new transfer is likely under way
+                watch.interval = self.min_interval
+                watch.next_poll = min(watch.next_poll, time.time() + self.min_interval)
+            watch.transfers.append(transfer)
+            self.transfers.append(transfer)
+            self._condition.notify_all()
+        return transfer
+
+    def watch_file(self, dataset_id, name, relative_path=None, callback=None, timeout=None):
+        """
+        Watches a file by name and location within a dataset
+
+        Parameters
+        ----------
+        dataset_id : int
+            Dataset the file was uploaded to
+        name : str
+            Name of the file within the dataset
+        relative_path : str, Optional
+            Directory within the dataset holding the file. Default - root of the dataset
+        callback : callable, Optional
+            Called with the ``Transfer`` once it completes or fails
+        timeout : float, Optional
+            Seconds after which the transfer is considered failed. Default - no limit
+
+        Returns
+        -------
+        Transfer
+            Tracked transfer. Its ``future`` resolves with the file's entry in the dataset
+        """
+        return self.__add(Transfer(dataset_id, name=name, relative_path=relative_path, timeout=timeout),
+                          callback)
+
+    def watch_upload(self, response, dataset_id, callback=None, timeout=None):
+        """
+        Watches a file using the response of ``API.file_upload``
+
+        Parameters
+        ----------
+        response : dict
+            Response of ``API.file_upload``
+        dataset_id : int
+            Dataset the file was uploaded to
+        callback, timeout :
+            See ``watch_file``
+
+        Returns
+        -------
+        Transfer
+        """
+        if response.get('id') is None:
+            return self.watch_file(dataset_id, response['name'], relative_path=response.get('relative_path'),
+                                   callback=callback, timeout=timeout)
+        transfer = Transfer(dataset_id, file_id=response['id'], name=response.get('name'),
+                            relative_path=response.get('relative_path'), timeout=timeout)
+        return self.__add(transfer, callback)
+
+    def watch_dataset(self, dataset_id, callback=None, timeout=None):
+        """
+        Watches every file within a dataset
+
+        Parameters
+        ----------
+        dataset_id : int
+            Dataset to watch
+        callback, timeout :
+            See ``watch_file``
+
+        Returns
+        -------
+        Transfer
+            Tracked transfer. Its ``future`` resolves with the ``dataset_info`` response once
+            the dataset holds files and all of them are transferred, and fails as soon as one fails
+        """
+        return self.__add(Transfer(dataset_id, timeout=timeout), callback)
+
+    def __resolve(self, transfer, files, response):
+        """
+        Finishes a transfer if the listing shows it completed or failed. Returns True if it did
+        """
+        if transfer.is_dataset:
+            states = [self.classify(item) for item in files]
+            if FAILED in states:
+                failed = [item.get('name') for item, state in zip(files, states) if state == FAILED]
+                transfer._finish(FAILED, response, RuntimeError(
+                    "Transfer of {} in dataset {} failed".format(', '.join(failed), transfer.dataset_id)))
+            elif states and all(state == DONE for state in states):
+                transfer._finish(DONE, response)
+            return transfer.state != PENDING
+        for item in files:
+            if transfer.matches(item):
+                state = self.classify(item)
+                if state == DONE:
+                    transfer._finish(DONE, item)
+                elif state == FAILED:
+                    transfer._finish(FAILED, item, RuntimeError("Transfer of {} in dataset {} failed: {}".format(
+                        item.get('name'), transfer.dataset_id, item)))
+                return transfer.state != PENDING
+        return False
+
+    def __poll(self, watch):
+        with self._condition:
+            transfers = list(watch.transfers)
+        progress = True
+        try:
+            progress = self.__query(watch, transfers)
+        except Exception as exc:
+            # E.g. classify raised or the response was not a dict. Retrying would fail alike
+            logger.warning("Could not resolve transfers in dataset {}: {}".format(watch.dataset_id, exc))
+            for transfer in transfers:
+                if transfer.state == PENDING:
+                    transfer._finish(FAILED, exc=exc)
+        finally:
+            # Always rescheduled, so that the watch never stays marked as polling
+            self.__reschedule(watch, transfers, progress)
+
+    def __query(self, watch, transfers):
+        """
+        Queries the dataset once and resolves its transfers. Returns True on progress
+        """
+        progress = False
+        try:
+            response = self.api.dataset_info(watch.dataset_id)
+            with self._condition:
+                self.num_queries += 1
+        except ValueError as exc:
+            if isinstance(exc, HTTPError) and exc.transient:
+                return self.__query_failed(watch, transfers, exc)
+            # Rejected by DataFlow, e.g. the dataset does not exist
+            for transfer in transfers:
+                transfer._finish(FAILED, exc=exc)
+            progress = True
+        except Exception as exc:
+            return self.__query_failed(watch, transfers, exc)
+        else:
+            watch.errors = 0
+            files = [item for item in response.get('dataset_files', []) if not item.get('is_directory')]
+            for transfer in transfers:
+                progress = self.__resolve(transfer, files, response) or progress
+        return progress
+
+    def __query_failed(self, watch, transfers, exc):
+        """
+        Counts a query that failed for reasons that may go away, e.g. a network error or a 5xx status
+        """
+        watch.errors += 1
+        logger.warning("Could not query dataset {}: {}".format(watch.dataset_id, exc))
+        if self.max_errors and watch.errors >= self.max_errors:
+            for transfer in transfers:
+                transfer._finish(FAILED, exc=exc)
+        return False
+
+    def __reschedule(self, watch, transfers, progress):
+        now = time.time()
+        for transfer in transfers:
+            if transfer.state == PENDING and transfer.deadline is not None and now >= transfer.deadline:
+                transfer._finish(FAILED, exc=TimeoutError("{} did not finish in time".format(transfer)))
+        with self._condition:
+            watch.transfers = [transfer for transfer in watch.transfers if transfer.state == PENDING]
+            if progress:
+                watch.interval = self.min_interval
+            else:
+                watch.interval = min(watch.interval * self.backoff, self.max_interval)
+            delay = watch.interval * (1 + self.jitter * random.random())
+            deadlines = [transfer.deadline for transfer in watch.transfers if transfer.deadline is not None]
+            watch.next_poll = min([now + delay] + deadlines)
+            watch.polling = False
+            if not watch.transfers and self._watches.get(watch.dataset_id) is watch:
+                del self._watches[watch.dataset_id]
+            self._condition.notify_all()
+
+    def poll(self):
+        """
+        Queries every dataset with pending transfers once, regardless of their schedule
+
+        Returns
+        -------
+        int
+            Number of transfers still pending
+        """
+        with self._condition:
+            watches = [watch for watch in self._watches.values() if not watch.polling]
+            for watch in watches:
+                watch.polling = True
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(self.__poll, watches))
+        return len(self.pending)
+
+    def __poll_loop(self):
+        while not self._stop.is_set():
+            with self._condition:
+                now = time.time()
+                due = [watch for watch in self._watches.values() if not watch.polling and watch.next_poll <= now]
+                if not due:
+                    upcoming = [watch.next_poll for watch in self._watches.values() if not watch.polling]
+                    self._condition.wait(min(upcoming) - now if upcoming else None)
+                    continue
+                for watch in due:
+                    watch.polling = True
+            for watch in due:
+                self._executor.submit(self.__poll, watch)
+
+    def start(self):
+        """
+        Starts polling in the background
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._thread = threading.Thread(target=self.__poll_loop, name="ordflow-transfer-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops polling. Pending transfers stay pending
+        """
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def wait_all(self, timeout=None):
+        """
+        Blocks until every watched transfer completed or failed. Starts polling if needed
+
+        Parameters
+        ----------
+        timeout : float, Optional
+            Maximum seconds to wait. Default - wait indefinitely
+
+        Returns
+        -------
+        dict
+            "done", "failed" and "pending" lists of ``Transfer``. "pending" is only
+            non-empty if the timeout elapsed first
+        """
+        self.start()
+        with self._condition:
+            transfers = list(self.transfers)
+        wait([transfer.future for transfer in transfers], timeout=timeout)
+        report = {DONE: [], FAILED: [], PENDING: []}
+        for transfer in transfers:
+            report[transfer.state].append(transfer)
+        return report
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -40,6 +40,7 @@ setup(
     author='S. Somnath',
     author_email='somnaths@ornl.gov',
     install_requires=requirements,
+    entry_points={'console_scripts': ['ordflow=ordflow.cli:main']},
     setup_requires=['pytest-runner'],
     tests_require=['pytest'],
     platforms=['Linux', 'Mac OSX', 'Windows 10/8.1/8/7'],
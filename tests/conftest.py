@@ -0,0 +1,96 @@
+"""
+Shared fixtures: an in-memory HTTP backend standing in for DataFlow
+"""
+from http import HTTPStatus
+import json as jsonlib
+import os
+import re
+import threading
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from ordflow.api import API
+from ordflow.backends import HTTPBackend, HTTPResponse
+
+
+SERVER_URL = "http://dataflow.test/api/v1"
+
+
+class StubRequest(object):
+
+    def __init__(self, method, path, query, json=None, data=None, files=None):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.json = json
+        self.data = data or {}
+        self.files = files or {}
+
+
+class StubBackend(HTTPBackend):
+    """
+    Answers requests with handlers registered per method and path, and records every request
+
+    A handler receives a ``StubRequest`` and returns the decoded JSON body, or a
+    ``(status_code, body)`` tuple, or raises to simulate a network error. Requests
+    without a handler are answered with 404
+    """
+
+    def __init__(self, server_url=SERVER_URL):
+        self.server_url = server_url
+        self.routes = []
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def route(self, method, pattern, handler):
+        """
+        Registers a handler for paths fully matching the regular expression ``pattern``.
+        Later registrations take precedence
+        """
+        if not callable(handler):
+            body = handler
+            handler = lambda request: body  # noqa: E731
+        self.routes.insert(0, (method, re.compile(pattern), handler))
+
+    def calls(self, method=None, pattern=None):
+        """
+        Recorded requests, optionally filtered by method and path
+        """
+        with self._lock:
+            requests = list(self.requests)
+        return [request for request in requests
+                if (method is None or request.method == method) and
+                (pattern is None or re.fullmatch(pattern, request.path))]
+
+    def request(self, method, url, headers=None, json=None, data=None, files=None):
+        parts = urlsplit(url[len(self.server_url):])
+        contents = {}
+        for field, upload in (files or {}).items():
+            name, file_handle = upload if isinstance(upload, tuple) else (None, upload)
+            if name is None and isinstance(getattr(file_handle, 'name', None), str):
+                # Like requests, which sends the base name of the file
+                name = os.path.basename(file_handle.name)
+            contents[field] = (name, file_handle.read())
+        stub_request = StubRequest(method, parts.path.strip('/'), dict(parse_qsl(parts.query)),
+                                   json=json, data=data, files=contents)
+        with self._lock:
+            self.requests.append(stub_request)
+        for route_method, pattern, handler in self.routes:
+            if route_method == method and pattern.fullmatch(stub_request.path):
+                result = handler(stub_request)
+                break
+        else:
+            result = (404, {'error': 'not found'})
+        status, body = result if isinstance(result, tuple) else (200, result)
+        return HTTPResponse(status, HTTPStatus(status).phrase, jsonlib.dumps(body).encode('utf-8'))
+
+
+@pytest.fixture
+def backend():
+    return StubBackend()
+
+
+@pytest.fixture
+def api(backend):
+    return API("secret-key", server_url=SERVER_URL, backend=backend)
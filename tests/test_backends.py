@@ -0,0 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import socket
+import sys
+
+import pytest
+
+from ordflow.api import API
+from ordflow.backends import HTTP2Backend, HTTPError, HTTPResponse, RequestsBackend
+from ordflow.outbox import is_offline_error
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from standin import H2StandInServer, StandInServer  # noqa: E402
+
+
+def closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return "http://127.0.0.1:{}/api/v1".format(port)
+
+
+@pytest.fixture
+def upload_file(tmp_path):
+    path = tmp_path / "scan.txt"
+    path.write_bytes(b"measurement\n" * 100)
+    return str(path)
+
+
+@pytest.mark.parametrize("status_code, transient", [
+    (500, True), (502, True), (503, True), (408, True), (429, True),
+    (400, False), (401, False), (404, False), (None, False),
+])
+def test_http_error_transient(status_code, transient):
+    exc = HTTPError("failed", status_code=status_code, reason="Reason")
+    assert exc.transient is transient
+    assert isinstance(exc, ValueError) and str(exc) == "failed" and exc.reason == "Reason"
+
+
+def test_http_response():
+    response = HTTPResponse(404, "Not Found", b'{"error": "missing"}')
+    assert not response.ok and response.text == '{"error": "missing"}'
+    assert response.json() == {'error': 'missing'} and response.headers == {}
+    assert HTTPResponse(201, "Created", b'{}').ok
+
+
+def exercise(api, upload_file):
+    dataset = api.dataset_create("Run 1", metadata={'sample': "PZT"})
+    response = api.file_upload(upload_file, dataset['id'], relative_path="raw")
+    assert response['name'] == "scan.txt" and response['file_length'] == 1200
+    info = api.dataset_info(dataset['id'])
+    assert [item['name'] for item in info['dataset_files']] == ["scan.txt"]
+    with pytest.raises(HTTPError) as exc_info:
+        api.dataset_info(dataset['id'] + 1000)
+    assert exc_info.value.status_code == 404 and exc_info.value.reason == "Not Found"
+    return dataset
+
+
+def test_requests_backend(upload_file):
+    with StandInServer() as server:
+        backend = RequestsBackend(pool_maxsize=2)
+        api = API(server.api_key, server_url=server.url, backend=backend)
+        exercise(api, upload_file)
+        response = backend.request("GET", server.url + "/instruments",
+                                   headers={'Authorization': "Bearer " + server.api_key})
+        assert response.status_code == 200 and response.reason == "OK"
+        assert response.http_version == "HTTP/1.1" and response.elapsed >= 0
+        assert response.headers['Content-Type'].startswith("application/json")
+        assert isinstance(response.json(), list)
+
+        with pytest.raises(HTTPError) as exc_info:
+            API("wrong-key", server_url=server.url, backend=backend).instrument_list()
+        assert exc_info.value.status_code == 401
+        api.close()
+        assert backend._session is None
+        # A closed backend opens a new session when used again
+        assert api.instrument_list() == response.json()
+        api.close()
+
+
+def test_requests_backend_unreachable():
+    with pytest.raises(OSError) as exc_info:
+        API("key", server_url=closed_port_url(), backend=RequestsBackend()).instrument_list()
+    assert is_offline_error(exc_info.value)
+
+
+@pytest.fixture
+def h2_server():
+    pytest.importorskip("h2")
+    pytest.importorskip("httpx")
+    with H2StandInServer(latency=0.05) as server:
+        yield server
+
+
+def test_http2_backend_multiplexes(h2_server, upload_file):
+    backend = HTTP2Backend(max_connections=1, prior_knowledge=True)
+    try:
+        api = API(h2_server.api_key, server_url=h2_server.url, backend=backend)
+        dataset = exercise(api, upload_file)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            infos = list(executor.map(api.dataset_info, [dataset['id']] * 16))
+        assert all(info['id'] == dataset['id'] for info in infos)
+        # Every request shared the single connection
+        assert h2_server.connections == 1
+        response = backend.request("GET", h2_server.url + "/instruments",
+                                   headers={'authorization': "Bearer " + h2_server.api_key})
+        assert response.http_version == "HTTP/2" and response.ok
+    finally:
+        backend.close()
+
+
+def test_http2_backend_timeout(h2_server):
+    backend = HTTP2Backend(prior_knowledge=True, timeout=0.01)
+    try:
+        with pytest.raises(TimeoutError) as exc_info:
+            API(h2_server.api_key, server_url=h2_server.url, backend=backend).instrument_list()
+        assert is_offline_error(exc_info.value)
+    finally:
+        backend.close()
+
+
+def test_http2_backend_unreachable():
+    pytest.importorskip("httpx")
+    backend = HTTP2Backend(prior_knowledge=True)
+    try:
+        with pytest.raises(ConnectionError) as exc_info:
+            API("key", server_url=closed_port_url(), backend=backend).instrument_list()
+        assert is_offline_error(exc_info.value)
+    finally:
+        backend.close()
+
+
+def test_http2_backend_falls_back_to_http1(upload_file):
+    pytest.importorskip("httpx")
+    with StandInServer() as server:
+        with HTTP2Backend() as backend:
+            exercise(API(server.api_key, server_url=server.url, backend=backend), upload_file)
+            response = backend.request("GET", server.url + "/instruments",
+                                       headers={'Authorization': "Bearer " + server.api_key})
+            assert response.http_version == "HTTP/1.1"
+
+
+def test_http2_backend_close(h2_server):
+    backend = HTTP2Backend(prior_knowledge=True)
+    api = API(h2_server.api_key, server_url=h2_server.url, backend=backend)
+    api.instrument_list()
+    backend.close()
+    assert not backend._thread.is_alive()
+    with pytest.raises(RuntimeError):
+        api.instrument_list()
+    # Closing twice is harmless
+    backend.close()
@@ -0,0 +1,129 @@
+import json
+import os
+
+import pytest
+
+from ordflow import cli
+
+get_api = cli._get_api
+
+
+@pytest.fixture(autouse=True)
+def stub_api(api, monkeypatch, tmp_path):
+    monkeypatch.setattr(cli, '_get_api', lambda args: api)
+    monkeypatch.setenv(cli.THROUGHPUT_ENV, str(tmp_path / "throughput.json"))
+    return api
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / "a"
+    root.mkdir()
+    (root / "scan.txt").write_text("measurement\n")
+    (root / "scan.tmp").write_text("partial\n")
+    return str(root)
+
+
+def run(capsys, *argv):
+    status = cli.main(list(argv))
+    out = capsys.readouterr().out
+    return status, json.loads(out) if out else None
+
+
+def serve_uploads(backend):
+    backend.route("GET", r"datasets/\d+", {'id': 1, 'dataset_files': []})
+    backend.route("POST", "dataset-file-upload", lambda request: {'name': request.files['file'][0]})
+
+
+def test_parser():
+    args = cli.build_parser().parse_args(["upload", "./a", "--dataset-id", "3", "--include", "*.txt",
+                                          "--include", "*.h5", "--dry-run"])
+    assert args.func is cli._cmd_upload and args.dataset_id == 3 and args.dry_run
+    assert args.include == ["*.txt", "*.h5"] and args.workers == 4
+    with pytest.raises(SystemExit):
+        cli.build_parser().parse_args(["upload", "./a"])
+
+
+def test_api_key_is_required(monkeypatch):
+    monkeypatch.delenv(cli.API_KEY_ENV, raising=False)
+    with pytest.raises(SystemExit):
+        get_api(cli.build_parser().parse_args(["instruments"]))
+    api = get_api(cli.build_parser().parse_args(["--api-key", "Bearer abc", "--server-url", "http://df.test",
+                                                 "instruments"]))
+    assert api._API_KEY == "abc" and api._API_URL == "http://df.test"
+
+
+def test_dry_run(backend, capsys, source):
+    serve_uploads(backend)
+    status, summary = run(capsys, "upload", source, "--dataset-id", "1", "--exclude", "*.tmp", "--dry-run")
+    assert status == 0
+    assert summary['files'] == 1 and summary['skip']['files'] == 1
+    assert not backend.calls("POST")
+
+
+def test_upload(backend, capsys, source, tmp_path):
+    serve_uploads(backend)
+    status, results = run(capsys, "upload", source, "--dataset-id", "1", "--exclude", "*.tmp")
+    assert status == 0 and results == {'uploaded': 1, 'changed': [], 'failed': {}}
+    assert [request.files['file'][0] for request in backend.calls("POST")] == ["scan.txt"]
+    # The measured throughput is kept for the estimates of later runs
+    assert os.path.exists(str(tmp_path / "throughput.json"))
+
+
+def test_failed_uploads_exit_non_zero(backend, capsys, source):
+    serve_uploads(backend)
+    backend.route("POST", "dataset-file-upload", (500, {'error': 'internal'}))
+    status, results = run(capsys, "upload", source, "--dataset-id", "1")
+    assert status == 1 and len(results['failed']) == 2
+
+
+def test_saved_plan(backend, capsys, source, tmp_path):
+    serve_uploads(backend)
+    plan = str(tmp_path / "plan.json")
+    status, _ = run(capsys, "upload", source, "--dataset-id", "1", "--exclude", "*.tmp", "--dry-run",
+                    "--plan", plan)
+    assert status == 0 and os.path.exists(plan) and not backend.calls("POST")
+
+    # Executes the reviewed plan, with the filters it was made with
+    status, results = run(capsys, "upload", source, "--dataset-id", "1", "--plan", plan)
+    assert status == 0 and results['uploaded'] == 1
+
+
+@pytest.mark.parametrize("argv", [["--dataset-id", "2"], ["--dataset-id", "1", "--relative-path", "run2"]])
+def test_saved_plan_for_another_upload_is_refused(backend, capsys, source, tmp_path, argv):
+    serve_uploads(backend)
+    plan = str(tmp_path / "plan.json")
+    run(capsys, "upload", source, "--dataset-id", "1", "--dry-run", "--plan", plan)
+    assert cli.main(["upload", source, "--plan", plan] + argv) == 1
+    other = tmp_path / "b"
+    other.mkdir()
+    assert cli.main(["upload", str(other), "--dataset-id", "1", "--plan", plan]) == 1
+    assert "Plan again" in capsys.readouterr().err
+    assert not backend.calls("POST")
+
+
+def test_single_file(backend, capsys, source):
+    serve_uploads(backend)
+    path = os.path.join(source, "scan.txt")
+    assert run(capsys, "upload", path, "--dataset-id", "1", "--dry-run")[1] == {'files': 1, 'bytes': 12}
+    status, response = run(capsys, "upload", path, "--dataset-id", "1", "--relative-path", "raw")
+    assert status == 0 and response == {'name': "scan.txt"}
+    assert backend.calls("POST")[0].data['relative_path'] == "raw"
+
+
+def test_search_many_exits_non_zero_on_failed_datasets(backend, capsys):
+    def search(request):
+        if request.query['dataset_id'] == "2":
+            return 404, {'error': 'no such dataset'}
+        return {'results': [{'id': 1}]}
+
+    backend.route("GET", "dataset-files/search", search)
+    status, merged = run(capsys, "search", "scan", "--files", "--dataset-id", "1", "--dataset-id", "2")
+    assert status == 1
+    assert merged['total'] == 1 and list(merged['failed']) == ["2"]
+
+
+def test_rejection_is_reported(backend, capsys):
+    backend.route("POST", "datasets", (400, {'error': 'bad title'}))
+    assert cli.main(["dataset", "create", "Run 1"]) == 1
+    assert "Bad Request" in capsys.readouterr().err
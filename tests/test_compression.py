@@ -0,0 +1,166 @@
+import gzip
+import hashlib
+import os
+import threading
+
+import pytest
+
+from ordflow import compression
+from ordflow.compression import Compressor
+from ordflow.manifest import Manifest
+
+
+DATA = b"0123456789abcdef" * 64 * 1024
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def frames(tmp_path):
+    path = tmp_path / "frames.raw"
+    path.write_bytes(DATA)
+    return str(path)
+
+
+@pytest.fixture
+def noise(tmp_path):
+    path = tmp_path / "noise.bin"
+    path.write_bytes(os.urandom(256 * 1024))
+    return str(path)
+
+
+def read_in_pieces(reader, size=10000):
+    content = b""
+    while True:
+        data = reader.read(size)
+        if not data:
+            return content
+        content += data
+
+
+def test_estimate_ratio(frames, noise, tmp_path):
+    compressor = Compressor(algorithm="gzip", sample_blocks=3, block_size=16 * 1024)
+    assert compressor.estimate_ratio(frames) > 10
+    assert compressor.estimate_ratio(noise) < 1.1
+    empty = tmp_path / "empty.txt"
+    empty.write_bytes(b"")
+    assert compressor.estimate_ratio(str(empty)) == 1.0
+
+
+def test_should_compress(frames, noise, tmp_path):
+    compressor = Compressor(algorithm="gzip", min_size=64 * 1024)
+    assert compressor.should_compress(frames)
+    assert not compressor.should_compress(noise)
+    small = tmp_path / "small.txt"
+    small.write_bytes(b"a" * 1000)
+    assert not compressor.should_compress(str(small))
+    assert not Compressor(algorithm="gzip", min_ratio=1000).should_compress(frames)
+
+
+def test_gzip_round_trip(frames):
+    compressor = Compressor(algorithm="gzip", chunk_size=100 * 1024, max_workers=2)
+    reader, info = compressor.compress(frames)
+    assert info == {'original_name': "frames.raw", 'original_size': len(DATA),
+                    'compressed_name': "frames.raw.gz", 'algorithm': "gzip"}
+    with reader:
+        content = read_in_pieces(reader)
+    # Concatenated gzip members decompress to the original
+    assert gzip.decompress(content) == DATA
+    assert reader.closed
+    assert info['original_sha256'] == sha256(DATA) and info['compressed_size'] == len(content)
+    assert info['ratio'] == len(DATA) / len(content) and info['compress_seconds'] >= 0
+
+
+def test_close_partially_read(frames):
+    threads = set(threading.enumerate())
+    reader, info = Compressor(algorithm="gzip", chunk_size=16 * 1024, max_workers=2).compress(frames)
+    assert len(reader.read(100)) == 100
+    reader.close()
+    assert reader.closed and reader.source.file_handle.closed
+    # The compression threads were stopped
+    assert set(threading.enumerate()) <= threads
+    assert 'compressed_size' not in info
+
+
+def test_zstd_round_trip(frames):
+    zstandard = pytest.importorskip("zstandard")
+    compressor = Compressor(algorithm="zstd", chunk_size=100 * 1024, max_workers=2)
+    reader, info = compressor.compress(frames)
+    with reader:
+        content = read_in_pieces(reader)
+    assert info['compressed_name'] == "frames.raw.zst"
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(content) == DATA
+    assert info['original_sha256'] == sha256(DATA)
+
+
+def test_zstd_requires_zstandard(monkeypatch):
+    monkeypatch.setattr(compression, 'zstd_available', lambda: False)
+    with pytest.raises(ImportError):
+        Compressor(algorithm="zstd")
+    assert Compressor().algorithm == "gzip" and Compressor().level == 6
+
+
+def test_report():
+    compressor = Compressor(algorithm="gzip")
+    assert compressor.report()['files'] == 0 and compressor.report()['ratio'] is None
+    compressor.record_upload({'original_size': 1000, 'compressed_size': 250, 'compress_seconds': 1.0}, 1.0)
+    compressor.record_upload({'original_size': 500}, 1.0)
+    report = compressor.report()
+    assert report['files'] == 2 and report['compressed_files'] == 1
+    assert report['original_bytes'] == 1500 and report['sent_bytes'] == 750 and report['ratio'] == 2.0
+    assert report['wire_throughput'] == 375.0 and report['effective_throughput'] == 500.0
+    assert report['throughput_gain'] == pytest.approx(4 / 3)
+
+
+@pytest.mark.parametrize("kwargs, error", [
+    ({'algorithm': "bz2"}, ValueError),
+    ({'chunk_size': 0}, ValueError),
+    ({'max_workers': 1.5}, TypeError),
+])
+def test_invalid_arguments(kwargs, error):
+    with pytest.raises(error):
+        Compressor(**kwargs)
+
+
+def serve_uploads(backend):
+    backend.route("POST", "dataset-file-upload", lambda request: {'name': request.files['file'][0]})
+
+
+def test_compressed_upload(backend, api, frames):
+    serve_uploads(backend)
+    compressor = Compressor(algorithm="gzip", chunk_size=256 * 1024, max_workers=2)
+    api.file_upload(frames, 1, compression=compressor)
+
+    request = backend.calls("POST")[0]
+    name, content = request.files['file']
+    assert name == "frames.raw.gz" and gzip.decompress(content) == DATA
+    # Enough to restore the original exactly, without a manifest
+    assert request.data['compression'] == "gzip" and request.data['original_name'] == "frames.raw"
+    assert request.data['original_size'] == len(DATA) and request.data['original_sha256'] == sha256(DATA)
+    assert compressor.records[0]['ratio'] > 1 and compressor.report()['compressed_files'] == 1
+
+
+def test_recorded_during_compressed_upload(backend, api, frames):
+    serve_uploads(backend)
+    manifest = Manifest()
+    compressor = Compressor(algorithm="gzip", chunk_size=256 * 1024, max_workers=2)
+    api.file_upload(frames, 1, compression=compressor, manifest=manifest)
+
+    _, content = backend.calls("POST")[0].files['file']
+    entry = manifest.entries["frames.raw.gz"]
+    assert entry['checksum'] == sha256(DATA) and entry['size'] == len(DATA)
+    assert entry['remote_size'] == len(content)
+
+
+def test_incompressible_upload_is_sent_raw(backend, api, noise):
+    serve_uploads(backend)
+    api.compressor = Compressor(algorithm="gzip")
+    api.file_upload(noise, 1)
+    request = backend.calls("POST")[0]
+    assert request.files['file'][0] == "noise.bin" and 'compression' not in request.data
+    assert api.compressor.report()['compressed_files'] == 0 and api.compressor.report()['files'] == 1
+    # Overrides the compressor of the API
+    api.file_upload(noise, 1, compression=False)
+    assert api.compressor.report()['files'] == 1
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from ordflow.encoding import ArrayEncoder
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.mark.parametrize("value, expected", [
+    (np.int64(7), 7),
+    (np.float32(0.5), 0.5),
+    (np.bool_(True), True),
+    (np.float64('nan'), None),
+    (np.float64('-inf'), None),
+    (np.bytes_(b"abc"), "abc"),
+    (np.str_("abc"), "abc"),
+    (np.datetime64('2020-01-02'), "2020-01-02"),
+    (np.complex128(1 + 2j), "(1+2j)"),
+])
+def test_encode_scalar(value, expected):
+    encoded = ArrayEncoder.encode_scalar(value)
+    assert encoded == expected and type(encoded) is type(expected)
+
+
+def test_small_array_inline():
+    encoded = ArrayEncoder().encode({'pos': np.arange(6).reshape(2, 3), 'zero': np.array(3.0)})
+    assert encoded == {'pos': [[0, 1, 2], [3, 4, 5]], 'zero': 3.0}
+
+
+def test_non_finite_values_become_none():
+    array = np.array([1.0, np.nan, np.inf, -np.inf])
+    assert ArrayEncoder().encode({'x': array}) == {'x': [1.0, None, None, None]}
+    chunked = ArrayEncoder(policy='chunk', max_elements=2, chunk_size=3).encode({'x': array})
+    assert chunked == {'x-shape': [4], 'x-dtype': 'float64', 'x-0': [1.0, None, None], 'x-1': [None]}
+    json.dumps(chunked, allow_nan=False)
+
+
+def test_summarize():
+    array = np.arange(2000, dtype=float)
+    array[5] = np.nan
+    encoded = ArrayEncoder(max_elements=1000).encode({'x': array})
+    assert encoded['x-shape'] == [2000] and encoded['x-dtype'] == 'float64'
+    assert encoded['x-min'] == 0.0 and encoded['x-max'] == 1999.0
+    assert len(encoded['x-sha256']) == 64
+
+
+def test_summarize_all_nan():
+    encoded = ArrayEncoder(max_elements=1).encode({'x': np.full(4, np.nan)})
+    assert encoded['x-min'] is None and encoded['x-max'] is None
+
+
+def test_chunk_order():
+    encoded = ArrayEncoder(policy='chunk', max_elements=4, chunk_size=4).encode({'x': np.arange(10).reshape(2, 5)})
+    assert [encoded['x-{}'.format(index)] for index in range(3)] == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+
+def test_lists_of_numpy_scalars():
+    encoder = ArrayEncoder(policy='chunk', max_elements=2, chunk_size=2)
+    assert encoder.encode({'x': [np.float64(1.5), np.float64('nan')]}) == {'x': [1.5, None]}
+    # Long lists follow the array policy
+    assert encoder.encode({'x': (np.int32(1), np.int32(2), np.int32(3))}) == \
+        {'x-shape': [3], 'x-dtype': 'int32', 'x-0': [1, 2], 'x-1': [3]}
+    # Mixed lists are converted element by element rather than cast to strings
+    assert encoder.encode({'x': [np.int64(1), "a", None]}) == {'x': [1, "a", None]}
+    # Ragged nesting is converted element by element as well
+    assert encoder.encode({'x': [np.float64(1.0), [1, 2]]}) == {'x': [1.0, [1, 2]]}
+
+
+def test_nested_lists_of_numpy_values():
+    encoder = ArrayEncoder()
+    assert encoder.encode({'x': [[np.int64(1)]]}) == {'x': [[1]]}
+    assert encoder.encode({'x': ([np.float32(0.5), np.float32(1.5)], (2.5, 3.5))}) == {'x': [[0.5, 1.5], [2.5, 3.5]]}
+    assert encoder.encode({'x': ["a", [np.int64(1), ("b", np.bool_(True))]]}) == {'x': ["a", [1, ["b", True]]]}
+    assert encoder.encode({'x': [1, [np.arange(2), np.float64('inf')]]}) == {'x': [1, [[0, 1], None]]}
+    assert json.dumps(encoder.encode({'x': [[np.int64(1)], [np.int64(2), "c"]]}))
+
+
+def test_native_values_pass_through():
+    flat = {'a': 1, 'b': [1, 2], 'c': "text", 'd': float('nan')}
+    assert ArrayEncoder().encode(flat) == flat
+
+
+def test_dataset_create_payload(backend, api):
+    backend.route("POST", "datasets", lambda request: request.json)
+    api.dataset_create("Run 1", metadata={'detector': {'gain': np.float32(2.0), 'mask': np.array([True, False])},
+                                          'counts': [np.int64(3), np.int64(4)]})
+    fields = {field['field_name']: field['field_value']
+              for field in backend.calls("POST")[0].json['metadata_field_values_attributes']}
+    assert fields == {'detector-gain': 2.0, 'detector-mask': [True, False], 'counts': [3, 4]}
+
+
+@pytest.mark.parametrize("kwargs, error", [
+    ({'policy': 'compress'}, ValueError),
+    ({'max_elements': 0}, ValueError),
+    ({'chunk_size': 1.5}, TypeError),
+])
+def test_invalid_arguments(kwargs, error):
+    with pytest.raises(error):
+        ArrayEncoder(**kwargs)
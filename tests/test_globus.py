@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+from ordflow.globus import EndpointReadiness, activation_ready
+
+
+ACTIVATION = r"transports/globus/activation"
+
+
+def activation(code='AlreadyActivated', expires_in=3600):
+    return {'source': {'code': code, 'expires_in': expires_in},
+            'destination': {'code': code, 'expires_in': expires_in}}
+
+
+@pytest.mark.parametrize("status, ready", [
+    ({'code': 'AlreadyActivated'}, True),
+    ({'code': 'AutoActivated.CachedCredential'}, True),
+    ({'code': 'Activated.MyProxyCredential'}, True),
+    ({'code': 'AutoActivationFailed'}, False),
+    ({'code': 'NotActivated'}, False),
+    ({}, False),
+    ('AlreadyActivated', False),
+])
+def test_activation_ready(status, ready):
+    assert activation_ready(status) is ready
+
+
+def test_result_is_cached(backend, api):
+    backend.route("GET", ACTIVATION, activation())
+    readiness = EndpointReadiness(api)
+    for _ in range(5):
+        readiness.ensure_ready()
+    assert readiness.num_checks == 1
+    assert readiness.is_ready
+    assert 3500 < readiness.expires_in <= 3600
+
+
+def test_expiring_activation_is_not_ready(backend, api):
+    backend.route("GET", ACTIVATION, activation(expires_in=30))
+    readiness = EndpointReadiness(api, refresh_margin=60)
+    assert not readiness.check()
+    assert not readiness.is_ready
+
+
+def test_unrecognized_status_raises(backend, api):
+    backend.route("GET", ACTIVATION, {'active': True})
+    readiness = EndpointReadiness(api)
+    with pytest.raises(ValueError):
+        readiness.check()
+    assert not readiness.is_ready and readiness.expires_in is None
+
+
+def test_ensure_ready_times_out(backend, api):
+    backend.route("GET", ACTIVATION, activation(code='NotActivated'))
+    readiness = EndpointReadiness(api, retry_interval=0.05, wait_timeout=0.2)
+    t_start = time.time()
+    with pytest.raises(RuntimeError):
+        readiness.ensure_ready()
+    assert time.time() - t_start < 2
+    assert EndpointReadiness(api).wait_timeout is not None
+
+
+def test_wait_ready_rechecks_until_active(backend, api):
+    responses = [activation(code='NotActivated')] * 2 + [activation()]
+    backend.route("GET", ACTIVATION, lambda request: responses.pop(0) if len(responses) > 1 else responses[0])
+    readiness = EndpointReadiness(api, retry_interval=0.05)
+    assert readiness.wait_ready(timeout=2)
+    assert readiness.num_checks == 3
+
+
+def test_refreshes_before_expiry(backend, api):
+    backend.route("GET", ACTIVATION, activation(expires_in=0.3))
+    with EndpointReadiness(api, refresh_margin=0.2, retry_interval=0.05) as readiness:
+        assert readiness.wait_ready(timeout=1)
+        time.sleep(0.6)
+        # Checked about every 0.1 s, i.e. the lifetime less the margin
+        assert 3 <= readiness.num_checks <= 12
+        assert readiness.wait_ready(timeout=1)
+
+
+def test_does_not_spin_while_expiring(backend, api):
+    # Reported lifetimes within the margin never count as ready
+    backend.route("GET", ACTIVATION, activation(expires_in=0.1))
+    with EndpointReadiness(api, refresh_margin=0.2, retry_interval=0.05) as readiness:
+        time.sleep(0.5)
+        assert not readiness.is_ready
+    assert readiness.num_checks <= 15
+
+
+def test_gates_file_upload(backend, api, tmp_path):
+    backend.route("GET", ACTIVATION, activation(code='NotActivated'))
+    backend.route("POST", "dataset-file-upload", {'id': 1})
+    path = tmp_path / "scan.txt"
+    path.write_text("measurement\n")
+    api.endpoint_readiness = EndpointReadiness(api, retry_interval=0.05, wait_timeout=0.1)
+    with pytest.raises(RuntimeError):
+        api.file_upload(str(path), 1)
+    assert not backend.calls("POST")
+
+
+def test_wait_ready_survives_concurrent_invalidation(backend, api):
+    backend.route("GET", ACTIVATION, activation(code='NotActivated'))
+    readiness = EndpointReadiness(api, retry_interval=0.05)
+    check = readiness.check
+
+    def check_then_invalidate():
+        # As if a transfer failed right after the check
+        ready = check()
+        readiness.invalidate()
+        return ready
+
+    readiness.check = check_then_invalidate
+    assert not readiness.wait_ready(timeout=0.2)
+    assert readiness.num_checks >= 2
+
+
+def test_refresher_retries_after_errors(backend, api):
+    backend.route("GET", ACTIVATION, (500, {'error': 'internal'}))
+    with EndpointReadiness(api, retry_interval=0.05) as readiness:
+        time.sleep(0.3)
+        assert not readiness.is_ready and readiness.expires_in is not None
+    assert 2 <= len(backend.calls("GET", ACTIVATION)) <= 15
@@ -0,0 +1,85 @@
+import hashlib
+import os
+
+import pytest
+
+from ordflow.manifest import Manifest, file_checksum
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / "src"
+    (root / "sub").mkdir(parents=True)
+    (root / "a.txt").write_bytes(b"alpha")
+    (root / "b.log").write_bytes(b"bravo!")
+    (root / "sub" / "c.txt").write_bytes(b"charlie")
+    return str(root)
+
+
+def remote(name, data, relative_path=None, **kwargs):
+    item = {'name': name, 'relative_path': relative_path, 'file_length': len(data), 'sha256': sha256(data)}
+    item.update(kwargs)
+    return item
+
+
+@pytest.mark.parametrize("data", [b"", b"x" * 1000])
+def test_file_checksum(tmp_path, data):
+    path = tmp_path / "file.bin"
+    path.write_bytes(data)
+    assert file_checksum(str(path), block_size=64) == (len(data), sha256(data))
+
+
+def test_build_uses_planner_filters_and_mapping(source):
+    manifest = Manifest.build(source, relative_path="run1", include=["*.txt"], max_workers=2)
+    assert sorted(manifest.entries) == ["run1/a.txt", "run1/sub/c.txt"]
+    entry = manifest.entries["run1/sub/c.txt"]
+    assert entry['relative_path'] == "run1/sub" and entry['size'] == 7 and entry['checksum'] == sha256(b"charlie")
+
+
+def test_verify(backend, api, source):
+    manifest = Manifest.build(source)
+    manifest.add("lost.txt", 4, sha256(b"lost"))
+    backend.route("GET", r"datasets/1", {'id': 1, 'dataset_files': [
+        remote("a.txt", b"alpha"),
+        # Truncated on the way
+        remote("b.log", b"bravo"),
+        # Same size, different contents
+        remote("c.txt", b"CHARLIE", relative_path="/sub/"),
+        remote("unexpected.txt", b"?"),
+        {'name': "sub", 'relative_path': None, 'is_directory': True}]})
+
+    report = manifest.verify(api, 1)
+    assert report['matched'] == 1
+    assert report['missing'] == ["lost.txt"]
+    assert report['extra'] == ["unexpected.txt"]
+    assert sorted(report['mismatched']) == ["b.log", "sub/c.txt"]
+    assert report['mismatched']["b.log"]['found'] == {'size': 5, 'checksum': sha256(b"bravo")}
+    assert report['mismatched']["sub/c.txt"]['expected']['checksum'] == sha256(b"charlie")
+
+
+def test_verify_without_remote_checksums(backend, api, source):
+    manifest = Manifest.build(source)
+    backend.route("GET", r"datasets/1", {'id': 1, 'dataset_files': [
+        {'name': "a.txt", 'file_length': 5}, {'name': "b.log", 'file_length': 6},
+        {'name': "c.txt", 'relative_path': "sub", 'file_length': 7}]})
+    assert manifest.verify(api, 1)['matched'] == 3
+
+
+def test_save_and_load(source, tmp_path):
+    manifest = Manifest.build(source, relative_path="run1")
+    path = str(tmp_path / "manifest.jsonl")
+    manifest.save(path)
+    loaded = Manifest.load(path)
+    assert loaded.algorithm == "sha256" and loaded.entries == manifest.entries
+
+
+def test_recorded_during_upload(backend, api, source):
+    backend.route("POST", "dataset-file-upload", lambda request: {'name': request.files['file'][0]})
+    manifest = Manifest()
+    api.file_upload(os.path.join(source, "sub", "c.txt"), 1, relative_path="sub", manifest=manifest)
+    assert manifest.entries["sub/c.txt"]['checksum'] == sha256(b"charlie")
+    assert backend.calls("POST")[0].files['file'][1] == b"charlie"
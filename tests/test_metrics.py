@@ -0,0 +1,73 @@
+import pytest
+
+from ordflow.metrics import MovingAverage, ThroughputMeter
+
+
+def test_nothing_measured():
+    meter = ThroughputMeter()
+    assert meter.fit() is None and meter.rate is None and meter.estimate(1000) is None
+
+
+def test_fits_overhead_and_rate():
+    meter = ThroughputMeter()
+    # 0.5 s per file plus 100 bytes per second
+    for num_bytes in [100, 1000, 10000]:
+        meter.record(num_bytes, 0.5 + num_bytes / 100)
+    overhead, rate = meter.fit()
+    assert overhead == pytest.approx(0.5) and rate == pytest.approx(100)
+    assert meter.estimate(1000, num_files=10) == pytest.approx(15)
+    # Files are spread over the concurrent transfers, but no further than one file each
+    assert meter.estimate(1000, num_files=10, concurrency=4) == pytest.approx(15 / 4)
+    assert meter.estimate(1000, num_files=2, concurrency=4) == pytest.approx(11 / 2)
+
+
+def test_equal_sizes_fall_back_to_the_mean_rate():
+    meter = ThroughputMeter()
+    for seconds in [1.0, 3.0]:
+        meter.record(1000, seconds)
+    assert meter.fit() == (0.0, 500.0)
+
+
+def test_timings_unrelated_to_size():
+    meter = ThroughputMeter()
+    meter.record(10, 2.0)
+    meter.record(1000, 1.0)
+    overhead, rate = meter.fit()
+    assert overhead == pytest.approx(1.5) and rate == float('inf')
+    assert meter.estimate(10 ** 9, num_files=2) == pytest.approx(3.0)
+
+
+def test_window():
+    meter = ThroughputMeter(window=2)
+    for seconds in [100.0, 1.0, 1.0]:
+        meter.record(1000, seconds)
+    assert meter.rate == 1000.0
+
+
+def test_save_and_load(tmp_path):
+    meter = ThroughputMeter()
+    meter.record(1000, 2.0)
+    path = str(tmp_path / "cache" / "throughput.json")
+    meter.save(path)
+
+    loaded = ThroughputMeter()
+    loaded.load(path)
+    assert loaded.rate == 500.0
+
+    restored = ThroughputMeter(window=1)
+    restored.record(3000, 2.0)
+    restored.load(path)
+    # Saved transfers count as older than the ones recorded in this session
+    assert restored.rate == 1500.0
+
+    (tmp_path / "bad.json").write_text('{"samples": []}')
+    with pytest.raises(ValueError):
+        restored.load(str(tmp_path / "bad.json"))
+
+
+def test_moving_average():
+    average = MovingAverage(0.5)
+    assert average.value is None
+    average.update(4.0)
+    average.update(2.0)
+    assert average.value == 3.0
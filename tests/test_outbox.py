@@ -0,0 +1,214 @@
+import threading
+import time
+
+import pytest
+
+from ordflow.backends import HTTPError
+from ordflow.outbox import Outbox, is_offline_error, is_pending_id
+
+
+def unreachable(request):
+    raise ConnectionError("Connection refused")
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for index in range(3):
+        path = tmp_path / "data" / "scan_{}.txt".format(index)
+        path.parent.mkdir(exist_ok=True)
+        path.write_text("measurement {}\n".format(index))
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def outbox(api, tmp_path):
+    return Outbox(api, str(tmp_path / "outbox"))
+
+
+def serve(backend, dataset_id=42):
+    backend.route("POST", "datasets", lambda request: {'id': dataset_id, 'name': request.json['name']})
+    backend.route("POST", "dataset-file-upload", lambda request: {'name': request.files['file'][0]})
+    backend.route("POST", "user-settings", lambda request: {'setting': request.query['setting']})
+
+
+@pytest.mark.parametrize("exc, offline", [
+    (ConnectionError("refused"), True),
+    (TimeoutError("timed out"), True),
+    (HTTPError("Service Unavailable", status_code=503), True),
+    (HTTPError("Request Timeout", status_code=408), True),
+    (HTTPError("Too Many Requests", status_code=429), True),
+    (HTTPError("Bad Request", status_code=400), False),
+    (HTTPError("Not Found", status_code=404), False),
+    (FileNotFoundError("missing"), False),
+    (ValueError("invalid"), False),
+])
+def test_is_offline_error(exc, offline):
+    assert is_offline_error(exc) is offline
+
+
+def test_sends_directly_while_online(backend, outbox, files):
+    serve(backend)
+    assert outbox.dataset_create("Run 1") == {'id': 42, 'name': "Run 1"}
+    outbox.file_upload(files[0], 42)
+    assert outbox.backlog()['entries'] == 0
+    assert len(backend.calls("POST", "dataset-file-upload")) == 1
+
+
+def test_journals_while_unreachable_and_resolves_placeholders(backend, outbox, files):
+    backend.route("POST", "datasets", unreachable)
+    dataset = outbox.dataset_create("Run 1", metadata={'temperature': 300})
+    assert dataset['pending'] and is_pending_id(dataset['id'])
+    for path in files:
+        outbox.file_upload(path, dataset['id'], relative_path="raw")
+    outbox.settings_set("transport", "globus")
+    assert outbox.backlog()['entries'] == 5
+
+    serve(backend)
+    results = outbox.drain()
+    assert results == {'sent': 5, 'failed': 0, 'held': 0, 'offline': False, 'remaining': 0}
+    assert outbox.offline_since is None
+
+    paths = [request.path for request in backend.calls("POST")]
+    # The dataset is created before any file is uploaded to it
+    assert paths.index("datasets") < paths.index("dataset-file-upload")
+    uploads = backend.calls("POST", "dataset-file-upload")
+    assert sorted(request.files['file'][1] for request in uploads) == \
+        [b"measurement 0\n", b"measurement 1\n", b"measurement 2\n"]
+    assert all(request.data['dataset_id'] == 42 for request in uploads)
+    assert all(request.data['relative_path'] == "raw" for request in uploads)
+
+
+def test_placeholder_resolves_after_restart(backend, api, tmp_path, files):
+    backend.route("POST", "datasets", unreachable)
+    directory = str(tmp_path / "outbox")
+    dataset = Outbox(api, directory).dataset_create("Run 1")
+    serve(backend, dataset_id=7)
+    Outbox(api, directory).drain()
+    # A new instance still knows the real ID of the placeholder
+    Outbox(api, directory).file_upload(files[0], dataset['id'])
+    assert backend.calls("POST", "dataset-file-upload")[0].data['dataset_id'] == 7
+
+
+def test_5xx_journals_and_is_retried(backend, outbox, files):
+    backend.route("POST", "dataset-file-upload", (503, {'error': 'maintenance'}))
+    entry = outbox.file_upload(files[0], 42)
+    assert entry['op'] == 'file_upload'
+    assert outbox.offline_since is not None
+
+    # Later calls for the same dataset are journaled behind the first one
+    outbox.file_upload(files[1], 42)
+    results = outbox.drain()
+    assert results['offline'] and results['failed'] == 0 and results['remaining'] == 2
+
+    serve(backend)
+    assert outbox.drain()['sent'] == 2
+    assert outbox.backlog()['entries'] == 0
+
+
+def test_rejection_is_raised_not_journaled(backend, outbox, files):
+    backend.route("POST", "dataset-file-upload", (400, {'error': 'bad dataset'}))
+    with pytest.raises(HTTPError) as exc_info:
+        outbox.file_upload(files[0], 42)
+    assert exc_info.value.status_code == 400
+    assert outbox.backlog()['entries'] == 0
+
+
+def test_settings_keep_their_order(backend, outbox):
+    backend.route("POST", "user-settings", unreachable)
+    for value in ["a", "b", "c", "d"]:
+        outbox.settings_set("transport", value)
+    attempted = len(backend.calls())
+    serve(backend)
+    outbox.drain(max_workers=4)
+    assert [request.query['value'] for request in backend.calls("POST", "user-settings")[attempted:]] == \
+        ["a", "b", "c", "d"]
+
+
+def test_uploads_of_a_dataset_drain_concurrently(backend, outbox, files):
+    backend.route("POST", "datasets", unreachable)
+    dataset = outbox.dataset_create("Run 1")
+    for path in files:
+        outbox.file_upload(path, dataset['id'])
+
+    serve(backend)
+    # Each upload only returns once all of them are in flight
+    barrier = threading.Barrier(len(files), timeout=5)
+
+    def upload(request):
+        barrier.wait()
+        return {'name': request.files['file'][0]}
+
+    backend.route("POST", "dataset-file-upload", upload)
+    results = outbox.drain(max_workers=4)
+    assert results['sent'] == 4 and results['failed'] == 0
+
+
+def test_rejected_create_holds_uploads_until_requeued(backend, outbox, files):
+    backend.route("POST", "datasets", unreachable)
+    dataset = outbox.dataset_create("Run 1")
+    for path in files:
+        outbox.file_upload(path, dataset['id'])
+
+    backend.route("POST", "datasets", (400, {'error': 'unknown instrument'}))
+    results = outbox.drain()
+    assert results['failed'] == 1 and results['held'] == 3 and results['remaining'] == 3
+    assert not backend.calls("POST", "dataset-file-upload")
+
+    serve(backend)
+    assert outbox.requeue_failed() == 1
+    results = outbox.drain()
+    assert results['sent'] == 4 and results['remaining'] == 0
+    assert [request.data['dataset_id'] for request in backend.calls("POST", "dataset-file-upload")] == [42] * 3
+
+
+def test_changed_file_is_moved_aside(backend, outbox, files):
+    backend.route("POST", "dataset-file-upload", unreachable)
+    outbox.file_upload(files[0], 42)
+    with open(files[0], 'a') as file_handle:
+        file_handle.write("appended\n")
+
+    serve(backend)
+    results = outbox.drain()
+    assert results['failed'] == 1 and results['sent'] == 0
+    assert outbox.backlog()['entries'] == 0
+
+
+def test_quota(backend, api, tmp_path, files):
+    backend.route("POST", "dataset-file-upload", unreachable)
+    outbox = Outbox(api, str(tmp_path / "outbox"), max_bytes=600)
+    with pytest.raises(OSError):
+        for path in files * 4:
+            outbox.file_upload(path, 42)
+
+
+def test_concurrent_drains_send_each_entry_once(backend, outbox, tmp_path):
+    backend.route("POST", "dataset-file-upload", unreachable)
+    for index in range(5):
+        path = tmp_path / "scan_{}.txt".format(index)
+        path.write_text("measurement {}\n".format(index))
+        outbox.file_upload(str(path), 42)
+    attempted = len(backend.calls())
+
+    serve(backend)
+    uploading = threading.Event()
+
+    def upload(request):
+        uploading.set()
+        # Keeps the first drain busy while the second one starts
+        time.sleep(0.05)
+        return {'name': request.files['file'][0]}
+
+    backend.route("POST", "dataset-file-upload", upload)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(outbox.drain(max_workers=2))) for _ in range(2)]
+    threads[0].start()
+    uploading.wait(5)
+    threads[1].start()
+    for thread in threads:
+        thread.join()
+
+    assert len(backend.calls("POST", "dataset-file-upload")) - attempted == 5
+    assert sorted(result['sent'] for result in results) == [0, 5]
+    assert outbox.backlog()['entries'] == 0
@@ -0,0 +1,178 @@
+import gzip
+import os
+import queue
+import threading
+import time
+
+import pytest
+
+from ordflow.compression import Compressor
+from ordflow.manifest import Manifest
+from ordflow.pipeline import FunctionStage, HashStage, Pipeline, Stage, StageMetrics, UploadStage, \
+    upload_pipeline
+
+
+def halve(item):
+    if item % 2:
+        # Dropped
+        return None
+    if item == 4:
+        raise ValueError("four")
+    return item // 2
+
+
+def slow(item):
+    time.sleep(0.02)
+    return item
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / "src"
+    (root / "sub").mkdir(parents=True)
+    (root / "a.txt").write_bytes(b"alpha")
+    (root / "frames.raw").write_bytes(b"0123456789abcdef" * 16 * 1024)
+    (root / "sub" / "c.txt").write_bytes(b"charlie")
+    return str(root)
+
+
+def serve_uploads(backend):
+    backend.route("POST", "dataset-file-upload", lambda request: {'name': request.files['file'][0]})
+
+
+def uploaded_names(backend):
+    return sorted(request.files['file'][0] for request in backend.calls("POST"))
+
+
+def test_items_flow_through_stages():
+    stages = [FunctionStage(lambda item: range(item), expands=True, name="expand"),
+              FunctionStage(halve, workers=3)]
+    pipeline = Pipeline(stages, queue_size=2)
+    assert repr(pipeline) == "Pipeline(expand(workers=1) -> halve(workers=3))"
+    result = pipeline.run([3, 6])
+    assert sorted(result['completed']) == [0, 0, 1, 1] and pipeline.done
+    assert [(name, item, str(exc)) for name, item, exc in result['failed']] == [("halve", 4, "four")]
+    expand, halved = result['metrics']
+    assert (expand['items_in'], expand['items_out'], expand['failed']) == (2, 9, 0)
+    assert (halved['items_in'], halved['items_out'], halved['failed']) == (9, 4, 1)
+    assert halved['workers'] == 3 and halved['queue_depth'] == 0
+
+
+def test_queues_are_bounded():
+    pipeline = Pipeline([FunctionStage(lambda item: item), FunctionStage(slow)], queue_size=2)
+    result = pipeline.run(range(20), timeout=10)
+    assert len(result['completed']) == 20
+    assert all(metrics['max_queue_depth'] <= 2 for metrics in result['metrics'])
+
+
+def test_bottleneck():
+    pipeline = Pipeline([FunctionStage(lambda item: item, name="fast"), FunctionStage(slow)])
+    assert pipeline.bottleneck() is None
+    pipeline.run(range(10), timeout=10)
+    assert pipeline.bottleneck() == "slow"
+    fast, slowest = pipeline.metrics()
+    assert 0 <= fast['utilization'] < slowest['utilization'] <= 1.05
+    assert slowest['items_per_second'] > 0
+
+
+def test_sink_without_keeping_results():
+    received = []
+    lock = threading.Lock()
+
+    def sink(item):
+        if item == 3:
+            raise IOError("disk full")
+        with lock:
+            received.append(item)
+
+    pipeline = Pipeline([FunctionStage(lambda item: item, workers=2)], sink=sink, keep_results=False)
+    result = pipeline.run(range(5))
+    assert sorted(received) == [0, 1, 2, 4]
+    assert result['completed'] == [] and pipeline.results == []
+    # Failures of the sink are reported as failures of the last stage
+    assert [(name, item) for name, item, _ in result['failed']] == [("<lambda>", 3)]
+
+
+def test_failing_feed_is_reported():
+    def items():
+        yield 1
+        raise IOError("lost the listing")
+
+    result = Pipeline([FunctionStage(lambda item: item)]).run(items())
+    assert result['completed'] == [1]
+    assert [(name, item) for name, item, _ in result['failed']] == [("feed", None)]
+
+
+def test_run_once_and_timeout():
+    release = threading.Event()
+    pipeline = Pipeline([FunctionStage(lambda item: release.wait(5))]).start([1])
+    try:
+        with pytest.raises(TimeoutError):
+            pipeline.join(timeout=0.05)
+        assert not pipeline.done
+        with pytest.raises(RuntimeError):
+            pipeline.start([2])
+    finally:
+        release.set()
+    assert pipeline.join(timeout=5)['completed'] == [True]
+
+
+def test_stage_metrics():
+    stage = FunctionStage(lambda item: item, workers=2)
+    metrics = StageMetrics(stage, queue.Queue())
+    assert metrics.to_dict()['utilization'] == 0.0
+    metrics.started = time.perf_counter() - 1.0
+    metrics.record(0.5, 2)
+    metrics.record(0.5, 0, failed=True)
+    metrics.finished = metrics.started + 1.0
+    assert metrics.to_dict() == {'stage': "<lambda>", 'workers': 2, 'items_in': 2, 'items_out': 2, 'failed': 1,
+                                 'queue_depth': 0, 'max_queue_depth': 0, 'utilization': 0.5,
+                                 'items_per_second': 2.0}
+
+
+@pytest.mark.parametrize("args, kwargs, error", [
+    (([],), {}, ValueError),
+    (([lambda item: item],), {}, TypeError),
+    (([Stage()],), {'queue_size': 0}, ValueError),
+    (([Stage()],), {'sink': "results.txt"}, TypeError),
+])
+def test_invalid_arguments(args, kwargs, error):
+    with pytest.raises(error):
+        Pipeline(*args, **kwargs)
+    with pytest.raises(ValueError):
+        Stage(workers=0)
+
+
+def test_upload_pipeline(backend, api, source):
+    serve_uploads(backend)
+    manifest = Manifest()
+    compressor = Compressor(algorithm="gzip", min_size=64 * 1024)
+    pipeline = upload_pipeline(api, 1, relative_path="run1", compressor=compressor, manifest=manifest,
+                               keep_results=False)
+    assert [type(stage).__name__ for stage in pipeline.stages] == ["ScanStage", "CompressStage", "UploadStage"]
+    result = pipeline.run([source], timeout=10)
+    assert not result['failed'] and result['metrics'][-1]['items_out'] == 3
+    assert uploaded_names(backend) == ["a.txt", "c.txt", "frames.raw.gz"]
+    frames = [request for request in backend.calls("POST") if request.files['file'][0] == "frames.raw.gz"][0]
+    assert gzip.decompress(frames.files['file'][1]) == b"0123456789abcdef" * 16 * 1024
+    assert frames.data['relative_path'] == "run1"
+    assert sorted(manifest.entries) == ["run1/a.txt", "run1/frames.raw.gz", "run1/sub/c.txt"]
+    assert manifest.entries["run1/frames.raw.gz"]['size'] == 16 * 16 * 1024
+
+
+def test_upload_pipeline_resumes(backend, api, source):
+    serve_uploads(backend)
+    uploaded = Manifest()
+    upload_pipeline(api, 1, manifest=uploaded).run([source], timeout=10)
+    assert len(backend.calls("POST")) == 3
+
+    with open(os.path.join(source, "a.txt"), 'wb') as file_handle:
+        file_handle.write(b"alpha, edited")
+    manifest = Manifest()
+    pipeline = upload_pipeline(api, 1, manifest=manifest, uploaded=uploaded)
+    assert isinstance(pipeline.stages[1], HashStage) and isinstance(pipeline.stages[-1], UploadStage)
+    result = pipeline.run([source], timeout=10)
+    # Only the changed file is sent again
+    assert [item['path'] for item in result['completed']] == [os.path.join(source, "a.txt")]
+    assert uploaded_names(backend) == ["a.txt", "a.txt", "c.txt", "frames.raw"]
+    assert list(manifest.entries) == ["a.txt"] and manifest.entries["a.txt"]['size'] == 13
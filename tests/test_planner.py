@@ -0,0 +1,139 @@
+import errno
+import os
+
+import pytest
+
+from ordflow.manifest import Manifest
+from ordflow.pipeline import ScanStage
+from ordflow.planner import DEDUPLICATE, SKIP, UPLOAD, UploadPlan, UploadPlanner, destination_path, \
+    matches_filters
+
+
+@pytest.fixture
+def source(tmp_path):
+    """
+    src/a.txt, src/b.log, src/empty.txt, src/sub/c.txt, src/sub/deep/d.txt and src/link -> src/sub
+    """
+    root = tmp_path / "src"
+    (root / "sub" / "deep").mkdir(parents=True)
+    (root / "a.txt").write_bytes(b"a" * 5)
+    (root / "b.log").write_bytes(b"b" * 3)
+    (root / "empty.txt").write_bytes(b"")
+    (root / "sub" / "c.txt").write_bytes(b"c" * 4)
+    (root / "sub" / "deep" / "d.txt").write_bytes(b"d" * 2)
+    os.symlink(str(root / "sub"), str(root / "link"))
+    return str(root)
+
+
+def by_path(plan):
+    return {os.path.relpath(entry['path'], plan.source).replace(os.sep, '/'): entry for entry in plan.entries}
+
+
+@pytest.mark.parametrize("rel_path, include, exclude, expected", [
+    ("a.txt", None, None, True),
+    ("sub/c.txt", ["*.txt"], None, True),
+    ("sub/c.txt", ["sub/*"], None, True),
+    ("b.log", ["*.txt"], None, False),
+    ("sub/c.txt", ["*.txt"], ["sub/*"], False),
+    ("sub/c.txt", None, ["c.txt"], False),
+])
+def test_matches_filters(rel_path, include, exclude, expected):
+    assert matches_filters(rel_path, include=include, exclude=exclude) is expected
+
+
+@pytest.mark.parametrize("rel_path, relative_path, expected", [
+    ("a.txt", None, None),
+    ("a.txt", "run1", "run1"),
+    ("a.txt", "/run1/", "run1"),
+    ("sub/deep/d.txt", None, "sub/deep"),
+    ("sub/deep/d.txt", "run1/", "run1/sub/deep"),
+])
+def test_destination_path(rel_path, relative_path, expected):
+    assert destination_path(rel_path, relative_path) == expected
+
+
+def test_iter_scan_yields_per_directory(source):
+    batches = list(UploadPlanner(max_workers=2).iter_scan(source))
+    # The link to a directory is reported as a file of src, not listed as a directory
+    assert len(batches) == 3
+    assert sorted(len(batch) for batch in batches) == [1, 1, 4]
+
+
+def test_plan(source):
+    planner = UploadPlanner(include=["*.txt"], exclude=["sub/deep/*"], relative_path="run1", skip_empty=True)
+    plan = planner.plan(source, 1)
+    entries = by_path(plan)
+    assert sorted(entries) == ["a.txt", "b.log", "empty.txt", "link", "sub/c.txt", "sub/deep/d.txt"]
+
+    assert entries["a.txt"]['action'] == UPLOAD and entries["a.txt"]['relative_path'] == "run1"
+    assert entries["sub/c.txt"]['action'] == UPLOAD and entries["sub/c.txt"]['relative_path'] == "run1/sub"
+    assert (entries["b.log"]['action'], entries["b.log"]['reason']) == (SKIP, "filtered")
+    assert (entries["sub/deep/d.txt"]['action'], entries["sub/deep/d.txt"]['reason']) == (SKIP, "filtered")
+    assert (entries["empty.txt"]['action'], entries["empty.txt"]['reason']) == (SKIP, "empty")
+    assert (entries["link"]['action'], entries["link"]['reason']) == (SKIP, "symbolic link to a directory")
+    assert plan.num_files == 2 and plan.num_bytes == 9
+
+
+def test_symlinked_file_is_uploaded(source):
+    os.symlink(os.path.join(source, "a.txt"), os.path.join(source, "alias.txt"))
+    entries = by_path(UploadPlanner().plan(source, 1))
+    assert entries["alias.txt"]['action'] == UPLOAD and entries["alias.txt"]['size'] == 5
+
+
+def test_deduplicates_against_dataset(backend, api, source):
+    backend.route("GET", r"datasets/1", {'id': 1, 'dataset_files': [
+        {'name': "c.txt", 'relative_path': "/run1/sub/", 'file_length': 4},
+        {'name': "a.txt", 'relative_path': "run1", 'file_length': 999},
+        {'name': "sub", 'relative_path': "run1", 'is_directory': True}]})
+    plan = UploadPlanner(api, relative_path="run1").plan(source, 1)
+    entries = by_path(plan)
+    assert entries["sub/c.txt"]['action'] == DEDUPLICATE
+    # Same name but a different size is uploaded again
+    assert entries["a.txt"]['action'] == UPLOAD
+
+
+def test_eta_uses_measured_throughput(api, source):
+    for _ in range(5):
+        api.throughput.record(10 * 1024 ** 2, 1.0)
+    planner = UploadPlanner(api, deduplicate=False, upload_workers=2)
+    plan = planner.plan(source, 1)
+    assert plan.eta is not None and plan.eta >= 0
+
+
+def test_plan_round_trip(source, tmp_path):
+    plan = UploadPlanner().plan(source, 1)
+    path = str(tmp_path / "plan.json")
+    plan.save(path)
+    loaded = UploadPlan.load(path)
+    assert loaded.entries == plan.entries and loaded.dataset_id == 1
+
+
+def test_invalid_arguments(source):
+    with pytest.raises(TypeError):
+        UploadPlanner(include="*.txt")
+    with pytest.raises(ValueError):
+        UploadPlanner(upload_workers=0)
+    with pytest.raises(NotADirectoryError):
+        UploadPlanner().plan(os.path.join(source, "a.txt"), 1)
+
+
+def test_unreadable_directory_is_skipped(source, monkeypatch):
+    scandir = os.scandir
+    unreadable = os.path.join(source, "sub")
+
+    def deny(path):
+        if os.fspath(path) == unreadable:
+            raise PermissionError(errno.EACCES, "Permission denied", path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', deny)
+    entries = by_path(UploadPlanner().plan(source, 1))
+    assert entries["sub"]['action'] == SKIP and entries["sub"]['reason'].startswith("unreadable: ")
+    assert entries["a.txt"]['action'] == UPLOAD
+    assert "sub/c.txt" not in entries
+
+    stage = ScanStage()
+    assert sorted(item['path'] for item in stage.process(source)) == \
+        [os.path.join(source, name) for name in ["a.txt", "b.log", "empty.txt"]]
+    assert (unreadable, entries["sub"]['reason']) in stage.skipped
+    assert sorted(Manifest.build(source).entries) == ["a.txt", "b.log", "empty.txt"]
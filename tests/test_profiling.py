@@ -0,0 +1,96 @@
+import os
+import pstats
+import tracemalloc
+
+import pytest
+
+from ordflow.api import API
+from ordflow.backends import HTTPError
+from ordflow.profiling import Profiler
+
+
+@pytest.fixture
+def served(backend):
+    backend.route("GET", r"datasets/\d+", {'id': 1, 'dataset_files': []})
+    backend.route("GET", "instruments", [])
+    backend.route("POST", "datasets", lambda request: {'id': 2, 'name': request.json['name']})
+    return backend
+
+
+def test_attach_and_detach(api):
+    profiler = api.profile(trace_memory=False)
+    assert 'dataset_info' in vars(api) and '_API__get' in vars(api)
+    assert 'profile' not in vars(api)
+    with pytest.raises(RuntimeError):
+        profiler.attach(api)
+    profiler.detach()
+    assert not any(callable(value) for value in vars(api).values())
+    assert api.dataset_info.__func__ is API.dataset_info
+    # Detaching twice is harmless
+    profiler.detach()
+
+
+def test_counts_public_and_internal_calls(served, api):
+    with api.profile(trace_memory=False) as profiler:
+        api.dataset_info(1)
+        api.dataset_info(1)
+        api.dataset_create("Run 1", metadata={'sample': {'name': "PZT"}})
+    summary = profiler.summary()
+    assert summary['dataset_info']['calls'] == 2
+    assert summary['dataset_create']['calls'] == 1
+    # Name-mangled helpers are reported under their own names
+    assert summary['__get']['calls'] == 2 and summary['__post']['calls'] == 1
+    assert summary['__flatten_dict']['calls'] >= 1
+    assert 'instrument_list' not in summary
+    assert all(stats['wall'] >= stats['cpu'] >= 0 and stats['errors'] == 0 for stats in summary.values())
+
+
+def test_counts_errors(backend, api):
+    backend.route("GET", r"datasets/\d+", (404, {'error': 'no such dataset'}))
+    with api.profile(methods=['dataset_info', '__get'], trace_memory=False) as profiler:
+        with pytest.raises(HTTPError):
+            api.dataset_info(1)
+    summary = profiler.summary()
+    assert sorted(summary) == ['__get', 'dataset_info']
+    assert summary['dataset_info']['errors'] == 1 and summary['__get']['errors'] == 1
+
+
+def test_unknown_method(api):
+    with pytest.raises(ValueError):
+        Profiler(methods=['no_such_method']).attach(api)
+    with pytest.raises(TypeError):
+        Profiler(methods='dataset_info')
+
+
+def test_allocation_peak(served, api):
+    tracing = tracemalloc.is_tracing()
+    with api.profile(methods=['dataset_create']) as profiler:
+        api.dataset_create("Run 1", metadata={'values': list(range(10000))})
+    assert profiler.summary()['dataset_create']['alloc_peak'] > 10000
+    # tracemalloc is only stopped if the profiler started it
+    assert tracemalloc.is_tracing() == tracing
+
+
+def test_cprofile_dumps(served, api, tmp_path):
+    directory = str(tmp_path / "profiles")
+    with api.profile(methods=['dataset_info', '__get'], trace_memory=False, cprofile_dir=directory) as profiler:
+        api.dataset_info(1)
+    # Only the outermost profiled call runs cProfile
+    assert os.listdir(directory) == ['dataset_info.prof']
+    assert pstats.Stats(os.path.join(directory, 'dataset_info.prof')).total_calls > 0
+    assert set(profiler.hot_spots()) >= {'json encoding / decoding', 'network wait'}
+    assert 'hot spot (cProfile)' in profiler.report()
+
+
+def test_report_sorting(served, api):
+    with api.profile(methods=['dataset_info', 'instrument_list'], trace_memory=False) as profiler:
+        for _ in range(3):
+            api.instrument_list()
+        api.dataset_info(1)
+    profiler.stats['dataset_info'].wall = 10.0
+    lines = profiler.report(sort_by='calls').splitlines()
+    assert lines[0].split()[:2] == ['method', 'calls']
+    assert [line.split()[0] for line in lines[1:]] == ['instrument_list', 'dataset_info']
+    assert [line.split()[0] for line in profiler.report().splitlines()[1:]] == ['dataset_info', 'instrument_list']
+    with pytest.raises(ValueError):
+        profiler.report(sort_by='name')
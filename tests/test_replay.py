@@ -0,0 +1,40 @@
+import gzip
+
+import pytest
+
+from ordflow.api import API
+from ordflow.replay import REDACTED, RecordingBackend, ReplayBackend, endpoint, request_target
+
+
+def test_request_target_redacts_credentials():
+    target = request_target("https://dataflow.test/api/v1/transports/globus/activate"
+                            "?endpoint=abc&username=jdoe&myproxy_password=s3cr%26t&q=password")
+    assert target == "/api/v1/transports/globus/activate?endpoint=abc&username={0}&myproxy_password={0}" \
+                     "&q=password".format(REDACTED)
+
+
+def test_endpoint():
+    assert endpoint("/api/v1/datasets/12?x=1") == "/api/v1/datasets/{id}"
+
+
+def test_record_and_replay(backend, tmp_path):
+    backend.route("GET", r"datasets/\d+", lambda request: {'id': int(request.path.split('/')[-1])})
+    backend.route("POST", r"transports/globus/activate", {'code': 'Activated'})
+    recorder = RecordingBackend(backend)
+    api = API("secret-key", server_url=backend.server_url, backend=recorder)
+    assert api.dataset_info(3) == {'id': 3}
+    api.globus_endpoints_activate("jdoe", "s3cret", endpoint="abc")
+    path = str(tmp_path / "session.jsonl.gz")
+    recorder.recording.save(path)
+
+    with gzip.open(path, 'rt') as file_handle:
+        saved = file_handle.read()
+    assert "secret-key" not in saved and "s3cret" not in saved and "jdoe" not in saved
+
+    replay = ReplayBackend(path, time_scale=0)
+    api = API("other-key", server_url="https://elsewhere.test/api/v1", backend=replay)
+    assert api.dataset_info(3) == {'id': 3}
+    # Matched although the credentials differ, since only their redacted form is compared
+    assert api.globus_endpoints_activate("other", "password", endpoint="abc") == {'code': 'Activated'}
+    with pytest.raises(LookupError):
+        api.dataset_info(4)
@@ -0,0 +1,107 @@
+import pytest
+
+from conftest import StubBackend
+from ordflow.backends import HTTPError
+from ordflow.routing import MultiServerAPI
+
+
+PRIMARY_URL = "http://primary.test/api/v1"
+MIRROR_URL = "http://mirror.test/api/v1"
+
+
+@pytest.fixture
+def servers():
+    return [StubBackend(server_url=PRIMARY_URL), StubBackend(server_url=MIRROR_URL)]
+
+
+@pytest.fixture
+def multi(servers):
+    multi = MultiServerAPI("secret-key", [PRIMARY_URL, MIRROR_URL], max_failures=2, cooldown=30,
+                           probe_interval=60)
+    for api, backend in zip(multi.apis, servers):
+        api.backend = backend
+    return multi
+
+
+def search_results(request):
+    return {'results': [{'id': int(request.query['dataset_id']) * 10}]}
+
+
+def test_5xx_fails_over_and_demotes(servers, multi):
+    primary, mirror = servers
+    primary.route("GET", r"datasets/\d+", (500, {'error': 'internal'}))
+    mirror.route("GET", r"datasets/\d+", {'id': 1, 'server': 'mirror'})
+
+    assert multi.dataset_info(1)['server'] == 'mirror'
+    decision = multi.last_decision
+    assert decision['server'] == MIRROR_URL and decision['failovers'] == 1
+    assert multi.health[0].failures == 1
+    assert multi.ranking()[0] == 1
+
+    for _ in range(5):
+        assert multi.dataset_info(1)['server'] == 'mirror'
+    # The failing primary is not tried again while the mirror keeps serving
+    assert len(primary.calls("GET")) == 1
+    assert len(mirror.calls("GET")) == 6
+
+
+def test_rejection_is_not_penalized(servers, multi):
+    primary, mirror = servers
+    primary.route("GET", r"datasets/\d+", (404, {'error': 'no such dataset'}))
+    mirror.route("GET", r"datasets/\d+", {'id': 1, 'server': 'mirror'})
+
+    # A lagging server may not know the dataset yet
+    assert multi.dataset_info(1)['server'] == 'mirror'
+    assert multi.health[0].failures == 0
+
+
+def test_raises_rejection_when_all_fail(servers, multi):
+    primary, mirror = servers
+    primary.route("GET", r"datasets/\d+", (404, {'error': 'no such dataset'}))
+    mirror.route("GET", r"datasets/\d+", (503, {'error': 'maintenance'}))
+
+    with pytest.raises(HTTPError) as exc_info:
+        multi.dataset_info(1)
+    assert exc_info.value.status_code == 404
+    assert multi.last_decision['server'] is None
+
+
+def test_writes_stay_on_primary(servers, multi):
+    primary, mirror = servers
+    primary.route("POST", "datasets", (503, {'error': 'maintenance'}))
+    mirror.route("POST", "datasets", {'id': 1})
+
+    with pytest.raises(HTTPError):
+        multi.dataset_create("Run 1")
+    assert not mirror.calls()
+
+
+def test_files_search_many_routes_each_query(servers, multi):
+    primary, mirror = servers
+    primary.route("GET", "dataset-files/search", (502, {'error': 'bad gateway'}))
+    mirror.route("GET", "dataset-files/search", search_results)
+
+    merged = multi.files_search_many("scan", [1, 2, 3], max_workers=1)
+    assert not merged['failed']
+    assert sorted(hit['id'] for hit in merged['results']) == [10, 20, 30]
+    assert len(mirror.calls("GET")) == 3
+    assert multi.decisions[-1]['method'] == 'files_search'
+
+
+def test_unmeasured_servers_are_probed(servers, multi):
+    primary, mirror = servers
+    for backend in servers:
+        backend.route("GET", "instruments", [])
+    assert multi.score(0) == multi.score(1) == 0.0
+    multi.instrument_list()
+    multi.instrument_list()
+    # The primary was measured, so the unmeasured mirror gets tried next
+    assert len(primary.calls()) == 1 and len(mirror.calls()) == 1
+
+
+def test_files_search_many_validates_arguments(servers, multi):
+    with pytest.raises(TypeError):
+        multi.files_search_many("scan", "1")
+    with pytest.raises(ValueError):
+        multi.files_search_many("scan", [1], max_workers=0)
+    assert not any(backend.calls() for backend in servers)
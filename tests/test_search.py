@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+
+SEARCH = "dataset-files/search"
+
+
+def hits(*ids, **kwargs):
+    return dict({'results': [{'id': file_id, 'name': "file_{}".format(file_id)} for file_id in ids]}, **kwargs)
+
+
+def by_dataset(responses):
+    return lambda request: responses[int(request.query['dataset_id'])]
+
+
+def test_merges_and_deduplicates(backend, api):
+    backend.route("GET", SEARCH, by_dataset({1: hits(1, 2), 2: hits(2, 3), 3: [{'name': "x"}, {'name': "x"}]}))
+    merged = api.files_search_many("scan", [1, 2, 3])
+    assert sorted(hit.get('id', 0) for hit in merged['results']) == [0, 1, 2, 3]
+    assert merged['total'] == 4 and not merged['has_more'] and merged['failed'] == {}
+    assert sorted(request.query['q'] for request in backend.calls()) == ["scan"] * 3
+
+
+def test_failed_datasets_are_reported(backend, api):
+    backend.route("GET", SEARCH, by_dataset({1: hits(1), 2: (404, {'error': 'no such dataset'}),
+                                             3: (500, {'error': 'internal'})}))
+    merged = api.files_search_many("scan", [1, 2, 3])
+    assert merged['total'] == 1
+    assert sorted(merged['failed']) == [2, 3] and "Not Found" in merged['failed'][2]
+
+
+def test_has_more_is_passed_on(backend, api):
+    backend.route("GET", SEARCH, by_dataset({1: hits(1), 2: hits(2, has_more=True)}))
+    assert api.files_search_many("scan", [1, 2])['has_more']
+
+
+def test_max_hits_stops_early(backend, api):
+    backend.route("GET", SEARCH, lambda request: hits(*[int(request.query['dataset_id']) * 10 + index
+                                                        for index in range(3)]))
+    merged = api.files_search_many("scan", list(range(1, 21)), max_workers=1, max_hits=2)
+    assert merged['total'] == 2 and merged['has_more']
+    # Queries that had not started are abandoned
+    assert len(backend.calls()) < 5
+
+
+def test_deadline(backend, api):
+    release = threading.Event()
+
+    def search(request):
+        if request.query['dataset_id'] == "2":
+            release.wait(5)
+        return hits(int(request.query['dataset_id']))
+
+    backend.route("GET", SEARCH, search)
+    t_start = time.time()
+    try:
+        merged = api.files_search_many("scan", [1, 2], timeout=0.2)
+    finally:
+        release.set()
+    assert time.time() - t_start < 2
+    assert [hit['id'] for hit in merged['results']] == [1]
+    assert merged['has_more'] and not merged['failed']
+
+
+@pytest.mark.parametrize("args, kwargs, error", [
+    (("", [1]), {}, ValueError),
+    (("scan", 1), {}, TypeError),
+    (("scan", [1.5]), {}, TypeError),
+    (("scan", [-1]), {}, ValueError),
+    (("scan", [1]), {'max_workers': 0}, ValueError),
+    (("scan", [1]), {'max_hits': 0}, ValueError),
+])
+def test_invalid_arguments(backend, api, args, kwargs, error):
+    with pytest.raises(error):
+        api.files_search_many(*args, **kwargs)
+    assert not backend.calls()
@@ -0,0 +1,121 @@
+import pytest
+
+from ordflow.tracking import DONE, FAILED, PENDING, TransferTracker, transfer_state
+
+
+DATASET = r"datasets/\d+"
+
+
+def listing(*files):
+    return {'id': 1, 'dataset_files': [dict(relative_path=None, is_directory=False, **item) for item in files]}
+
+
+@pytest.fixture
+def tracker(api):
+    tracker = TransferTracker(api, min_interval=0.01, max_interval=0.05, jitter=0, max_errors=3)
+    yield tracker
+    tracker.stop()
+
+
+@pytest.mark.parametrize("item, state", [
+    ({'transfer_status': 'Succeeded'}, DONE),
+    ({'status': 'completed'}, DONE),
+    ({'state': 'FAILED'}, FAILED),
+    ({'transfer_status': 'active'}, PENDING),
+    ({'transfer_status': None, 'status': 'done'}, DONE),
+])
+def test_transfer_state(item, state):
+    assert transfer_state(item) == state
+
+
+def test_missing_status_warns():
+    with pytest.warns(RuntimeWarning):
+        assert transfer_state({'name': 'scan.txt'}) == PENDING
+
+
+def test_one_query_per_dataset(backend, tracker):
+    backend.route("GET", DATASET, listing(*[{'name': 'scan_{}.txt'.format(index), 'transfer_status': 'active'}
+                                            for index in range(5)]))
+    for index in range(5):
+        tracker.watch_file(1, 'scan_{}.txt'.format(index))
+    assert tracker.poll() == 5
+    assert len(backend.calls("GET")) == 1
+
+    backend.route("GET", DATASET, listing(*[{'name': 'scan_{}.txt'.format(index), 'transfer_status': 'succeeded'}
+                                            for index in range(5)]))
+    report = tracker.wait_all(timeout=2)
+    assert len(report[DONE]) == 5 and not report[PENDING]
+
+
+def test_failed_transfer(backend, tracker):
+    backend.route("GET", DATASET, listing({'name': 'scan.txt', 'transfer_status': 'failed'}))
+    transfer = tracker.watch_file(1, 'scan.txt')
+    tracker.poll()
+    assert transfer.state == FAILED
+    with pytest.raises(RuntimeError):
+        transfer.future.result(timeout=0)
+
+
+def test_raising_classify_fails_transfers(backend, api):
+    def classify(item):
+        raise KeyError('transfer_status')
+
+    backend.route("GET", DATASET, listing({'name': 'scan.txt'}))
+    tracker = TransferTracker(api, min_interval=0.01, max_interval=0.05, classify=classify)
+    try:
+        transfer = tracker.watch_file(1, 'scan.txt')
+        report = tracker.wait_all(timeout=2)
+    finally:
+        tracker.stop()
+    assert report[FAILED] == [transfer]
+    assert isinstance(transfer.future.exception(), KeyError)
+
+
+def test_malformed_response_fails_transfers(backend, tracker):
+    backend.route("GET", DATASET, ['not', 'a', 'dataset'])
+    tracker.watch_dataset(1)
+    report = tracker.wait_all(timeout=2)
+    assert len(report[FAILED]) == 1 and not report[PENDING]
+
+
+def test_rejected_query_fails_right_away(backend, tracker):
+    backend.route("GET", DATASET, (404, {'error': 'no such dataset'}))
+    transfer = tracker.watch_file(1, 'scan.txt')
+    tracker.poll()
+    assert transfer.state == FAILED
+    assert len(backend.calls("GET")) == 1
+
+
+def test_transient_errors_are_retried(backend, tracker):
+    statuses = [503, 502]
+
+    def dataset_info(request):
+        if statuses:
+            return statuses.pop(0), {'error': 'unavailable'}
+        return listing({'name': 'scan.txt', 'transfer_status': 'succeeded'})
+
+    backend.route("GET", DATASET, dataset_info)
+    transfer = tracker.watch_file(1, 'scan.txt')
+    for _ in range(3):
+        tracker.poll()
+    assert transfer.state == DONE
+    assert len(backend.calls("GET")) == 3
+
+
+def test_transient_errors_fail_after_max_errors(backend, tracker):
+    backend.route("GET", DATASET, (503, {'error': 'maintenance'}))
+    transfer = tracker.watch_file(1, 'scan.txt')
+    for _ in range(2):
+        tracker.poll()
+    assert transfer.state == PENDING
+    tracker.poll()
+    assert transfer.state == FAILED
+    assert tracker.poll() == 0
+
+
+def test_timeout(backend, tracker):
+    backend.route("GET", DATASET, listing({'name': 'scan.txt', 'transfer_status': 'active'}))
+    transfer = tracker.watch_file(1, 'scan.txt', timeout=0.1)
+    report = tracker.wait_all(timeout=2)
+    assert report[FAILED] == [transfer]
+    assert isinstance(transfer.future.exception(), TimeoutError)